@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Benchmark summarizing spot price histories."""
+import random
+import datetime
+
+from harness import timed
+
+from sparksteps.pricing import get_zone_profile, price_by_zone
+
+ZONES = ['us-east-1{}'.format(z) for z in 'abcdef']
+HISTORY_SIZES = [1000, 10000, 100000]
+
+
+def synthetic_history(size, seed=0):
+    """Returns `size` spot price records spread over ZONES, in the format of `describe_spot_price_history`."""
+    rng = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1)
+    return [{'AvailabilityZone': rng.choice(ZONES),
+             'Timestamp': start + datetime.timedelta(seconds=i),
+             'SpotPrice': '{:.4f}'.format(rng.uniform(0.05, 0.5)),
+             'InstanceType': 'm5.xlarge',
+             'ProductDescription': 'Linux/UNIX'}
+            for i in range(size)]
+
+
+def bench_zone_profile(quick=False):
+    results = []
+    for size in HISTORY_SIZES[:2] if quick else HISTORY_SIZES:
+        history = synthetic_history(size)
+        by_zone = price_by_zone(history)
+        results.append({'name': 'price_by_zone', 'params': {'records': size},
+                        'metrics': timed(lambda: price_by_zone(history))})
+        results.append({'name': 'get_zone_profile', 'params': {'records': size},
+                        'metrics': timed(lambda: get_zone_profile(by_zone))})
+    return results
+
+
+BENCHMARKS = [bench_zone_profile]
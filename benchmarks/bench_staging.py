@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Benchmark zipping directories to S3 and building the steps of an app."""
+import os
+import shutil
+import tempfile
+
+from harness import LocalS3, make_tree, peak_memory, timed
+
+from sparksteps.steps import setup_steps, zip_to_s3
+
+# (number of files, bytes per file)
+ZIP_TREES = [(10, 1024 * 1024), (100, 100 * 1024), (1000, 10 * 1024), (100, 1024 * 1024)]
+UPLOAD_COUNTS = [1, 10, 100]
+
+
+def bench_zip_to_s3(quick=False):
+    results = []
+    for num_files, file_size in ZIP_TREES[:2] if quick else ZIP_TREES:
+        root = tempfile.mkdtemp()
+        try:
+            make_tree(os.path.join(root, 'lib'), num_files, file_size)
+            s3 = LocalS3()
+
+            def run():
+                zip_to_s3(s3, os.path.join(root, 'lib'), 'bucket', 'sparksteps/sources/lib.zip')
+
+            metrics = timed(run, repeat=3)
+            total_bytes = num_files * file_size
+            metrics['throughput_mb_s'] = total_bytes / 1024 / 1024 / metrics['median_s']
+            metrics['peak_memory_mb'] = peak_memory(run) / 1024 / 1024
+            results.append({'name': 'zip_to_s3',
+                            'params': {'files': num_files, 'file_bytes': file_size, 'total_mb': total_bytes >> 20},
+                            'metrics': metrics})
+        finally:
+            shutil.rmtree(root)
+    return results
+
+
+def bench_setup_steps(quick=False):
+    results = []
+    for num_uploads in UPLOAD_COUNTS[:2] if quick else UPLOAD_COUNTS:
+        root = tempfile.mkdtemp()
+        try:
+            uploads = []
+            for i in range(num_uploads):
+                path = os.path.join(root, 'lib{}.py'.format(i))
+                with open(path, 'wb') as f:
+                    f.write(os.urandom(10 * 1024))
+                uploads.append(path)
+            app = os.path.join(root, 'app.py')
+            open(app, 'w').close()
+            s3 = LocalS3()
+            metrics = timed(lambda: setup_steps(s3, 'bucket', 'sparksteps', app, uploads=list(uploads)), repeat=5)
+            metrics['per_upload_ms'] = metrics['median_s'] * 1000 / num_uploads
+            results.append({'name': 'setup_steps', 'params': {'uploads': num_uploads}, 'metrics': metrics})
+        finally:
+            shutil.rmtree(root)
+    return results
+
+
+BENCHMARKS = [bench_zip_to_s3, bench_setup_steps]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Helpers shared by the benchmarks."""
+import os
+import time
+import statistics
+import tracemalloc
+
+
+def timed(func, repeat=5, setup=None):
+    """
+    Runs `func` `repeat` times, calling `setup` before each run, and returns
+    the median and minimum wall clock time in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {'median_s': statistics.median(timings), 'min_s': min(timings)}
+
+
+def peak_memory(func):
+    """Returns the peak memory in bytes allocated by Python while running `func`."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def make_tree(root, num_files, file_size):
+    """Creates `num_files` files of `file_size` random bytes below `root`, 100 per directory."""
+    for i in range(num_files):
+        directory = os.path.join(root, 'd{}'.format(i // 100))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'f{}.bin'.format(i)), 'wb') as f:
+            f.write(os.urandom(file_size))
+    return root
+
+
+class LocalS3(object):
+    """
+    Stand-in for a boto3 S3 resource which reads uploaded bodies and files
+    without storing them, so that benchmarks measure sparksteps rather than S3.
+    """
+    def __init__(self):
+        self.meta = self
+        self.client = self
+        self.bytes_uploaded = 0
+
+    def Bucket(self, name):
+        return self
+
+    def put_object(self, Key, Body):
+        for chunk in iter(lambda: Body.read(1024 * 1024), b''):
+            self.bytes_uploaded += len(chunk)
+        return {'Key': Key}
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, 'rb') as f:
+            self.put_object(Key, f)
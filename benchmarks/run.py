@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Run the sparksteps benchmarks and store the results as JSON.
+
+Usage:
+    python benchmarks/run.py [--quick] [--filter NAME] [--output FILE] [--compare BASELINE] [--threshold 0.2]
+
+Staging benchmarks upload to a local stand-in for S3, so that no AWS
+credentials are required and only the work done by sparksteps is measured.
+With `--compare`, the median times are compared to those of a previous run
+and the run fails when any of them regressed by more than `--threshold`.
+"""
+import os
+import sys
+import json
+import platform
+import argparse
+import datetime
+import subprocess
+
+# Benchmark the working tree rather than an installed version of sparksteps.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bench_pricing  # noqa: E402
+import bench_staging  # noqa: E402
+import startup  # noqa: E402
+
+MODULES = [bench_staging, bench_pricing, startup]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=startup.ROOT,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+    """Prints the change of every median time relative to `baseline` and returns the regressed benchmarks."""
+    previous = {result_key(r): r['metrics']['median_s'] for r in baseline['results']}
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in previous:
+            continue
+        change = result['metrics']['median_s'] / previous[key] - 1
+        print('{:<18} {:<60} {:>+7.1%}'.format(key[0], key[1], change))
+        if change > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='run the smaller cases only')
+    parser.add_argument('--filter', help='only run benchmarks whose function name contains FILTER')
+    parser.add_argument('--output', help='file to write the results to')
+    parser.add_argument('--compare', help='results of a previous run to compare to')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+    for module in MODULES:
+        for benchmark in module.BENCHMARKS:
+            if args.filter and args.filter not in benchmark.__name__:
+                continue
+            print('Running {}...'.format(benchmark.__name__), file=sys.stderr)
+            results.extend(benchmark(quick=args.quick))
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit('{} benchmarks regressed by more than {:.0%}.'.format(len(regressions), args.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the startup time of the sparksteps CLI.
+
+Usage:
+    python benchmarks/startup.py [--repeat N] [--max-seconds S]
+
+Exits with a non-zero status when the median time of a command exceeds
+`--max-seconds`, so the benchmark can guard against startup regressions.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+APP = os.path.join(ROOT, 'examples', 'episodes.py')
+COMMANDS = {
+    'import': [sys.executable, '-c', 'import sparksteps.__main__'],
+    'help': [sys.executable, '-m', 'sparksteps', '--help'],
+    'dry-run': [sys.executable, '-m', 'sparksteps', APP, '--s3-bucket', 'bucket', '--aws-region', 'us-east-1',
+                '--release-label', 'emr-6.2.0', '--num-core', '2', '--instance-type-core', 'm5.xlarge', '--dry-run'],
+}
+
+
+def time_command(command, repeat):
+    """Returns the wall clock time of `repeat` runs of `command` in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_startup(quick=False):
+    repeat = 3 if quick else 10
+    baseline = statistics.median(time_command([sys.executable, '-c', 'pass'], repeat))
+    results = []
+    for name, command in COMMANDS.items():
+        timings = time_command(command, repeat)
+        results.append({'name': 'startup', 'params': {'command': name},
+                        'metrics': {'median_s': statistics.median(timings), 'min_s': min(timings),
+                                    'over_interpreter_s': statistics.median(timings) - baseline}})
+    return results
+
+
+BENCHMARKS = [bench_startup]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_command([sys.executable, '-c', 'pass'], args.repeat))
+    print('{:<10} {:>10} {:>10}'.format('command', 'median', 'min'))
+    print('{:<10} {:>9.3f}s {:>10}'.format('python', baseline, ''))
+    slow = []
+    for name, command in COMMANDS.items():
+        timings = time_command(command, args.repeat)
+        median = statistics.median(timings)
+        print('{:<10} {:>9.3f}s {:>9.3f}s'.format(name, median, min(timings)))
+        if args.max_seconds is not None and median > args.max_seconds:
+            slow.append(name)
+    if slow:
+        sys.exit('Startup of {} exceeded {}s.'.format(', '.join(slow), args.max_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -30,7 +30,10 @@ setup(
     zip_safe=False,
     entry_points={
         'console_scripts': [
-            'sparksteps=sparksteps.__main__:main'
+            'sparksteps=sparksteps.__main__:main',
+            'sparksteps-server=sparksteps.server:main',
+            'sparksteps-history=sparksteps.history:main',
+            'sparksteps-gc=sparksteps.gc:main'
         ]
     },
     classifiers=textwrap.dedent("""
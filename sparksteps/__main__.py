@@ -3,14 +3,31 @@
 """Create Spark cluster on EMR.
 
 Prompt parameters:
-  app                           main spark script for submit spark (required)
+  app                           main spark script for submit spark (required unless pipeline is set)
   app-args:                     arguments passed to main spark script
   app-list:                     Applications to be installed on the EMR cluster (Default: Hadoop Spark)
+  app-spec:                     additional app to run concurrently: "FILE --submit-args=... --app-args=..."
+  auto-tune:                    derive spark-defaults executor settings from the core and task instance types
+  autoscale-min:                minimum number of task nodes when autoscaling the task group (default=0)
+  autoscale-max:                autoscale the task group from YARN metrics while waiting, up to this many nodes
+  autoscale-cooldown:           seconds to wait after resizing the task group before resizing it again (default=300)
   aws-region:                   AWS region name
+  backend:                      where to run the steps (supported: [emr, local], default=emr)
   bid-price:                    specify bid price for task nodes
   bootstrap-script:             include a bootstrap script (s3 path)
+  bootstrap-cache-paths:        absolute paths written by the bootstrap script, cached in S3 for later clusters
+  bootstrap-inputs:             files read by the bootstrap script, part of the key of its cached result
+  cache:                        skip the app if its code, dependencies, arguments and inputs did not change
   cluster-id:                   job flow id of existing cluster to submit to
+  compact-src:                  output of the app to compact with an S3DistCp step after the app
+  compact-dest:                 destination of the compacted files
+  compact-sample:               S3 URI of existing output to sample file names and sizes from, required with compact-src
+  compact-target-size:          size of the compacted files in MiB (default=256)
+  compact-codec:                compression codec of the compacted files (default: that of the sampled files)
   debug:                        allow debugging of cluster
+  dry-run:                      print the cluster configuration and steps as JSON without calling AWS
+  resume:                       journal the run and resume the previous attempt of the same run from its journal
+  journal:                      journal the progress of the run at this path
   defaults:                     cluster configurations of the form "<classification1> key1=val1 key2=val2 ..."
   dynamic-pricing-master:       use spot pricing for the master nodes.
   dynamic-pricing-core:         use spot pricing for the core nodes.
@@ -24,26 +41,53 @@ Prompt parameters:
   ebs-volumes-per-task:         the number of EBS volumes to attach per task node.
   ebs-optimized-task:           whether to use EBS optimized volumes for task nodes.
   ec2-key:                      name of the Amazon EC2 key pair
+  event-log:                    write the Spark event log to s3-path and report on its stages once the app completes
   ec2-subnet-id:                Amazon VPC subnet id
   help (-h):                    argparse help
+  history:                      SQLite database to record the run in and pace polling by (default: not recorded)
+  inputs:                       S3 URIs read by the app, part of its cache key
+  idle-timeout:                 terminate the cluster after it has been idle for this many seconds
   jobflow-role:                 Amazon EC2 instance profile name to use (Default: EMR_EC2_DefaultRole)
   service-role:                 AWS IAM service role to use for EMR (Default: EMR_DefaultRole)
+  skip-preflight:               do not check the S3 inputs, uploads and bucket access before launching
+  size-from-inputs:             derive node counts and Spark partitions from the size of the inputs
+  size-max-nodes:               maximum number of nodes when sizing from inputs (default=20)
+  step-concurrency-level:       number of steps the cluster may run concurrently
   keep-alive:                   whether to keep the EMR cluster alive when there are no steps
+  local-dir:                    directory files are staged to and apps run in with the local backend
   log-level (-l):               logging level (default=INFO)
+  managed-scaling-min:          minimum number of core and task units when using EMR managed scaling
+  managed-scaling-max:          maximum number of core and task units when using EMR managed scaling
+  managed-scaling-max-on-demand: maximum number of on-demand units when using EMR managed scaling
+  managed-scaling-max-core:     maximum number of core units when using EMR managed scaling
+  managed-scaling-unit-type:    unit of the managed scaling limits (supported: [Instances, VCPU], default=Instances)
+  max-cost:                     terminate the cluster once its accrued cost exceeds this many USD while waiting
+  max-runtime:                  terminate the cluster once it has been waited for longer than this many seconds
+  max-recoveries:               number of times to recover from steps failing because instances were lost (default=0)
   instance-type-master:         instance type of of master host (default='m4.large')
   instance-type-core:           instance type of the core nodes, must be set when num-core > 0
   instance-type-task:           instance type of the task nodes, must be set when num-task > 0
   maximize-resource-allocation: sets the maximizeResourceAllocation property for the cluster to true when supplied.
   name:                         specify cluster name
+  num-clusters:                 number of clusters to launch for a pipeline or sweep (default=1)
   num-core:                     number of core nodes
   num-task:                     number of task nodes
+  outputs:                      S3 URIs written by the app, checked to be writable and to exist to skip it when cached
+  pipeline:                     JSON file describing a pipeline of dependent apps to run instead of app
   release-label:                EMR release label
+  sample-utilization:           sample cluster utilization while waiting and recommend a size for the workers
   s3-bucket:                    name of s3 bucket to upload spark file (required)
+  spark-home:                   Spark installation used by the local backend (default=$SPARK_HOME)
   s3-path:                      path (key prefix) within s3-bucket to use when uploading spark file
   s3-dist-cp:                   s3-dist-cp step after spark job is done
   submit-args:                  arguments passed to spark-submit
+  sweep-args:                   app-args variant to run app with, may be repeated to run a parameter sweep
+  sweep-file:                   file with an app-args variant per line to run app with
   tags:                         EMR cluster tags of the form "key1=value1 key2=value2"
   uploads:                      files to upload to /home/hadoop/ in master instance
+  utilization-interval:         seconds between utilization samples (default=60)
+  utilization-out:              JSON file to write the sampled utilization to
+  utilization-source:           where to sample utilization from (supported: [cloudwatch, yarn], default=cloudwatch)
   wait:                         poll until all steps are complete (or error)
 
 Examples:
@@ -61,56 +105,132 @@ Examples:
 """
 from __future__ import print_function
 
+import os
 import json
+import time
 import shlex
 import logging
 import argparse
-
-import boto3
+import functools
 
 from sparksteps import steps
 from sparksteps import cluster
+from sparksteps import launcher
+from sparksteps import pipeline
+from sparksteps import submit
+from sparksteps import recovery
+from sparksteps import autoscale
+from sparksteps import bootstrap
+from sparksteps import budget
+from sparksteps import local
+from sparksteps import sizing
+from sparksteps import preflight
+from sparksteps import compaction
+from sparksteps import eventlog
 from sparksteps import pricing
+from sparksteps import utilization
+from sparksteps.cache import StepCache
+from sparksteps.session import Session
+from sparksteps.journal import Journal, default_journal_path
+from sparksteps.history import History, app_hash, hourly_price, instance_groups
 from sparksteps.cluster import DEFAULT_APP_LIST, DEFAULT_JOBFLOW_ROLE, DEFAULT_SERVICE_ROLE
-from sparksteps.poll import wait_for_step_complete
+from sparksteps.poll import (
+    FAILED_STATE, get_step_timings, log_step_timings, wait_for_step_complete, wait_for_steps_complete
+)
 
 logger = logging.getLogger(__name__)
 LOGFORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
 DEFAULT_SLEEP_INTERVAL_SECONDS = 150
 
 
+def parse_app_spec(raw_spec):
+    """
+    Parses an additional app of the form "FILE --submit-args='...' --app-args='...'".
+
+    Examples:
+        >>> parse_app_spec("job.py --app-args='--date 2020-01-01'")
+        App(path='job.py', submit_args=None, app_args=['--date', '2020-01-01'])
+    """
+    parser = argparse.ArgumentParser(prog='--app-spec', add_help=False)
+    parser.add_argument('app', metavar='FILE', nargs='?')
+    parser.add_argument('--submit-args', type=shlex.split)
+    parser.add_argument('--app-args', type=shlex.split)
+    try:
+        args = parser.parse_args(shlex.split(raw_spec))
+    except SystemExit:
+        raise argparse.ArgumentTypeError('invalid app spec: {}'.format(raw_spec))
+    return steps.App(args.app, args.submit_args, args.app_args)
+
+
 def create_parser():
     parser = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
 
-    parser.add_argument('app', metavar='FILE')
+    parser.add_argument('app', metavar='FILE', nargs='?')
     parser.add_argument('--app-args', type=shlex.split)
     parser.add_argument('--app-list', nargs='*', default=DEFAULT_APP_LIST)
+    parser.add_argument('--app-spec', type=parse_app_spec, action='append')
+    parser.add_argument('--autoscale-min', type=int, default=0)
+    parser.add_argument('--autoscale-max', type=int)
+    parser.add_argument('--autoscale-cooldown', type=int, default=autoscale.DEFAULT_COOLDOWN_SECONDS)
     parser.add_argument('--aws-region', required=True)
+    parser.add_argument('--backend', choices=('emr', 'local'), default='emr')
     parser.add_argument('--bid-price')
     parser.add_argument('--bootstrap-script')
+    parser.add_argument('--bootstrap-cache-paths', nargs='+')
+    parser.add_argument('--bootstrap-inputs', nargs='+')
+    parser.add_argument('--cache', action='store_true')
+    parser.add_argument('--inputs', nargs='*')
+    parser.add_argument('--outputs', nargs='*')
     parser.add_argument('--cluster-id')
+    parser.add_argument('--compact-src')
+    parser.add_argument('--compact-dest')
+    parser.add_argument('--compact-sample')
+    parser.add_argument('--compact-target-size', type=int, default=compaction.DEFAULT_TARGET_SIZE_MB)
+    parser.add_argument('--compact-codec', choices=('gzip', 'lzo', 'snappy', 'none', 'keep'))
     parser.add_argument('--debug', action='store_true')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--journal')
     parser.add_argument('--defaults', nargs='*')
     parser.add_argument('--ec2-key')
+    parser.add_argument('--event-log', action='store_true')
+    parser.add_argument('--history')
     parser.add_argument('--ec2-subnet-id')
     parser.add_argument('--jobflow-role', default=DEFAULT_JOBFLOW_ROLE)
     parser.add_argument('--service-role', default=DEFAULT_SERVICE_ROLE)
+    parser.add_argument('--skip-preflight', action='store_true')
+    parser.add_argument('--size-from-inputs', action='store_true')
+    parser.add_argument('--size-max-nodes', type=int, default=sizing.DEFAULT_MAX_NODES)
+    parser.add_argument('--step-concurrency-level', type=int)
     parser.add_argument('--keep-alive', action='store_true')
+    parser.add_argument('--local-dir', default=local.DEFAULT_LOCAL_DIR)
+    parser.add_argument('--spark-home', default=os.environ.get('SPARK_HOME'))
     parser.add_argument('--log-level', '-l', type=str.upper, default='INFO')
     parser.add_argument('--name')
+    parser.add_argument('--max-cost', type=float)
+    parser.add_argument('--max-runtime', type=int)
     parser.add_argument('--num-core', type=int)
     parser.add_argument('--num-task', type=int)
+    parser.add_argument('--num-clusters', type=int, default=1)
+    parser.add_argument('--pipeline')
     parser.add_argument('--release-label', required=True)
+    parser.add_argument('--sample-utilization', action='store_true')
+    parser.add_argument('--utilization-interval', type=int, default=utilization.DEFAULT_SAMPLE_INTERVAL_SECONDS)
+    parser.add_argument('--utilization-out')
+    parser.add_argument('--utilization-source', choices=('cloudwatch', 'yarn'), default='cloudwatch')
     parser.add_argument('--s3-bucket', required=True)
     parser.add_argument('--s3-path', default='sparksteps/')
     parser.add_argument('--s3-dist-cp', type=shlex.split)
     parser.add_argument('--submit-args', type=shlex.split)
+    parser.add_argument('--sweep-args', type=shlex.split, action='append')
+    parser.add_argument('--sweep-file')
     parser.add_argument('--tags', nargs='*')
     parser.add_argument('--uploads', nargs='*')
     parser.add_argument('--maximize-resource-allocation', action='store_true')
+    parser.add_argument('--auto-tune', action='store_true')
     # TODO: wrap lines below in a for loop?
     parser.add_argument('--instance-type-master', default='m4.large')
     parser.add_argument('--instance-type-core')
@@ -130,6 +250,15 @@ def create_parser():
     parser.add_argument('--ebs-volumes-per-task', type=int, default=1)
     parser.add_argument('--ebs-optimized-task', action='store_true')
 
+    # Managed scaling and auto-termination configuration
+    parser.add_argument('--managed-scaling-min', type=int)
+    parser.add_argument('--managed-scaling-max', type=int)
+    parser.add_argument('--managed-scaling-max-on-demand', type=int)
+    parser.add_argument('--managed-scaling-max-core', type=int)
+    parser.add_argument('--managed-scaling-unit-type', choices=('Instances', 'VCPU'), default='Instances')
+    parser.add_argument('--idle-timeout', type=int)
+    parser.add_argument('--max-recoveries', type=int, default=0)
+
     # Wait configuration
     parser.add_argument('--wait', type=int, nargs='?', default=False)
 
@@ -147,6 +276,9 @@ def parse_cli_args(parser, args=None):
     """
     args = vars(parser.parse_args(args))
 
+    if not args['app'] and not args['pipeline']:
+        parser.error('either app or --pipeline is required')
+
     # Perform sanitization on any arguments
     if args['s3_path'] and args['s3_path'].startswith('/'):
         raise ValueError(
@@ -155,104 +287,610 @@ def parse_cli_args(parser, args=None):
     if args['wait'] is None:
         args['wait'] = DEFAULT_SLEEP_INTERVAL_SECONDS
 
+    if args['app_spec'] and args['s3_dist_cp']:
+        raise ValueError("s3-dist-cp cannot be combined with app-spec as apps may run concurrently.")
+
+    if args['pipeline'] and (args['app'] or args['app_spec'] or args['s3_dist_cp']):
+        raise ValueError("pipeline cannot be combined with app, app-spec or s3-dist-cp.")
+
+    if bool(args['compact_src']) != bool(args['compact_dest']):
+        raise ValueError("compact-src and compact-dest must be set together.")
+
+    if args['compact_src'] and not (args['compact_sample'] or '').startswith('s3://'):
+        # The output of the app does not exist before it ran, the step is planned before submitting it.
+        raise ValueError("compact-src requires compact-sample, the S3 URI of existing output shaped like that of "
+                         "the app, e.g. the output of a previous run.")
+
+    if args['compact_src'] and (args['pipeline'] or args['app_spec'] or args['sweep_args']):
+        raise ValueError("compact-src can only be used with a single app.")
+
+    if args['sweep_file']:
+        with open(args['sweep_file']) as f:
+            variants = [shlex.split(line) for line in f if line.strip() and not line.startswith('#')]
+        args['sweep_args'] = (args['sweep_args'] or []) + variants
+
+    if args['sweep_args'] and (args['pipeline'] or args['app_spec'] or args['s3_dist_cp']):
+        raise ValueError("sweep-args cannot be combined with pipeline, app-spec or s3-dist-cp.")
+
+    if args['num_clusters'] != 1 and not (args['pipeline'] or args['sweep_args']):
+        raise ValueError("num-clusters can only be used with pipeline or sweep-args.")
+
+    if args['max_recoveries'] and (args['pipeline'] or args['sweep_args'] or args['app_spec']
+                                   or args['step_concurrency_level']):
+        raise ValueError("max-recoveries can only be used with a single app.")
+
+    if args['max_recoveries'] and not args['wait']:
+        raise ValueError("max-recoveries requires wait.")
+
+    if args['max_recoveries'] and args['history']:
+        # Recovered runs span resubmitted steps and possibly several clusters.
+        raise ValueError("history cannot be combined with max-recoveries.")
+
+    if args['backend'] == 'local' and (args['pipeline'] or args['sweep_args']):
+        raise ValueError("backend local cannot run a pipeline or sweep-args.")
+
+    if args['cache'] and (args['app_spec'] or args['sweep_args'] or args['step_concurrency_level']):
+        raise ValueError("cache can only be used with a single app or a pipeline.")
+
+    if args['cache'] and args['app'] and not (args['wait'] and args['outputs']):
+        raise ValueError("cache requires wait and outputs.")
+
+    if args['event_log'] and (args['pipeline'] or args['app_spec'] or args['sweep_args']
+                              or args['step_concurrency_level']):
+        raise ValueError("event-log can only be used with a single app.")
+
+    if args['event_log'] and not args['wait']:
+        raise ValueError("event-log requires wait.")
+
+    if args['sample_utilization']:
+        if not args['wait']:
+            raise ValueError("sample-utilization requires wait.")
+        if args['cluster_id'] or not (args['num_core'] or args['num_task']):
+            raise ValueError("sample-utilization requires launching a cluster with core or task nodes.")
+
+    if args['max_cost'] is not None or args['max_runtime'] is not None:
+        if not args['wait']:
+            raise ValueError("max-cost and max-runtime require wait.")
+        if (args['max_cost'] or 0) < 0 or (args['max_runtime'] or 0) < 0:
+            raise ValueError("max-cost and max-runtime must not be negative.")
+
+    if args['bootstrap_cache_paths']:
+        if not args['bootstrap_script']:
+            raise ValueError("bootstrap-cache-paths requires bootstrap-script.")
+        if not all(os.path.isabs(path) and path != '/' for path in args['bootstrap_cache_paths']):
+            raise ValueError("bootstrap-cache-paths must be absolute paths below /.")
+
+    if args['bootstrap_inputs'] and not args['bootstrap_cache_paths']:
+        raise ValueError("bootstrap-inputs requires bootstrap-cache-paths.")
+
+    if args['size_from_inputs']:
+        if not args['app'] or args['app_spec'] or args['sweep_args']:
+            raise ValueError("size-from-inputs can only be used with a single app.")
+        if not args['inputs']:
+            raise ValueError("size-from-inputs requires inputs.")
+        if not (args['instance_type_core'] or args['instance_type_task']):
+            raise ValueError("size-from-inputs requires instance-type-core or instance-type-task.")
+
+    if args['autoscale_max'] is not None:
+        if not args['wait']:
+            raise ValueError("autoscale-max requires wait.")
+        if not args['cluster_id'] and not args['num_task']:
+            raise ValueError("autoscale-max requires task nodes.")
+        if args['managed_scaling_max'] is not None:
+            raise ValueError("autoscale-max cannot be combined with managed scaling.")
+        if not 0 <= args['autoscale_min'] <= args['autoscale_max']:
+            raise ValueError("autoscale-min must be between 0 and autoscale-max.")
+
     return args
 
 
-def determine_prices(args, ec2, pricing_client):
+def cluster_config(args_dict):
     """
-    Checks `args` in order to determine whether spot pricing should be
-     used for instance groups within the EMR cluster, and if this is the
-     case attempts to determine the optimal bid price.
+    Returns the `run_job_flow` arguments of the clusters to launch.
     """
-    # Check if we need to do anything
-    pricing_properties = (
-        'dynamic_pricing_master', 'dynamic_pricing_core', 'dynamic_pricing_task')
-    if not any([x in args for x in pricing_properties]):
-        return args
+    # Staging steps run serially, the step concurrency level is raised once they complete.
+    # Pipeline and sweep jobs are submitted as capacity frees up, so clusters
+    # running them are kept alive until all jobs have finished.
+    scheduled = bool(args_dict['pipeline'] or args_dict['sweep_args'])
+    return cluster.emr_config(**dict(args_dict,
+                                     step_concurrency_level=None,
+                                     keep_alive=args_dict['keep_alive'] or scheduled))
 
-    availability_zone = None
-    subnet_id = args.get('ec2_subnet_id')
-    if subnet_id:
-        # We need to determine the AZ associated with the provided EC2 subnet ID
-        # in order to look up spot prices in the correct region.
-        availability_zone = pricing.get_availability_zone(ec2, subnet_id)
-        if not availability_zone:
-            logger.info("Could not determine availability zone for subnet '%s'", subnet_id)
 
-    # Mutate a copy of args.
-    args = args.copy()
+def size_from_inputs(s3_client, args_dict):
+    """
+    Returns `args_dict` with the node counts and the partition settings of
+    the app derived from the size of its inputs. The node counts of an existing
+    cluster are left as they are.
+    """
+    input_size = sizing.measure_inputs(s3_client, args_dict['inputs'])
+    sized = sizing.size_cluster(input_size.total_bytes, max_nodes=args_dict['size_max_nodes'], **args_dict)
+    args_dict = dict(args_dict, submit_args=sizing.sized_submit_args(args_dict['submit_args'], sized))
+    if args_dict.get('cluster_id') is None:
+        args_dict.update(num_core=sized.num_core, num_task=sized.num_task)
+    return args_dict
 
-    # Determine bid prices for the instance types for which we want to
-    # use bid pricing.
-    for price_property in pricing_properties:
-        if price_property not in args:
-            continue
 
-        if args[price_property]:
-            instance_type_key = price_property.replace(
-                'dynamic_pricing', 'instance_type')
-            instance_type = args[instance_type_key]
-            instance_group = price_property.replace('dynamic_pricing_', '')
-            # TODO (rikheijdens): optimize by caching instance prices
-            # between instance groups?
-            bid_price, is_spot = pricing.get_bid_price(ec2, pricing_client, instance_type, availability_zone)
-            if is_spot:
-                logger.info("Using spot pricing with a bid price of $%.2f"
-                            " for %s instances in the %s instance group.",
-                            bid_price, instance_type,
-                            instance_group)
-                bid_key = price_property.replace('dynamic_pricing', 'bid_price')
-                args[bid_key] = str(bid_price)
-            else:
-                logger.info("Spot price for %s in the %s instance group too high."
-                            " Using on-demand price of $%.2f",
-                            instance_type, instance_group, bid_price)
-    return args
+def plan_compaction(s3_client, args_dict):
+    """
+    Returns `args_dict` with the S3DistCp arguments compacting the output of
+    the app, derived from a sample of its files. Without an `s3_client`, in dry
+    runs and with the local backend which skips S3DistCp steps, files are not
+    sampled and the step only shows the default pattern.
+    """
+    if not args_dict.get('compact_src'):
+        return args_dict
+    if s3_client is None:
+        return dict(args_dict, compaction=[
+            '--src', args_dict['compact_src'], '--dest', args_dict['compact_dest'],
+            '--groupBy', compaction.DEFAULT_GROUP_BY, '--targetSize', str(args_dict['compact_target_size']),
+            '--outputCodec', args_dict['compact_codec'] or 'keep'])
+    return dict(args_dict, compaction=compaction.compaction_args(
+        s3_client, args_dict['compact_src'], args_dict['compact_dest'],
+        sample_uri=args_dict['compact_sample'], target_size_mb=args_dict['compact_target_size'],
+        output_codec=args_dict['compact_codec']))
+
+
+def plan_bootstrap_cache(s3_client, args_dict):
+    """
+    Returns `args_dict` running the bootstrap script through the wrapper caching
+    its result, keyed by the contents of the script and its inputs when
+    `s3_client` is given, which also uploads the wrapper.
+    """
+    if not args_dict.get('bootstrap_cache_paths') or args_dict.get('cluster_id') is not None:
+        return args_dict
+    wrapper_uri, cache_uri = bootstrap.plan_bootstrap_cache(
+        s3_client, args_dict['s3_bucket'], args_dict['s3_path'], args_dict['bootstrap_script'],
+        args_dict['release_label'], args_dict['bootstrap_cache_paths'], args_dict['bootstrap_inputs'] or ())
+    return dict(args_dict, bootstrap_wrapper=wrapper_uri, bootstrap_cache_uri=cache_uri)
 
 
-def main():
-    args_dict = parse_cli_args(create_parser())
-    print("Args: ", args_dict)
+def report_event_logs(s3_client, log_uri):
+    """Logs a report of every event log written below `log_uri`."""
+    reports = eventlog.analyze_s3(s3_client, log_uri)
+    if not reports:
+        logger.warning("No event logs found below %s", log_uri)
+    for name, report in reports.items():
+        logger.info("%s", eventlog.format_report(report, name))
+    return reports
 
-    numeric_level = getattr(logging, args_dict['log_level'], None)
-    logging.basicConfig(format=LOGFORMAT)
-    logging.getLogger('sparksteps').setLevel(numeric_level)
 
-    client = boto3.client('emr', region_name=args_dict['aws_region'])
-    s3 = boto3.resource('s3')
+def report_utilization(samplers, args_dict, price_func, duration_s):
+    """
+    Stops `samplers`, optionally writes the sampled utilization to `utilization_out`
+    and logs a recommended size for the workers of every sampled cluster.
+    """
+    recommendations = {}
+    for sampler in samplers:
+        sampler.stop()
+        recommendation = utilization.recommend(sampler.series, price_func, duration_s, **args_dict)
+        if recommendation is None:
+            logger.warning("No utilization was sampled for cluster %s", sampler.cluster_id)
+            continue
+        logger.info("Cluster %s: %s", sampler.cluster_id, utilization.format_recommendation(recommendation))
+        recommendations[sampler.cluster_id] = recommendation
+    if args_dict.get('utilization_out'):
+        with open(args_dict['utilization_out'], 'w') as f:
+            json.dump({sampler.cluster_id: sampler.series.to_dict() for sampler in samplers}, f)
+    return recommendations
 
-    cluster_id = args_dict.get('cluster_id')
-    if cluster_id is None:
-        logger.info("Launching cluster...")
-        ec2_client = boto3.client('ec2', region_name=args_dict['aws_region'])
-        pricing_client = boto3.client('pricing', region_name=args_dict['aws_region'])
-        args_dict = determine_prices(args_dict, ec2_client, pricing_client)
-        cluster_config = cluster.emr_config(**args_dict)
-        response = client.run_job_flow(**cluster_config)
-        cluster_id = response['JobFlowId']
-        logger.info("Cluster ID: %s", cluster_id)
-
-    emr_steps = steps.setup_steps(s3,
-                                  args_dict['s3_bucket'],
-                                  args_dict['s3_path'],
-                                  args_dict['app'],
-                                  args_dict['submit_args'],
-                                  args_dict['app_args'],
-                                  args_dict['uploads'],
-                                  args_dict['s3_dist_cp'])
-
-    response = client.add_job_flow_steps(JobFlowId=cluster_id, Steps=emr_steps)
 
+def launch_clusters(session, args_dict, journal=None):
+    """
+    Determines bid prices and launches `num_clusters` clusters, returning their IDs.
+    """
+    logger.info("Launching cluster...")
+    args_dict = session.determine_prices(args_dict)
+    cluster_ids = launcher.launch_clusters(session.emr, cluster_config(args_dict), args_dict['num_clusters'])
+    if journal is not None:
+        journal.record('clusters', cluster_ids=cluster_ids)
+    return cluster_ids
+
+
+def relaunch_cluster(session, args_dict, on_demand_roles=(), journal=None):
+    """
+    Launches a cluster replacing a terminated one, using on-demand instances
+    for the instance groups in `on_demand_roles`, and returns its ID.
+    """
+    args_dict = dict(args_dict, num_clusters=1)
+    for role in on_demand_roles:
+        args_dict['dynamic_pricing_' + role] = False
+        args_dict['bid_price_' + role] = None
+    return launch_clusters(session, args_dict, journal)[0]
+
+
+def stage_app(s3, args_dict, journal=None):
+    return steps.setup_steps(s3,
+                             args_dict['s3_bucket'],
+                             args_dict['s3_path'],
+                             args_dict['app'],
+                             args_dict['submit_args'],
+                             args_dict['app_args'],
+                             list(args_dict['uploads'] or []),
+                             args_dict['s3_dist_cp'],
+                             journal=journal,
+                             compaction=args_dict.get('compaction'))
+
+
+def record_history(history, client, cluster_id, step_ids, args_dict, outcome, session=None, timings=None):
+    """
+    Records a run of the app in `history`, priced given a `session`. Recording
+    is best effort, it never fails the run.
+    """
+    try:
+        if timings is None:
+            timings = get_step_timings(client, cluster_id, step_ids)
+        groups = instance_groups(client, cluster_id)
+        price = None
+        if session is not None:
+            try:
+                price = hourly_price(groups, functools.partial(pricing.get_demand_price, session.pricing))
+            except Exception:
+                logger.warning("Failed to price the instance groups of cluster %s", cluster_id)
+        app = args_dict['app']
+        history.record_run(app, timings, outcome, cluster_id, groups, price,
+                           app_hash(app) if app.startswith('s3://') or os.path.exists(app) else None)
+    except Exception:
+        logger.exception("Failed to record the run in %s", history.path)
+
+
+def retarget_pollers(pollers, cluster_id, new_cluster_id):
+    """Points the pollers of a terminated cluster at the cluster relaunched in its place."""
+    for poller in pollers:
+        if poller.cluster_id == cluster_id:
+            poller.retarget(new_cluster_id)
+
+
+def run_app(client, cluster_ids, emr_steps, args_dict, journal=None, session=None, history=None, on_relaunch=None):
+    """
+    Submits the steps of a single app, optionally waiting for the last one to complete.
+    Given a `session` and `max_recoveries`, steps failing because instances were lost
+    are recovered from, calling `on_relaunch` when the cluster is relaunched. Otherwise,
+    given a `history`, the run is recorded and polling is paced by the runtimes of the
+    last step in previous runs of the app.
+    """
+    cluster_id = cluster_ids[0]
+    submitted_step_ids, on_submit = [], None
+    if journal is not None:
+        submitted_step_ids = journal.step_ids(cluster_id)
+        on_submit = functools.partial(journal.record_steps, cluster_id)
+        if submitted_step_ids:
+            logger.info("Resuming after %d submitted steps", len(submitted_step_ids))
     try:
-        step_ids = json.dumps(response['StepIds'])
+        step_ids = submitted_step_ids + submit.add_steps(client, cluster_id, emr_steps[len(submitted_step_ids):],
+                                                         on_submit=on_submit)
     except KeyError:
-        step_ids = 'Invalid response'
+        step_ids = []
         args_dict['wait'] = False
-    logger.info("Step IDs: %s", step_ids)
+    logger.info("Step IDs: %s", json.dumps(step_ids) if step_ids else 'Invalid response')
 
     sleep_interval = args_dict.get('wait')
-    if sleep_interval:
-        last_step_id = response['StepIds'][-1]
+    if sleep_interval and args_dict.get('max_recoveries') and session is not None:
+        relaunch = None
+        # Compaction and s3-dist-cp steps follow the step running the app.
+        num_staging_steps = len(emr_steps) - 1 - bool(args_dict['s3_dist_cp']) - bool(args_dict.get('compaction'))
+        if args_dict.get('cluster_id') is None:
+            relaunch = functools.partial(relaunch_cluster, session, args_dict, journal=journal)
+        logger.info('Polling until all steps are complete using a sleep interval of %s seconds...', sleep_interval)
+        recovery.wait_and_recover(client, cluster_id, emr_steps, step_ids[-len(emr_steps):], int(sleep_interval),
+                                  args_dict['max_recoveries'], session.get_bid_price,
+                                  relaunch=relaunch,
+                                  num_staging_steps=num_staging_steps,
+                                  on_submit=journal.record_steps if journal is not None else None,
+                                  on_relaunch=on_relaunch)
+    elif sleep_interval:
+        last_step_id = step_ids[-1]
         logger.info('Polling until step {last_step} is complete using a sleep interval of {interval} seconds...'
                     .format(last_step=last_step_id, interval=sleep_interval))
-        wait_for_step_complete(client, cluster_id, last_step_id, sleep_interval_s=int(sleep_interval))
+        wait_kwargs = {}
+        # The waiter sleeps from the start of the awaited step, not from the start of staging.
+        step_name = emr_steps[-1]['Name']
+        expected_s = history.estimate_runtime(args_dict['app'], step_name) if history is not None else None
+        if expected_s is not None:
+            logger.info('%s took %.0f seconds in previous runs of the app', step_name, expected_s)
+            wait_kwargs['expected_s'] = expected_s
+        try:
+            wait_for_step_complete(client, cluster_id, last_step_id, sleep_interval_s=int(sleep_interval),
+                                   **wait_kwargs)
+        except Exception:
+            if history is not None:
+                record_history(history, client, cluster_id, step_ids, args_dict, 'FAILED', session)
+            raise
+        timings = get_step_timings(client, cluster_id, step_ids)
+        log_step_timings(timings)
+        if history is not None:
+            record_history(history, client, cluster_id, step_ids, args_dict, 'COMPLETED', session, timings)
+
+
+def stage_concurrent_apps(s3, args_dict, journal=None):
+    apps = [steps.App(args_dict['app'], args_dict['submit_args'], args_dict['app_args'])]
+    apps.extend(args_dict['app_spec'] or [])
+    staging_steps, app_steps = steps.setup_concurrent_steps(s3,
+                                                            args_dict['s3_bucket'],
+                                                            args_dict['s3_path'],
+                                                            apps,
+                                                            args_dict['uploads'],
+                                                            journal=journal)
+    return apps, staging_steps, app_steps
+
+
+def run_concurrent_apps(client, cluster_ids, staged, args_dict, journal=None):
+    """
+    Runs apps staged by `stage_concurrent_apps` concurrently,
+    optionally waiting for each of them to complete.
+    """
+    cluster_id = cluster_ids[0]
+    apps, staging_steps, app_steps = staged
+    submitted_step_ids, on_submit = (), None
+    if journal is not None:
+        submitted_step_ids = journal.step_ids(cluster_id)
+        on_submit = functools.partial(journal.record_steps, cluster_id)
+    step_ids = submit.submit_after_staging(client, cluster_id, staging_steps, app_steps,
+                                           step_concurrency_level=args_dict['step_concurrency_level'] or 1,
+                                           submitted_step_ids=submitted_step_ids,
+                                           on_submit=on_submit)
+    for app, step_id in zip(apps, step_ids):
+        logger.info("Step ID for %s: %s", app.path, step_id)
+
+    sleep_interval = args_dict.get('wait')
+    if sleep_interval:
+        logger.info('Polling until all apps are complete using a sleep interval of %s seconds...', sleep_interval)
+        states = wait_for_steps_complete(client, cluster_id, step_ids, sleep_interval_s=int(sleep_interval))
+        for app, step_id in zip(apps, step_ids):
+            logger.info("%s (%s) finished in state %s", app.path, step_id, states[step_id])
+        log_step_timings(get_step_timings(client, cluster_id, step_ids))
+        failed = [app.path for app, step_id in zip(apps, step_ids) if states[step_id] in FAILED_STATE]
+        if failed:
+            raise Exception('EMR job failed for {}'.format(', '.join(failed)))
+
+
+def stage_scheduled_jobs(s3, args_dict, journal=None):
+    """
+    Stages the files of the jobs of a pipeline or sweep once, returning the
+    jobs, the staging steps and the uploaded files.
+    """
+    uploads = args_dict['uploads'] or []
+    if args_dict['pipeline']:
+        spec = pipeline.load_pipeline(args_dict['pipeline'])
+        jobs = spec.jobs
+        uploads = uploads + spec.uploads
+    else:
+        app = steps.App(args_dict['app'], args_dict['submit_args'], args_dict['app_args'])
+        jobs = pipeline.sweep_jobs(app, args_dict['sweep_args'])
+    staging_steps, _ = steps.setup_concurrent_steps(s3,
+                                                    args_dict['s3_bucket'],
+                                                    args_dict['s3_path'],
+                                                    [job.app for job in jobs],
+                                                    uploads,
+                                                    journal=journal)
+    return jobs, staging_steps, uploads
+
+
+def run_scheduled_jobs(client, cluster_ids, staged, args_dict, journal=None, session=None):
+    """
+    Schedules jobs staged by `stage_scheduled_jobs` onto `cluster_ids` as their
+    dependencies complete, logging a summary at the end. Given a `session`,
+    cached jobs are skipped when `cache` is set.
+    """
+    jobs, staging_steps, uploads = staged
+    cache = None
+    if args_dict.get('cache') and session is not None:
+        cache = StepCache(session.s3.meta.client, args_dict['s3_bucket'], args_dict['s3_path'], uploads)
+    scheduler = pipeline.PipelineScheduler(
+        client, cluster_ids, jobs,
+        step_concurrency_level=args_dict['step_concurrency_level'] or pipeline.DEFAULT_STEP_CONCURRENCY_LEVEL,
+        journal=journal, cache=cache)
+    scheduler.run(staging_steps, sleep_interval_s=int(args_dict['wait'] or pipeline.DEFAULT_SLEEP_INTERVAL_SECONDS))
+
+    for job, state, job_cluster_id, step_id in scheduler.summary():
+        logger.info("%s finished in state %s (cluster: %s, step: %s, app args: %s)",
+                    job.name, state, job_cluster_id, step_id, ' '.join(job.app.app_args or []))
+    failed = [name for name, state in scheduler.states.items() if state in FAILED_STATE]
+    if failed:
+        raise Exception('EMR job failed for {}'.format(', '.join(failed)))
+
+
+def run_local(args_dict):
+    """
+    Stages the files of the app, or of concurrent apps, to a local directory
+    and runs the same steps EMR would run with a local Spark installation.
+    """
+    apps = [args_dict['app']] + [app.path for app in args_dict['app_spec'] or []]
+    s3_client = None
+    if any(path.startswith('s3://') for path in apps + (args_dict['uploads'] or [])):
+        s3_client = Session(aws_region=args_dict['aws_region']).s3.meta.client
+
+    s3 = local.LocalS3(os.path.join(args_dict['local_dir'], 's3'))
+    concurrent = bool(args_dict['app_spec'] or args_dict['step_concurrency_level'])
+    if concurrent:
+        _, staging_steps, app_steps = stage_concurrent_apps(s3, args_dict)
+        emr_steps = staging_steps + app_steps
+    else:
+        emr_steps = stage_app(s3, plan_compaction(None, args_dict))
+
+    runner = local.LocalRunner(args_dict['local_dir'], s3, spark_home=args_dict['spark_home'], s3_client=s3_client,
+                               step_concurrency_level=args_dict['step_concurrency_level'] or 1)
+    logger.info("Running %d steps in %s", len(emr_steps), args_dict['local_dir'])
+    timings = runner.run(emr_steps, concurrent_apps=concurrent)
+    log_step_timings(timings)
+    failed = [timing.name for timing in timings if timing.state in FAILED_STATE]
+    if failed:
+        raise Exception('Local job failed for {}'.format(', '.join(failed)))
+    return timings
+
+
+def dry_run(args_dict):
+    """
+    Returns the configuration of the cluster which would be launched and the
+    steps which would be submitted, without uploading files or calling AWS.
+    Bid prices are not determined as that requires looking prices up.
+    """
+    config = None
+    if args_dict.get('cluster_id') is None:
+        if any(args_dict.get(p) for p in ('dynamic_pricing_master', 'dynamic_pricing_core', 'dynamic_pricing_task')):
+            logger.info("Dry run, not determining bid prices.")
+        config = cluster_config(plan_bootstrap_cache(None, args_dict))
+
+    if args_dict['pipeline'] or args_dict['sweep_args']:
+        jobs, staging_steps, _ = stage_scheduled_jobs(None, args_dict)
+        emr_steps = staging_steps + [pipeline.JobStep(job).step for job in jobs]
+    elif args_dict['app_spec'] or args_dict['step_concurrency_level']:
+        _, staging_steps, app_steps = stage_concurrent_apps(None, args_dict)
+        emr_steps = staging_steps + app_steps
+    else:
+        emr_steps = stage_app(None, plan_compaction(None, args_dict))
+    return {'Cluster': config, 'Steps': emr_steps}
+
+
+def main():
+    args_dict = parse_cli_args(create_parser())
+
+    numeric_level = getattr(logging, args_dict['log_level'], None)
+    logging.basicConfig(format=LOGFORMAT)
+    logging.getLogger('sparksteps').setLevel(numeric_level)
+    logger.debug("Args: %s", args_dict)
+
+    if args_dict['dry_run']:
+        print(json.dumps(dry_run(args_dict), indent=2, default=str))
+        return
+
+    if args_dict['backend'] == 'local':
+        run_local(args_dict)
+        return
+
+    session = Session(aws_region=args_dict['aws_region'])
+    client = session.emr
+    s3 = session.s3
+    journal = None
+    if args_dict['resume'] or args_dict['journal']:
+        journal = Journal.open(args_dict['journal'] or default_journal_path(args_dict), resume=args_dict['resume'])
+
+    # Autoscalers, utilization samplers and budget guards, which follow a relaunched cluster.
+    pollers = []
+    scheduled = bool(args_dict['pipeline'] or args_dict['sweep_args'])
+    if scheduled:
+        stage, run = stage_scheduled_jobs, functools.partial(run_scheduled_jobs, session=session)
+    elif args_dict['app_spec'] or args_dict['step_concurrency_level']:
+        stage, run = stage_concurrent_apps, run_concurrent_apps
+    else:
+        history = History(args_dict['history']) if args_dict['history'] else None
+        stage, run = stage_app, functools.partial(run_app, session=session, history=history,
+                                                  on_relaunch=functools.partial(retarget_pollers, pollers))
+
+    cache = cache_key = None
+    if args_dict['cache'] and not scheduled:
+        app = steps.App(args_dict['app'], args_dict['submit_args'], args_dict['app_args'])
+        cache = StepCache(s3.meta.client, args_dict['s3_bucket'], args_dict['s3_path'], args_dict['uploads'] or [])
+        cache_key = cache.key(app, args_dict['inputs'] or [])
+        if cache.lookup(cache_key) is not None:
+            logger.info("%s is cached, skipping it (cache key: %s)", app.path, cache_key)
+            if journal is not None:
+                journal.record('finished')
+            return
+
+    if not args_dict['skip_preflight']:
+        preflight.validate(s3.meta.client, args_dict)
+
+    if args_dict['size_from_inputs']:
+        args_dict = size_from_inputs(s3.meta.client, args_dict)
+    args_dict = plan_compaction(s3.meta.client, args_dict)
+    args_dict = plan_bootstrap_cache(s3.meta.client, args_dict)
+
+    log_uri = None
+    if args_dict['event_log']:
+        # A resumed run keeps writing to the event log directory of the previous attempt.
+        recorded = journal.events('event_log') if journal is not None else []
+        log_uri = recorded[-1]['uri'] if recorded else eventlog.event_log_uri(args_dict['s3_bucket'],
+                                                                              args_dict['s3_path'])
+        if journal is not None and not recorded:
+            journal.record('event_log', uri=log_uri)
+        args_dict = dict(args_dict, submit_args=eventlog.event_log_submit_args(args_dict['submit_args'], log_uri))
+
+    cluster_id = args_dict.get('cluster_id')
+    launched_cluster_ids = []
+    if cluster_id is None:
+        launched_cluster_ids = journal.active_cluster_ids(client) if journal is not None else []
+        if launched_cluster_ids:
+            logger.info("Resuming on clusters %s", ', '.join(launched_cluster_ids))
+            staged = stage(s3, args_dict, journal)
+        else:
+            # Provision clusters while files are being staged.
+            launched_cluster_ids, staged = launcher.launch_and_stage(
+                client,
+                functools.partial(launch_clusters, session, args_dict, journal),
+                functools.partial(stage, s3, args_dict, journal))
+        cluster_ids = launched_cluster_ids
+    else:
+        staged = stage(s3, args_dict, journal)
+        cluster_ids = [cluster_id]
+
+    scalers = []
+    if args_dict['autoscale_max'] is not None:
+        metrics = autoscale.CloudWatchMetrics(session.client('cloudwatch'))
+        for scaled_cluster_id in cluster_ids:
+            scaler = autoscale.TaskGroupScaler(client, scaled_cluster_id, metrics,
+                                               args_dict['autoscale_min'], args_dict['autoscale_max'],
+                                               scale_out_cooldown_s=args_dict['autoscale_cooldown'],
+                                               scale_in_cooldown_s=args_dict['autoscale_cooldown'])
+            scaler.start()
+            scalers.append(scaler)
+
+    samplers = []
+    if args_dict['sample_utilization']:
+        if args_dict['utilization_source'] == 'yarn':
+            sampled_metrics = utilization.YarnUtilization(client)
+        else:
+            sampled_metrics = utilization.CloudWatchUtilization(session.client('cloudwatch'))
+        for sampled_cluster_id in cluster_ids:
+            sampler = utilization.UtilizationSampler(sampled_cluster_id, sampled_metrics,
+                                                     args_dict['utilization_interval'])
+            sampler.start()
+            samplers.append(sampler)
+
+    demand_price = functools.lru_cache(maxsize=None)(functools.partial(pricing.get_demand_price, session.pricing))
+    guards = []
+    if args_dict['max_cost'] is not None or args_dict['max_runtime'] is not None:
+        for guarded_cluster_id in cluster_ids:
+            guard = budget.BudgetGuard(client, guarded_cluster_id, demand_price,
+                                       max_cost=args_dict['max_cost'], max_runtime_s=args_dict['max_runtime'],
+                                       on_exceeded=(functools.partial(journal.record, 'budget_exceeded')
+                                                    if journal is not None else None))
+            guard.start()
+            guards.append(guard)
+    pollers.extend(scalers + samplers + guards)
+
+    started_at = time.time()
+    try:
+        run(client, cluster_ids, staged, args_dict, journal)
+        if cache_key is not None:
+            cache.store(cache_key, app, args_dict['outputs'])
+        # Recorded before reporting, so that a failed report does not resubmit a completed run on resume.
+        if journal is not None:
+            journal.record('finished')
+        if samplers:
+            try:
+                report_utilization(samplers, args_dict, demand_price, time.time() - started_at)
+            except Exception:
+                # Recommendations are best effort, they must not fail a successful run.
+                logger.exception("Failed to recommend a cluster size")
+        if log_uri is not None:
+            try:
+                report_event_logs(s3.meta.client, log_uri)
+            except Exception:
+                logger.exception("Failed to analyze the event logs below %s", log_uri)
+    finally:
+        for scaler in scalers:
+            scaler.stop()
+        for sampler in samplers:
+            sampler.stop()
+        for guard in guards:
+            guard.stop()
+            if guard.reason is not None:
+                logger.error("Cluster %s was terminated: %s", guard.cluster_id, guard.reason)
+        if scheduled and launched_cluster_ids and not args_dict['keep_alive']:
+            logger.info("Terminating clusters %s", ', '.join(launched_cluster_ids))
+            client.terminate_job_flows(JobFlowIds=launched_cluster_ids)
+
+
+if __name__ == '__main__':
+    main()
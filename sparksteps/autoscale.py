@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Grow and shrink the task instance group of a cluster from YARN metrics.
+
+While steps run, the number of pending and allocated YARN containers and the
+available YARN memory are sampled. Pending containers grow the task group by
+the number of nodes needed to run them, idle memory shrinks it, always within
+bounds and no sooner than a cooldown after the previous resize or after the
+scaler started. Samples come from the CloudWatch metrics EMR publishes or from
+any callable returning a `Sample`, such as a recorded trace.
+"""
+import json
+import math
+import time
+import logging
+import datetime
+import collections
+
+from sparksteps.poll import Poller
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COOLDOWN_SECONDS = 300
+DEFAULT_SAMPLE_INTERVAL_SECONDS = 60
+SCALE_IN_MEMORY_AVAILABLE_PCT = 50  # Shrink once at least this share of YARN memory is idle.
+METRICS_PERIOD_SECONDS = 300  # EMR publishes metrics to CloudWatch every five minutes.
+
+Sample = collections.namedtuple('Sample', 'containers_pending containers_allocated memory_available_pct')
+
+
+def desired_task_count(sample, task_count, other_count, min_count, max_count):
+    """
+    Returns the number of task nodes the cluster needs given a metrics sample.
+
+    Args:
+        sample (Sample): YARN metrics of the cluster.
+        task_count (int): current number of task nodes.
+        other_count (int): number of running core nodes.
+        min_count (int): minimum number of task nodes.
+        max_count (int): maximum number of task nodes.
+
+    Examples:
+        >>> desired_task_count(Sample(8, 8, 10), 2, 2, 0, 10)
+        6
+        >>> desired_task_count(Sample(0, 4, 80), 4, 2, 1, 10)
+        2
+    """
+    nodes = task_count + other_count
+    if sample.containers_pending > 0:
+        containers_per_node = sample.containers_allocated / nodes if nodes and sample.containers_allocated else 1
+        target = task_count + int(math.ceil(sample.containers_pending / containers_per_node))
+    elif sample.memory_available_pct >= SCALE_IN_MEMORY_AVAILABLE_PCT:
+        # Release half of the idle nodes at a time, in case the load picks up again.
+        idle_nodes = int(nodes * sample.memory_available_pct / 100.0)
+        target = task_count - int(math.ceil(idle_nodes / 2.0))
+    else:
+        target = task_count
+    return max(min_count, min(max_count, target))
+
+
+class CloudWatchMetrics(object):
+    """
+    Samples the YARN metrics EMR publishes to CloudWatch. Subclasses sample
+    other metrics by overriding `METRICS`, (field, metric name) pairs, and
+    `sample`, which builds a sample from the latest value of every field.
+
+    Args:
+        cloudwatch_client: boto3 CloudWatch client
+    """
+    METRICS = (('containers_pending', 'ContainerPending'),
+               ('containers_allocated', 'ContainerAllocated'),
+               ('memory_available_pct', 'YARNMemoryAvailablePercentage'))
+
+    def __init__(self, cloudwatch_client):
+        self.cloudwatch_client = cloudwatch_client
+
+    def sample(self, values):
+        if len(values) < len(self.METRICS):
+            # Metrics are only published once the cluster is running.
+            return None
+        return Sample(**values)
+
+    def __call__(self, cluster_id):
+        end = datetime.datetime.utcnow()
+        response = self.cloudwatch_client.get_metric_data(
+            MetricDataQueries=[{
+                'Id': field,
+                'MetricStat': {
+                    'Metric': {'Namespace': 'AWS/ElasticMapReduce', 'MetricName': name,
+                               'Dimensions': [{'Name': 'JobFlowId', 'Value': cluster_id}]},
+                    'Period': METRICS_PERIOD_SECONDS,
+                    'Stat': 'Average'
+                }
+            } for field, name in self.METRICS],
+            StartTime=end - datetime.timedelta(seconds=2 * METRICS_PERIOD_SECONDS),
+            EndTime=end,
+            ScanBy='TimestampDescending')
+        values = {r['Id']: r['Values'][0] for r in response['MetricDataResults'] if r['Values']}
+        return self.sample(values)
+
+
+class RecordedMetrics(object):
+    """
+    Replays a recorded trace of samples, one per call, and None once the
+    trace is exhausted. Subclasses replay other samples by overriding `SAMPLE`.
+
+    Args:
+        samples (list): `Sample`s or dicts with the fields of `Sample`.
+    """
+    SAMPLE = Sample
+
+    def __init__(self, samples):
+        self.samples = collections.deque(s if isinstance(s, self.SAMPLE) else self.SAMPLE(**s) for s in samples)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a trace stored as a JSON list of samples."""
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def __call__(self, cluster_id):
+        return self.samples.popleft() if self.samples else None
+
+
+class TaskGroupScaler(Poller):
+    """
+    Resizes the task instance group of a cluster from metrics samples.
+
+    Args:
+        emr_client: boto3 EMR client
+        cluster_id (str): cluster to scale.
+        metrics: returns a `Sample` of a cluster, or None when none is available.
+        min_count (int): minimum number of task nodes.
+        max_count (int): maximum number of task nodes.
+        scale_out_cooldown_s (int): seconds to wait after a resize before growing.
+        scale_in_cooldown_s (int): seconds to wait after a resize before shrinking.
+        clock: returns the current time in seconds.
+        interval_s (int): seconds between samples.
+    """
+    thread_name = 'sparksteps-autoscale'
+    failure_message = 'Failed to scale the task group of cluster %s'
+
+    def __init__(self, emr_client, cluster_id, metrics, min_count, max_count,
+                 scale_out_cooldown_s=DEFAULT_COOLDOWN_SECONDS, scale_in_cooldown_s=DEFAULT_COOLDOWN_SECONDS,
+                 clock=time.time, interval_s=DEFAULT_SAMPLE_INTERVAL_SECONDS):
+        if min_count < 0 or min_count > max_count:
+            raise ValueError('Invalid task node bounds: {} to {}.'.format(min_count, max_count))
+        Poller.__init__(self, cluster_id, interval_s)
+        self.emr_client = emr_client
+        self.metrics = metrics
+        self.min_count = min_count
+        self.max_count = max_count
+        self.scale_out_cooldown_s = scale_out_cooldown_s
+        self.scale_in_cooldown_s = scale_in_cooldown_s
+        self.clock = clock
+        # Metrics are noisy while the cluster warms up, the first resize waits for a cooldown too.
+        self.last_resized_at = clock()
+        self.resizes = []  # (time, from count, to count)
+
+    def retarget(self, cluster_id):
+        Poller.retarget(self, cluster_id)
+        # The relaunched cluster warms up as well.
+        self.last_resized_at = self.clock()
+
+    def instance_groups(self):
+        """Returns the task instance group and the number of running core nodes."""
+        task_group, core_count = None, 0
+        paginator = self.emr_client.get_paginator('list_instance_groups')
+        for page in paginator.paginate(ClusterId=self.cluster_id):
+            for group in page['InstanceGroups']:
+                if group['InstanceGroupType'] == 'TASK' and task_group is None:
+                    task_group = group
+                elif group['InstanceGroupType'] == 'CORE':
+                    core_count += group.get('RunningInstanceCount', 0)
+        return task_group, core_count
+
+    def step(self):
+        """
+        Samples the metrics once and resizes the task group if needed,
+        returning its new size or None when it was not resized.
+        """
+        task_group, core_count = self.instance_groups()
+        if task_group is None or task_group['Status']['State'] != 'RUNNING':
+            # Groups which are being provisioned or resized cannot be modified.
+            return None
+        sample = self.metrics(self.cluster_id)
+        if sample is None:
+            return None
+
+        current = task_group['RequestedInstanceCount']
+        target = desired_task_count(sample, current, core_count, self.min_count, self.max_count)
+        if target == current:
+            return None
+        now = self.clock()
+        cooldown = self.scale_out_cooldown_s if target > current else self.scale_in_cooldown_s
+        if now - self.last_resized_at < cooldown:
+            logger.debug('Not resizing %s to %d nodes during cooldown', task_group['Id'], target)
+            return None
+
+        logger.info('Resizing task group %s from %d to %d nodes (%d containers pending, %.0f%% memory available)',
+                    task_group['Id'], current, target, sample.containers_pending, sample.memory_available_pct)
+        self.emr_client.modify_instance_groups(
+            ClusterId=self.cluster_id, InstanceGroups=[{'InstanceGroupId': task_group['Id'], 'InstanceCount': target}])
+        self.last_resized_at = now
+        self.resizes.append((now, current, target))
+        return target
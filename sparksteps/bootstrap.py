@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Cache the result of bootstrap scripts in S3.
+
+Bootstrap scripts installing packages or building native code run on every
+node of every cluster, adding minutes to provisioning. With cached paths, the
+bootstrap script is run by a wrapper instead. The wrapper looks for a tarball
+of the cached paths in S3, keyed by a digest of the script, its inputs and the
+release label of the cluster, along with the architecture of the node. When
+the tarball exists it is extracted in place of running the script. Otherwise
+the script runs and the master node publishes the tarball for later clusters.
+
+Only the cached paths are restored, so they must hold everything the script
+installs which is needed later on.
+"""
+import os
+import hashlib
+import logging
+
+from sparksteps.cache import parse_s3_uri, source_digest
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = 'bootstrap-cache'
+INSTANCE_INFO_PATH = '/mnt/var/lib/info/instance.json'
+
+# Arguments: script URI, cache URI prefix, cached paths.
+WRAPPER_SCRIPT = """#!/bin/bash
+# Extracts the cached result of a bootstrap script, or runs the script and publishes its result.
+set -euo pipefail
+
+script_uri="$1"
+cache_uri="$2-$(uname -m).tar.gz"
+shift 2
+tarball="$(mktemp)"
+trap 'rm -f "$tarball"' EXIT
+
+if aws s3 cp --only-show-errors "$cache_uri" "$tarball" 2>/dev/null; then
+    echo "Extracting cached bootstrap result $cache_uri"
+    sudo tar -xzf "$tarball" -C /
+    exit 0
+fi
+
+echo "No cached bootstrap result at $cache_uri, running $script_uri"
+script="$(mktemp)"
+aws s3 cp --only-show-errors "$script_uri" "$script"
+chmod +x "$script"
+"$script"
+
+# Every node runs the script on a miss, only the master node publishes its result.
+if grep -q '"isMaster": *true' "${SPARKSTEPS_INSTANCE_INFO:-%(instance_info)s}" 2>/dev/null; then
+    sudo tar -czf "$tarball" -C / "${@#/}"
+    aws s3 cp --only-show-errors "$tarball" "$cache_uri" || echo "Failed to publish $cache_uri" >&2
+fi
+""" % {'instance_info': INSTANCE_INFO_PATH}
+
+
+def wrapper_key(bucket_path):
+    """
+    Returns the key of the wrapper script, which changes along with the script.
+
+    Examples:
+        >>> wrapper_key('sparksteps/')[:-15]
+        'sparksteps/bootstrap-cache/wrapper-'
+    """
+    digest = hashlib.sha256(WRAPPER_SCRIPT.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(bucket_path, CACHE_DIR, 'wrapper-{}.sh'.format(digest))
+
+
+def bootstrap_digest(s3_client, script_uri, release_label, cache_paths, inputs=()):
+    """
+    Returns a digest of a bootstrap script, its inputs, the cached paths and
+    the release label. Without an `s3_client` the URIs of the script and its
+    inputs are digested rather than their contents.
+    """
+    digest = hashlib.sha256()
+    for path in [script_uri] + sorted(inputs):
+        digest.update(path.encode('utf-8'))
+        if s3_client is not None:
+            digest.update(source_digest(s3_client, path).encode('utf-8'))
+    for value in [release_label] + sorted(cache_paths):
+        digest.update(value.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_uri_prefix(bucket, bucket_path, release_label, digest):
+    """
+    Returns the S3 URI prefix of the cached results of a bootstrap script,
+    completed with the architecture of the node by the wrapper.
+
+    Examples:
+        >>> cache_uri_prefix('my-bucket', 'sparksteps/', 'emr-6.2.0', 'abc')
+        's3://my-bucket/sparksteps/bootstrap-cache/emr-6.2.0/abc'
+    """
+    return os.path.join('s3://', bucket, bucket_path, CACHE_DIR, release_label, digest)
+
+
+def upload_wrapper(s3_client, bucket, bucket_path):
+    """Uploads the wrapper script unless it already exists and returns its S3 URI."""
+    key = wrapper_key(bucket_path)
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+    except s3_client.exceptions.ClientError:
+        logger.info("Uploading bootstrap wrapper to s3://%s/%s", bucket, key)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=WRAPPER_SCRIPT.encode('utf-8'))
+    return os.path.join('s3://', bucket, key)
+
+
+def bootstrap_actions(script_uri, wrapper_uri=None, cache_uri=None, cache_paths=()):
+    """
+    Returns the bootstrap actions running `script_uri`, through the wrapper
+    caching `cache_paths` below `cache_uri` when a wrapper is given.
+
+    Examples:
+        >>> bootstrap_actions('s3://b/bootstrap.sh')
+        [{'Name': 'bootstrap', 'ScriptBootstrapAction': {'Path': 's3://b/bootstrap.sh'}}]
+        >>> bootstrap_actions('s3://b/bootstrap.sh', 's3://b/wrapper.sh', 's3://b/cache/abc', ['/opt/lib'])
+        ... # doctest: +NORMALIZE_WHITESPACE
+        [{'Name': 'bootstrap', 'ScriptBootstrapAction': {'Path': 's3://b/wrapper.sh',
+          'Args': ['s3://b/bootstrap.sh', 's3://b/cache/abc', '/opt/lib']}}]
+    """
+    if wrapper_uri is None:
+        return [{'Name': 'bootstrap', 'ScriptBootstrapAction': {'Path': script_uri}}]
+    return [{'Name': 'bootstrap',
+             'ScriptBootstrapAction': {'Path': wrapper_uri, 'Args': [script_uri, cache_uri] + list(cache_paths)}}]
+
+
+def plan_bootstrap_cache(s3_client, bucket, bucket_path, script_uri, release_label, cache_paths, inputs=()):
+    """
+    Returns the URI of the wrapper script and the cache URI prefix of a bootstrap
+    script, uploading the wrapper when `s3_client` is given.
+    """
+    digest = bootstrap_digest(s3_client, script_uri, release_label, cache_paths, inputs)
+    cache_uri = cache_uri_prefix(bucket, bucket_path, release_label, digest)
+    if s3_client is None:
+        wrapper_uri = os.path.join('s3://', bucket, wrapper_key(bucket_path))
+    else:
+        wrapper_uri = upload_wrapper(s3_client, bucket, bucket_path)
+        cache_bucket, cache_prefix = parse_s3_uri(cache_uri)
+        cached = s3_client.list_objects_v2(Bucket=cache_bucket, Prefix=cache_prefix, MaxKeys=1).get('KeyCount', 0)
+        logger.info("Bootstrap result is %s at %s", 'cached' if cached else 'not cached yet', cache_uri)
+    return wrapper_uri, cache_uri
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Terminate clusters whose accrued cost or runtime exceeds a ceiling.
+
+While waiting, the running instances of every instance group and their EBS
+volumes are priced at a fixed interval and the cost since the previous check
+is added to the accrued cost, so that resizes are accounted for. Spot groups
+are priced at the bid price determined at launch and on-demand groups at their
+on-demand price. Once the accrued cost exceeds `max_cost` or the cluster has
+been waited for longer than `max_runtime_s`, pending and running steps are
+cancelled, the cluster is terminated and the reason is recorded as a tag of
+the cluster.
+"""
+import time
+import logging
+import collections
+
+from sparksteps.poll import Poller
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECK_INTERVAL_SECONDS = 60
+HOURS_PER_MONTH = 730.0
+# USD per GiB-month in us-east-1, EBS volumes are billed per second.
+EBS_GIB_MONTH_PRICES = {'standard': 0.05, 'gp2': 0.10, 'gp3': 0.08, 'io1': 0.125, 'st1': 0.045, 'sc1': 0.015}
+ACTIVE_STEP_STATES = ['PENDING', 'RUNNING']
+REASON_TAG = 'sparksteps:terminated-reason'
+
+InstanceGroup = collections.namedtuple('InstanceGroup', 'role instance_type count market bid_price ebs_volumes')
+
+
+def running_instance_groups(emr_client, cluster_id):
+    """
+    Returns an `InstanceGroup` per instance group of a cluster with its number
+    of running instances and the (volume type, size in GiB) of its EBS volumes.
+    """
+    groups = []
+    paginator = emr_client.get_paginator('list_instance_groups')
+    for page in paginator.paginate(ClusterId=cluster_id):
+        for group in page['InstanceGroups']:
+            volumes = [(d['VolumeSpecification']['VolumeType'], d['VolumeSpecification']['SizeInGB'])
+                       for d in group.get('EbsBlockDevices', [])]
+            bid_price = group.get('BidPrice')
+            groups.append(InstanceGroup(group['InstanceGroupType'], group['InstanceType'],
+                                        group.get('RunningInstanceCount', 0), group.get('Market'),
+                                        float(bid_price) if bid_price and bid_price != 'OnDemandPrice' else None,
+                                        volumes))
+    return groups
+
+
+def hourly_cost(groups, demand_price_func):
+    """
+    Returns the hourly cost of the running instances of `groups` and their EBS volumes.
+
+    Examples:
+        >>> groups = [InstanceGroup('CORE', 'm5.xlarge', 2, 'ON_DEMAND', None, [('gp2', 73)]),
+        ...           InstanceGroup('TASK', 'm5.xlarge', 4, 'SPOT', 0.1, [])]
+        >>> round(hourly_cost(groups, lambda instance_type: 0.192), 3)
+        0.804
+    """
+    cost = 0.0
+    for group in groups:
+        if not group.count:
+            continue
+        if group.market == 'SPOT' and group.bid_price is not None:
+            instance_price = group.bid_price
+        else:
+            instance_price = demand_price_func(group.instance_type)
+        ebs_price = sum(EBS_GIB_MONTH_PRICES.get(volume_type, EBS_GIB_MONTH_PRICES['gp2']) * size_gib
+                        for volume_type, size_gib in group.ebs_volumes) / HOURS_PER_MONTH
+        cost += group.count * (instance_price + ebs_price)
+    return cost
+
+
+class BudgetGuard(Poller):
+    """
+    Tracks the accrued cost and runtime of a cluster and terminates it once
+    either exceeds its ceiling.
+
+    Args:
+        emr_client: boto3 EMR client
+        cluster_id (str): cluster to guard.
+        demand_price_func: returns the on-demand hourly price of an instance type.
+        max_cost (float): ceiling of the accrued cost in USD, or None.
+        max_runtime_s (float): ceiling of the runtime in seconds, or None.
+        on_exceeded: called with the cluster ID, the reason, the accrued cost and the runtime once the
+            cluster is terminated.
+        clock: returns the current time in seconds.
+        interval_s (int): seconds between checks.
+    """
+    thread_name = 'sparksteps-budget'
+    # Pricing failures must not fail the run, the next check tries again.
+    failure_message = 'Failed to check the budget of cluster %s'
+
+    def __init__(self, emr_client, cluster_id, demand_price_func, max_cost=None, max_runtime_s=None,
+                 on_exceeded=None, clock=time.time, interval_s=DEFAULT_CHECK_INTERVAL_SECONDS):
+        if max_cost is None and max_runtime_s is None:
+            raise ValueError('Either max_cost or max_runtime_s must be set.')
+        Poller.__init__(self, cluster_id, interval_s)
+        self.emr_client = emr_client
+        self.demand_price_func = demand_price_func
+        self.max_cost = max_cost
+        self.max_runtime_s = max_runtime_s
+        self.on_exceeded = on_exceeded
+        self.clock = clock
+        self.started_at = self.last_checked_at = clock()
+        self.hourly_cost = 0.0
+        self.accrued_cost = 0.0
+        self.reason = None
+
+    def exceeded(self, runtime_s):
+        """Returns why a ceiling was exceeded, or None."""
+        if self.max_cost is not None and self.accrued_cost >= self.max_cost:
+            return 'accrued cost {:.2f} USD exceeded max-cost {:.2f} USD'.format(self.accrued_cost, self.max_cost)
+        if self.max_runtime_s is not None and runtime_s >= self.max_runtime_s:
+            return 'runtime {:.0f}s exceeded max-runtime {:.0f}s'.format(runtime_s, self.max_runtime_s)
+        return None
+
+    def step(self):
+        """
+        Adds the cost since the previous check, terminating the cluster when
+        a ceiling was exceeded. Returns the reason it was terminated, or None.
+        """
+        if self.reason is not None:
+            return None
+        now = self.clock()
+        # The previous hourly cost applies until now, the new one from now on.
+        self.accrued_cost += self.hourly_cost * (now - self.last_checked_at) / 3600.0
+        self.last_checked_at = now
+        self.hourly_cost = hourly_cost(running_instance_groups(self.emr_client, self.cluster_id),
+                                       self.demand_price_func)
+        logger.debug('Cluster %s accrued %.2f USD at %.2f USD per hour', self.cluster_id, self.accrued_cost,
+                     self.hourly_cost)
+        reason = self.exceeded(now - self.started_at)
+        if reason is not None:
+            self.terminate(reason)
+        return reason
+
+    def terminate(self, reason):
+        """
+        Terminates the cluster and cancels its active steps, recording `reason`.
+        Only once termination succeeded is the cluster considered terminated,
+        otherwise the next check tries again.
+        """
+        logger.error('Terminating cluster %s: %s', self.cluster_id, reason)
+        self.emr_client.terminate_job_flows(JobFlowIds=[self.cluster_id])
+        self.reason = reason
+        try:
+            step_ids = []
+            paginator = self.emr_client.get_paginator('list_steps')
+            for page in paginator.paginate(ClusterId=self.cluster_id, StepStates=ACTIVE_STEP_STATES):
+                step_ids.extend(step['Id'] for step in page['Steps'])
+            if step_ids:
+                # Steps are marked cancelled rather than left to fail as the cluster shuts down.
+                self.emr_client.cancel_steps(ClusterId=self.cluster_id, StepIds=step_ids,
+                                             StepCancellationOption='SEND_INTERRUPT')
+        except Exception:
+            # Running steps can only be cancelled on recent releases, terminating stops them too.
+            logger.warning('Failed to cancel the active steps of cluster %s', self.cluster_id)
+        try:
+            self.emr_client.add_tags(ResourceId=self.cluster_id, Tags=[{'Key': REASON_TAG, 'Value': reason[:256]}])
+        except Exception:
+            logger.warning('Failed to tag cluster %s with the reason it was terminated', self.cluster_id)
+        if self.on_exceeded is not None:
+            self.on_exceeded(cluster_id=self.cluster_id, reason=reason, cost=self.accrued_cost,
+                             runtime_s=self.last_checked_at - self.started_at)
+
+    def finished(self):
+        return self.reason is not None
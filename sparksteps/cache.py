@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Skip Spark apps whose code, dependencies, arguments and inputs did not change.
+
+The cache key of an app is derived from the contents of the app and of the
+uploaded files, the spark-submit and app arguments, and the keys, ETags and
+sizes of the objects below the declared S3 inputs. Once an app completes, its
+key is recorded in S3 along with its declared outputs. Later runs with the
+same key skip the app as long as all of its outputs still exist.
+"""
+import os
+import json
+import hashlib
+import logging
+import datetime
+from urllib.parse import urlparse
+
+from sparksteps.steps import path_digest
+
+logger = logging.getLogger(__name__)
+
+
+def parse_s3_uri(uri):
+    """
+    Returns the bucket and key of an S3 URI.
+
+    Examples:
+        >>> parse_s3_uri('s3://my-bucket/data/episodes/')
+        ('my-bucket', 'data/episodes/')
+    """
+    parsed = urlparse(uri, allow_fragments=False)
+    return parsed.netloc, parsed.path.lstrip('/')
+
+
+def list_objects(s3_client, uri):
+    """Yields the objects below an S3 URI."""
+    bucket, prefix = parse_s3_uri(uri)
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj
+
+
+def s3_fingerprint(s3_client, uri):
+    """Returns a digest of the keys, ETags and sizes of the objects below an S3 URI."""
+    digest = hashlib.sha256()
+    for obj in sorted(list_objects(s3_client, uri), key=lambda o: o['Key']):
+        digest.update('{} {} {}\n'.format(obj['Key'], obj['ETag'], obj['Size']).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def s3_exists(s3_client, uri):
+    """Returns whether there is any object below an S3 URI."""
+    bucket, prefix = parse_s3_uri(uri)
+    return s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1).get('KeyCount', 0) > 0
+
+
+def source_digest(s3_client, path):
+    """Returns a digest of a local file or directory, or of the objects below an S3 URI."""
+    if path.startswith('s3://'):
+        return s3_fingerprint(s3_client, path)
+    return path_digest(path)
+
+
+class StepCache(object):
+    """
+    Records the keys of completed apps in S3 below `bucket_path`/cache/.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket (str): bucket the records are stored in.
+        bucket_path (str): key prefix the records are stored under.
+        uploads (list): files uploaded for every app.
+    """
+    def __init__(self, s3_client, bucket, bucket_path, uploads=()):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.bucket_path = bucket_path
+        self.uploads = list(uploads)
+        self._uploads_digest = None
+
+    @property
+    def uploads_digest(self):
+        if self._uploads_digest is None:
+            self._uploads_digest = [[os.path.basename(os.path.normpath(path)), source_digest(self.s3_client, path)]
+                                    for path in self.uploads]
+        return self._uploads_digest
+
+    def key(self, app, inputs=()):
+        """Returns the cache key of an `App` reading the S3 URIs `inputs`."""
+        components = {
+            'app': source_digest(self.s3_client, app.path),
+            'uploads': self.uploads_digest,
+            'submit_args': app.submit_args or [],
+            'app_args': app.app_args or [],
+            'inputs': {uri: s3_fingerprint(self.s3_client, uri) for uri in inputs},
+        }
+        return hashlib.sha256(json.dumps(components, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def record_key(self, key):
+        return os.path.join(self.bucket_path, 'cache', key + '.json')
+
+    def lookup(self, key):
+        """Returns the record of `key` if all of its outputs still exist, otherwise None."""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.record_key(key))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        record = json.loads(response['Body'].read().decode('utf-8'))
+        missing = [uri for uri in record['outputs'] if not s3_exists(self.s3_client, uri)]
+        if missing:
+            logger.info('Outputs of cached run %s no longer exist: %s', key, ', '.join(missing))
+            return None
+        return record
+
+    def store(self, key, app, outputs):
+        """Records that `app` completed with cache key `key` and wrote `outputs`."""
+        record = {'key': key, 'app': app.path, 'outputs': list(outputs),
+                  'completed_at': datetime.datetime.utcnow().isoformat()}
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.record_key(key),
+                                  Body=json.dumps(record).encode('utf-8'))
+        logger.info('Recorded %s in the cache as %s', app.path, key)
+        return record
@@ -6,11 +6,19 @@ import logging
 import datetime
 
 from sparksteps import steps
+from sparksteps import tuning
+from sparksteps import bootstrap
 
 DEFAULT_JOBFLOW_ROLE = 'EMR_EC2_DefaultRole'
 DEFAULT_SERVICE_ROLE = 'EMR_DefaultRole'
 DEFAULT_APP_LIST = ['Hadoop', 'Spark']
 
+# Limits imposed by EMR on the AutoTerminationPolicy idle timeout.
+MIN_IDLE_TIMEOUT = 60  # seconds
+MAX_IDLE_TIMEOUT = 7 * 24 * 60 * 60  # seconds
+MANAGED_SCALING_UNIT_TYPES = ('Instances', 'VCPU', 'InstanceFleetUnits')
+MAX_STEP_CONCURRENCY_LEVEL = 256
+
 logger = logging.getLogger(__name__)
 
 username = getpass.getuser()
@@ -36,7 +44,17 @@ def parse_tags(raw_tags_list):
 
 
 def parse_conf(raw_conf_list):
-    """Parse configuration items."""
+    """
+    Parse configuration items.
+
+    Properties of a classification which occurs more than once are merged,
+    with later values taking precedence.
+
+    Examples:
+        >>> from pprint import pprint
+        >>> pprint(parse_conf(['spark', 'a=1', 'b=2', 'spark', 'b=3']))
+        [{'Classification': 'spark', 'Properties': {'a': '1', 'b': '3'}}]
+    """
 
     defaults = []
     classification = None
@@ -46,15 +64,13 @@ def parse_conf(raw_conf_list):
             key, value = token.split('=', 1)
             classification['Properties'][key] = value
         else:
-            if classification:
+            classification = next((c for c in defaults if c['Classification'] == token), None)
+            if classification is None:
+                classification = {
+                    'Classification': token,
+                    'Properties': {}
+                }
                 defaults.append(classification)
-            classification = {
-                'Classification': token,
-                'Properties': {}
-            }
-
-    if classification:
-        defaults.append(classification)
 
     return defaults
 
@@ -74,6 +90,67 @@ def parse_apps(raw_app_list):
         key=lambda x: x['Name'])
 
 
+def managed_scaling_policy(instance_groups, min_units, max_units, max_on_demand_units=None,
+                           max_core_units=None, unit_type='Instances'):
+    """
+    Returns a ManagedScalingPolicy for a cluster made up of `instance_groups`,
+    raising a ValueError when the compute limits are not valid for these groups.
+
+    Args:
+        instance_groups (list): InstanceGroups configuration of the cluster.
+        min_units (int): lower boundary of core and task units.
+        max_units (int): upper boundary of core and task units.
+        max_on_demand_units (int): upper boundary of on-demand units.
+        max_core_units (int): upper boundary of core units.
+        unit_type (str): the unit in which the boundaries are expressed.
+    """
+    if unit_type not in MANAGED_SCALING_UNIT_TYPES:
+        raise ValueError('Unsupported managed scaling unit type: {}.'.format(unit_type))
+    if unit_type == 'InstanceFleetUnits':
+        raise ValueError('Managed scaling unit type InstanceFleetUnits requires instance fleets, '
+                         'but the cluster is configured with instance groups.')
+    if not any(g['InstanceRole'] == 'CORE' for g in instance_groups):
+        raise ValueError('Managed scaling requires core nodes.')
+    if min_units is None or max_units is None:
+        raise ValueError('Managed scaling requires both a minimum and a maximum number of units.')
+    if not 1 <= min_units <= max_units:
+        raise ValueError('Managed scaling requires 1 <= minimum ({}) <= maximum ({}) units.'.format(
+            min_units, max_units))
+
+    compute_limits = {
+        'UnitType': unit_type,
+        'MinimumCapacityUnits': min_units,
+        'MaximumCapacityUnits': max_units,
+    }
+    for key, value in (('MaximumOnDemandCapacityUnits', max_on_demand_units),
+                       ('MaximumCoreCapacityUnits', max_core_units)):
+        if value is None:
+            continue
+        if not 1 <= value <= max_units:
+            raise ValueError('{} ({}) must be between 1 and the maximum number of units ({}).'.format(
+                key, value, max_units))
+        compute_limits[key] = value
+
+    if unit_type == 'Instances':
+        num_instances = sum(g['InstanceCount'] for g in instance_groups if g['InstanceRole'] != 'MASTER')
+        if not min_units <= num_instances <= max_units:
+            logger.warning('The cluster will be launched with %d core and task nodes, managed scaling '
+                           'will resize it to within [%d, %d].', num_instances, min_units, max_units)
+
+    return {'ComputeLimits': compute_limits}
+
+
+def auto_termination_policy(idle_timeout):
+    """
+    Returns an AutoTerminationPolicy which terminates the cluster after it
+    has been idle for `idle_timeout` seconds.
+    """
+    if not MIN_IDLE_TIMEOUT <= idle_timeout <= MAX_IDLE_TIMEOUT:
+        raise ValueError('Idle timeout must be between {} and {} seconds, got {}.'.format(
+            MIN_IDLE_TIMEOUT, MAX_IDLE_TIMEOUT, idle_timeout))
+    return {'IdleTimeout': idle_timeout}
+
+
 def emr_config(release_label, keep_alive=False, **kw):
     timestamp = datetime.datetime.now().replace(microsecond=0)
     config = dict(
@@ -141,17 +218,42 @@ def emr_config(release_label, keep_alive=False, **kw):
         config['Steps'] = [steps.DebugStep().step]
     if kw.get('tags'):
         config['Tags'] = parse_tags(kw['tags'])
+    raw_conf = []
+    if kw.get('auto_tune'):
+        raw_conf.extend(tuning.spark_defaults(**kw))
     if kw.get('defaults'):
-        config['Configurations'] = parse_conf(kw['defaults'])
+        # Explicitly provided defaults take precedence over tuned values.
+        raw_conf.extend(kw['defaults'])
+    if raw_conf:
+        config['Configurations'] = parse_conf(raw_conf)
     if kw.get('maximize_resource_allocation'):
+        if kw.get('auto_tune'):
+            logger.warning('maximizeResourceAllocation is overridden by the tuned spark-defaults.')
         configurations = config.get('Configurations', [])
         configurations.append({
             'Classification': 'spark',
             'Properties': {'maximizeResourceAllocation': 'true'}
         })
         config['Configurations'] = configurations
+    if kw.get('managed_scaling_min') is not None or kw.get('managed_scaling_max') is not None:
+        config['ManagedScalingPolicy'] = managed_scaling_policy(
+            config['Instances']['InstanceGroups'],
+            kw.get('managed_scaling_min'),
+            kw.get('managed_scaling_max'),
+            max_on_demand_units=kw.get('managed_scaling_max_on_demand'),
+            max_core_units=kw.get('managed_scaling_max_core'),
+            unit_type=kw.get('managed_scaling_unit_type') or 'Instances')
+    if kw.get('step_concurrency_level'):
+        if not 1 <= kw['step_concurrency_level'] <= MAX_STEP_CONCURRENCY_LEVEL:
+            raise ValueError('Step concurrency level must be between 1 and {}.'.format(
+                MAX_STEP_CONCURRENCY_LEVEL))
+        config['StepConcurrencyLevel'] = kw['step_concurrency_level']
+    if kw.get('idle_timeout'):
+        config['AutoTerminationPolicy'] = auto_termination_policy(kw['idle_timeout'])
     if kw.get('bootstrap_script'):
-        config['BootstrapActions'] = [{'Name': 'bootstrap',
-                                       'ScriptBootstrapAction': {'Path': kw['bootstrap_script']}}]
+        config['BootstrapActions'] = bootstrap.bootstrap_actions(kw['bootstrap_script'],
+                                                                 wrapper_uri=kw.get('bootstrap_wrapper'),
+                                                                 cache_uri=kw.get('bootstrap_cache_uri'),
+                                                                 cache_paths=kw.get('bootstrap_cache_paths') or ())
 
     return config
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Build S3DistCp steps compacting the many small files Spark apps write.
+
+A sample of the objects below the output prefix is listed to estimate the
+distribution of file sizes and to learn the layout of the output: the depth of
+its partition directories, the naming of its files and their compression. From
+these the `--groupBy` pattern concatenating the files of every partition, the
+`--targetSize` and the `--outputCodec` of the S3DistCp step are derived.
+
+Concatenating files only preserves line oriented formats such as JSON and
+CSV, columnar and container formats are refused.
+"""
+import re
+import logging
+import collections
+
+from sparksteps.cache import parse_s3_uri
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SIZE = 1000
+DEFAULT_TARGET_SIZE_MB = 256
+# Spark names the files it writes part-<partition>-<uuid>...
+DEFAULT_GROUP_BY = r'.*/(part)-[^/]*'
+# Files at least this fraction of the target size are not worth compacting.
+COMPACTED_FRACTION = 0.5
+COMPRESSION_CODECS = collections.OrderedDict([('.gz', 'gzip'), ('.lzo', 'lzo'), ('.snappy', 'snappy')])
+UNSPLITTABLE_EXTENSIONS = ('.parquet', '.orc', '.avro')
+
+SizeDistribution = collections.namedtuple('SizeDistribution', 'num_files total_bytes median_bytes p90_bytes')
+
+
+def sample_objects(s3_client, uri, sample_size=SAMPLE_SIZE):
+    """Returns up to `sample_size` objects below an S3 URI, skipping markers such as _SUCCESS."""
+    bucket, prefix = parse_s3_uri(uri)
+    objects = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, PaginationConfig={'MaxItems': sample_size}):
+        objects.extend(obj for obj in page.get('Contents', [])
+                       if not obj['Key'].rsplit('/', 1)[-1].startswith(('_', '.')))
+    return objects
+
+
+def size_distribution(sizes):
+    """
+    Summarizes a sample of file sizes.
+
+    Examples:
+        >>> size_distribution([10, 20, 30, 40, 1000])
+        SizeDistribution(num_files=5, total_bytes=1100, median_bytes=30, p90_bytes=1000)
+    """
+    sizes = sorted(sizes)
+    if not sizes:
+        return SizeDistribution(0, 0, 0, 0)
+    return SizeDistribution(len(sizes), sum(sizes), sizes[len(sizes) // 2], sizes[int(len(sizes) * 0.9)])
+
+
+def split_extension(basename):
+    """
+    Returns the extension of a file without its compression suffix, and its compression codec.
+
+    Examples:
+        >>> split_extension('part-00000-1b2c-c000.json.gz')
+        ('.json', 'gzip')
+        >>> split_extension('part-00000')
+        ('', 'none')
+    """
+    extension = basename[basename.index('.'):] if '.' in basename else ''
+    for suffix, codec in COMPRESSION_CODECS.items():
+        if extension.endswith(suffix):
+            return extension[:-len(suffix)], codec
+    return extension, 'none'
+
+
+def group_by_pattern(keys, prefix):
+    """
+    Returns a `--groupBy` pattern concatenating the files of every partition
+    directory below `prefix`, naming the result after the directories.
+
+    Examples:
+        >>> group_by_pattern(['out/date=1/part-0.json', 'out/date=2/part-1.json'], 'out/')
+        '.*/([^/]+)/part[^/]*(\\\\.json)'
+        >>> group_by_pattern(['out/part-0', 'out/part-1'], 'out/')
+        '.*/(part)[^/]*'
+    """
+    relative = [key[len(prefix):].lstrip('/') for key in keys]
+    depths = set(path.count('/') for path in relative)
+    if len(depths) != 1:
+        raise ValueError('Files below {} are nested at different depths, unable to group them.'.format(prefix))
+    depth = depths.pop()
+    basenames = [path.rsplit('/', 1)[-1] for path in relative]
+    stems = set(re.match(r'[A-Za-z]*', name).group(0) for name in basenames)
+    stem = stems.pop() if len(stems) == 1 else ''
+    extensions = set(split_extension(name)[0] for name in basenames)
+    extension = extensions.pop() if len(extensions) == 1 else ''
+    # The compression suffix is left out of the name, S3DistCp appends that of the output codec.
+    suffixes = set(name[name.index(extension) + len(extension):] if extension else '' for name in basenames)
+    suffix = suffixes.pop() if len(suffixes) == 1 else None
+    if not depth and not stem:
+        raise ValueError('Files below {} share no common name, unable to group them.'.format(prefix))
+
+    stem = re.escape(stem)
+    pattern = '.*/' + '([^/]+)/' * depth + (stem if depth else '({})'.format(stem)) + '[^/]*'
+    if extension and suffix is not None:
+        pattern += '({}){}'.format(re.escape(extension), re.escape(suffix))
+    # Files not matching the pattern would not be copied.
+    unmatched = [key for key in keys if not re.match(pattern + '$', key)]
+    if unmatched:
+        raise ValueError('Unable to derive a groupBy pattern matching {}.'.format(unmatched[0]))
+    return pattern
+
+
+def compaction_args(s3_client, src, dest, sample_uri=None, target_size_mb=DEFAULT_TARGET_SIZE_MB, output_codec=None):
+    """
+    Returns the S3DistCp arguments compacting the files of `src` into `dest`,
+    derived from a sample of the objects below `sample_uri` (`src` by default),
+    or None when the sampled files are large enough already.
+
+    Raises a ValueError when the format of the files cannot be verified, that
+    is without an S3 client or when nothing is found to sample, since columnar
+    files would be corrupted by concatenating them.
+    """
+    sample_uri = sample_uri or src
+    objects = []
+    if s3_client is not None and sample_uri.startswith('s3://'):
+        objects = sample_objects(s3_client, sample_uri)
+    if not objects:
+        raise ValueError('No files to sample below {}, unable to verify they can be compacted by concatenating '
+                         'them. Sample the output of a previous run instead.'.format(sample_uri))
+
+    keys = [obj['Key'] for obj in objects]
+    if any(split_extension(key.rsplit('/', 1)[-1])[0].endswith(UNSPLITTABLE_EXTENSIONS) for key in keys):
+        raise ValueError('Files below {} cannot be compacted by concatenating them.'.format(sample_uri))
+    distribution = size_distribution(obj['Size'] for obj in objects)
+    logger.info('Sampled %d files below %s, median size %d bytes, 90th percentile %d bytes',
+                distribution.num_files, sample_uri, distribution.median_bytes, distribution.p90_bytes)
+    if distribution.median_bytes >= COMPACTED_FRACTION * target_size_mb * 1024 ** 2:
+        logger.info('Files below %s are large enough, not compacting them', sample_uri)
+        return None
+    group_by = group_by_pattern(keys, parse_s3_uri(sample_uri)[1])
+    codecs = set(split_extension(key.rsplit('/', 1)[-1])[1] for key in keys)
+    codec = codecs.pop() if len(codecs) == 1 else 'keep'
+
+    return ['--src', src, '--dest', dest, '--groupBy', group_by, '--targetSize', str(target_size_mb),
+            '--outputCodec', output_codec or codec]
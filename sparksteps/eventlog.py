@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""Analyze the Spark event log of an app once it has completed.
+
+Apps write their event log below the S3 path of the run. The log is streamed
+from S3 line by line and only the events needed for the report are decoded.
+Memory stays bounded regardless of the size of the log: stages are summarized
+as soon as they complete, and the median task duration of a stage is estimated
+from a fixed size reservoir sample of its tasks.
+
+The report lists per stage its duration, task skew (the longest task over the
+median task), bytes spilled to disk, GC time and shuffle volume, followed by the idle
+time of the executor cores.
+"""
+import os
+import json
+import uuid
+import random
+import logging
+import datetime
+import collections
+
+from sparksteps.cache import parse_s3_uri
+
+logger = logging.getLogger(__name__)
+
+RESERVOIR_SIZE = 1000
+READ_CHUNK_BYTES = 1024 * 1024
+EVENT_PREFIX = b'{"Event":"'
+EVENTS = frozenset([b'SparkListenerTaskEnd', b'SparkListenerStageCompleted', b'SparkListenerExecutorAdded',
+                    b'SparkListenerExecutorRemoved', b'SparkListenerApplicationStart',
+                    b'SparkListenerApplicationEnd'])
+
+StageReport = collections.namedtuple('StageReport', [
+    'stage_id', 'attempt', 'name', 'duration_s', 'num_tasks', 'task_median_s', 'task_max_s', 'skew',
+    'spill_bytes', 'gc_s', 'shuffle_read_bytes', 'shuffle_write_bytes'])
+Report = collections.namedtuple('Report', 'stages duration_s executor_core_s executor_idle_s')
+
+
+def event_log_uri(bucket, bucket_path):
+    """Returns a new S3 URI below `bucket_path` for apps of a run to write their event logs to."""
+    run_id = '{}-{}'.format(datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+    return os.path.join('s3://', bucket, bucket_path, 'eventlogs', run_id) + '/'
+
+
+def event_log_submit_args(submit_args, log_uri):
+    """
+    Appends the spark-submit arguments writing an uncompressed event log to `log_uri`.
+
+    Examples:
+        >>> event_log_submit_args(['--deploy-mode', 'cluster'], 's3://b/logs/')  # doctest: +NORMALIZE_WHITESPACE
+        ['--deploy-mode', 'cluster', '--conf', 'spark.eventLog.enabled=true',
+         '--conf', 'spark.eventLog.dir=s3://b/logs/', '--conf', 'spark.eventLog.compress=false']
+    """
+    return list(submit_args or []) + ['--conf', 'spark.eventLog.enabled=true',
+                                      '--conf', 'spark.eventLog.dir={}'.format(log_uri),
+                                      '--conf', 'spark.eventLog.compress=false']
+
+
+def parse_events(lines):
+    """
+    Yields the events of an event log which are used in the report, skipping
+    the remaining events without decoding them.
+
+    Examples:
+        >>> list(parse_events([b'{"Event":"SparkListenerJobStart","Job ID":0}',
+        ...                    b'{"Event":"SparkListenerApplicationEnd","Timestamp":5}']))
+        [{'Event': 'SparkListenerApplicationEnd', 'Timestamp': 5}]
+    """
+    for line in lines:
+        if not line.startswith(EVENT_PREFIX):
+            continue
+        if line[len(EVENT_PREFIX):line.find(b'"', len(EVENT_PREFIX))] not in EVENTS:
+            continue
+        try:
+            yield json.loads(line.decode('utf-8'))
+        except ValueError:
+            # The last line may be incomplete when the app was killed.
+            logger.warning('Ignoring malformed event log line of %d bytes', len(line))
+
+
+class Reservoir(object):
+    """Uniform sample of at most `size` values of a stream, used to estimate its median."""
+    def __init__(self, size=RESERVOIR_SIZE, rng=None):
+        self.size = size
+        self.count = 0
+        self.values = []
+        self.rng = rng or random.Random(0)
+
+    def add(self, value):
+        self.count += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            i = self.rng.randrange(self.count)
+            if i < self.size:
+                self.values[i] = value
+
+    def median(self):
+        values = sorted(self.values)
+        return values[len(values) // 2] if values else 0
+
+
+class StageMetrics(object):
+    """Aggregated metrics of the tasks of a running stage attempt."""
+    def __init__(self):
+        self.task_durations = Reservoir()
+        self.task_max_ms = 0
+        self.spill_bytes = 0
+        self.gc_ms = 0
+        self.shuffle_read_bytes = 0
+        self.shuffle_write_bytes = 0
+
+    def add_task(self, duration_ms, metrics):
+        self.task_durations.add(duration_ms)
+        self.task_max_ms = max(self.task_max_ms, duration_ms)
+        # Memory bytes spilled is the deserialized size of the same data, adding it would count the spill twice.
+        self.spill_bytes += metrics.get('Disk Bytes Spilled', 0)
+        self.gc_ms += metrics.get('JVM GC Time', 0)
+        shuffle_read = metrics.get('Shuffle Read Metrics', {})
+        self.shuffle_read_bytes += shuffle_read.get('Remote Bytes Read', 0) + shuffle_read.get('Local Bytes Read', 0)
+        self.shuffle_write_bytes += metrics.get('Shuffle Write Metrics', {}).get('Shuffle Bytes Written', 0)
+
+
+class EventLogAnalyzer(object):
+    """
+    Builds a `Report` from the events of an event log, fed one at a time.
+    """
+    def __init__(self):
+        self.running = {}
+        self.stages = []
+        self.executors = {}  # Executor ID -> [cores, added ms, removed ms, busy ms]
+        self.app_start_ms = None
+        self.app_end_ms = None
+        self.last_ms = 0
+
+    def feed(self, event):
+        name = event['Event']
+        if name == 'SparkListenerTaskEnd':
+            info = event['Task Info']
+            duration_ms = info['Finish Time'] - info['Launch Time']
+            self.last_ms = max(self.last_ms, info['Finish Time'])
+            key = (event['Stage ID'], event.get('Stage Attempt ID', 0))
+            self.running.setdefault(key, StageMetrics()).add_task(duration_ms, event.get('Task Metrics') or {})
+            executor = self.executors.get(info['Executor ID'])
+            if executor is not None:
+                executor[3] += duration_ms
+        elif name == 'SparkListenerStageCompleted':
+            self.complete_stage(event['Stage Info'])
+        elif name == 'SparkListenerExecutorAdded':
+            cores = event['Executor Info']['Total Cores']
+            self.executors[event['Executor ID']] = [cores, event['Timestamp'], None, 0]
+        elif name == 'SparkListenerExecutorRemoved':
+            executor = self.executors.get(event['Executor ID'])
+            if executor is not None:
+                executor[2] = event['Timestamp']
+        elif name == 'SparkListenerApplicationStart':
+            self.app_start_ms = event['Timestamp']
+        elif name == 'SparkListenerApplicationEnd':
+            self.app_end_ms = event['Timestamp']
+
+    def complete_stage(self, info):
+        attempt = info.get('Stage Attempt ID', 0)
+        metrics = self.running.pop((info['Stage ID'], attempt), None) or StageMetrics()
+        submitted_ms, completed_ms = info.get('Submission Time'), info.get('Completion Time')
+        duration_s = None
+        if submitted_ms is not None and completed_ms is not None:
+            duration_s = (completed_ms - submitted_ms) / 1000.0
+        median_ms = metrics.task_durations.median()
+        self.stages.append(StageReport(
+            info['Stage ID'], attempt, info.get('Stage Name', ''), duration_s, metrics.task_durations.count,
+            median_ms / 1000.0, metrics.task_max_ms / 1000.0,
+            metrics.task_max_ms / float(median_ms) if median_ms else None,
+            metrics.spill_bytes, metrics.gc_ms / 1000.0, metrics.shuffle_read_bytes, metrics.shuffle_write_bytes))
+
+    def report(self):
+        end_ms = self.app_end_ms if self.app_end_ms is not None else self.last_ms
+        core_ms = busy_ms = 0
+        for cores, added_ms, removed_ms, executor_busy_ms in self.executors.values():
+            core_ms += cores * max((removed_ms or end_ms) - added_ms, 0)
+            busy_ms += executor_busy_ms
+        duration_s = (end_ms - self.app_start_ms) / 1000.0 if self.app_start_ms is not None else None
+        return Report(list(self.stages), duration_s, core_ms / 1000.0, max(core_ms - busy_ms, 0) / 1000.0)
+
+
+def analyze(lines):
+    """Returns the `Report` of the event log lines `lines`."""
+    analyzer = EventLogAnalyzer()
+    for event in parse_events(lines):
+        analyzer.feed(event)
+    return analyzer.report()
+
+
+def s3_lines(s3_client, bucket, key):
+    """Yields the lines of an S3 object, streaming it in chunks."""
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    pending = b''
+    for chunk in iter(lambda: body.read(READ_CHUNK_BYTES), b''):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def analyze_s3(s3_client, log_uri):
+    """
+    Returns a `Report` per event log below `log_uri`, keyed by the name of the
+    log. Logs rolled over into several files are analyzed as one.
+    """
+    bucket, prefix = parse_s3_uri(log_uri)
+    logs = collections.OrderedDict()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            name = obj['Key'][len(prefix):].lstrip('/').split('/', 1)[0]
+            logs.setdefault(name, []).append(obj['Key'])
+
+    reports = collections.OrderedDict()
+    for name, keys in logs.items():
+        if name.endswith(('.lz4', '.lzf', '.snappy', '.zstd', '.inprogress')):
+            logger.warning('Skipping event log %s, it is compressed or incomplete', name)
+            continue
+        # Rolled over logs consist of events_<n>_<app> files along with appstatus markers.
+        keys = sorted((k for k in keys if not k.rsplit('/', 1)[-1].startswith('appstatus')), key=lambda k: (len(k), k))
+        lines = (line for key in keys for line in s3_lines(s3_client, bucket, key))
+        reports[name] = analyze(lines)
+    return reports
+
+
+def format_report(report, name=''):
+    """Returns a human readable table of a `Report`."""
+    def gib(num_bytes):
+        return '{:.2f}'.format(num_bytes / 1024.0 ** 3)
+
+    def number(value, pattern='{:.1f}'):
+        return pattern.format(value) if value is not None else '-'
+
+    lines = ['Event log {}: {} stages in {}s'.format(name, len(report.stages), number(report.duration_s)),
+             '{:>6} {:>9} {:>7} {:>9} {:>6} {:>10} {:>8} {:>10} {:>11}  {}'.format(
+                 'stage', 'duration', 'tasks', 'median', 'skew', 'spill GiB', 'GC s', 'read GiB', 'write GiB',
+                 'name')]
+    for stage in report.stages:
+        lines.append('{:>6} {:>9} {:>7} {:>9} {:>6} {:>10} {:>8} {:>10} {:>11}  {}'.format(
+            '{}.{}'.format(stage.stage_id, stage.attempt), number(stage.duration_s), stage.num_tasks,
+            number(stage.task_median_s, '{:.2f}'), number(stage.skew), gib(stage.spill_bytes),
+            number(stage.gc_s), gib(stage.shuffle_read_bytes), gib(stage.shuffle_write_bytes), stage.name))
+    if report.executor_core_s:
+        lines.append('Executor cores were idle for {:.0f}s of {:.0f}s ({:.0%})'.format(
+            report.executor_idle_s, report.executor_core_s, report.executor_idle_s / report.executor_core_s))
+    return '\n'.join(lines)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Delete staged files and logs below the S3 path which are no longer used.
+
+Staged sources, debug logs, event logs and cached bootstrap results pile up
+below ``s3://<s3-bucket>/<s3-path>/``. The prefix is listed concurrently, one
+listing per top level directory, and every object is kept when
+
+* a run recorded in a journal modified within the retention period uploaded
+  or references it,
+* an active cluster references it from the arguments of its steps or
+  bootstrap actions, or it is a debug log of an active cluster,
+* it was modified within the retention period, or
+* it is one of the most recently modified objects.
+
+The remaining objects are deleted with batched requests, unless dry running.
+"""
+import os
+import glob
+import json
+import time
+import logging
+import argparse
+import collections
+import concurrent.futures
+
+from sparksteps.journal import ACTIVE_CLUSTER_STATES, DEFAULT_JOURNAL_DIR
+from sparksteps.session import Session
+
+logger = logging.getLogger(__name__)
+LOGFORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+
+DEFAULT_KEEP_DAYS = 7
+DEFAULT_KEEP_LATEST = 100
+DELETE_BATCH_SIZE = 1000  # Maximum number of keys per DeleteObjects request.
+LIST_WORKERS = 8
+
+S3Object = collections.namedtuple('S3Object', 'key size last_modified')
+Report = collections.namedtuple('Report', 'kept deleted deleted_bytes errors')
+
+
+def list_prefix(s3_client, bucket, prefix, max_workers=LIST_WORKERS):
+    """Returns the objects below `prefix`, listing every top level directory concurrently."""
+    def list_all(sub_prefix, delimiter=None):
+        objects, directories = [], []
+        kwargs = {'Bucket': bucket, 'Prefix': sub_prefix}
+        if delimiter:
+            kwargs['Delimiter'] = delimiter
+        for page in s3_client.get_paginator('list_objects_v2').paginate(**kwargs):
+            objects.extend(S3Object(o['Key'], o['Size'], o['LastModified'].timestamp())
+                           for o in page.get('Contents', []))
+            directories.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+        return objects, directories
+
+    objects, directories = list_all(prefix, delimiter='/')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for directory_objects, _ in executor.map(list_all, directories):
+            objects.extend(directory_objects)
+    return objects
+
+
+def s3_uris(value, bucket):
+    """
+    Yields the S3 URIs of `bucket` in a value, such as a step argument or a
+    journal record, looking inside lists, dicts and arguments of the form key=value.
+
+    Examples:
+        >>> list(s3_uris(['--src=s3://b/logs/', 's3://other/x', {'uri': 's3://b/sources/a.py'}], 'b'))
+        ['s3://b/logs/', 's3://b/sources/a.py']
+    """
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from s3_uris(item, bucket)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from s3_uris(item, bucket)
+    elif isinstance(value, str):
+        start = value.find('s3://{}/'.format(bucket))
+        if start >= 0:
+            yield value[start:].split(',', 1)[0]
+
+
+def journal_references(bucket, journal_dir, since):
+    """Returns the S3 URIs of `bucket` recorded in journals modified since `since`."""
+    uris = set()
+    for path in glob.glob(os.path.join(journal_dir, '*.jsonl')):
+        if os.path.getmtime(path) < since:
+            continue
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('event') == 'upload' and record.get('bucket') == bucket:
+                    uris.add('s3://{}/{}'.format(bucket, record['key']))
+                uris.update(s3_uris(record, bucket))
+    return uris
+
+
+def cluster_references(emr_client, bucket):
+    """
+    Returns the S3 URIs of `bucket` referenced by the steps and bootstrap
+    actions of active clusters, along with the IDs of the active clusters.
+    """
+    uris, cluster_ids = set(), []
+    for page in emr_client.get_paginator('list_clusters').paginate(ClusterStates=list(ACTIVE_CLUSTER_STATES)):
+        cluster_ids.extend(c['Id'] for c in page['Clusters'])
+    for cluster_id in cluster_ids:
+        for page in emr_client.get_paginator('list_steps').paginate(ClusterId=cluster_id):
+            for step in page['Steps']:
+                uris.update(s3_uris(step['Config'].get('Args', []), bucket))
+        for page in emr_client.get_paginator('list_bootstrap_actions').paginate(ClusterId=cluster_id):
+            for action in page['BootstrapActions']:
+                uris.update(s3_uris([action['ScriptPath']] + action.get('Args', []), bucket))
+    return uris, cluster_ids
+
+
+def plan(objects, bucket, bucket_path, references, active_cluster_ids, since, keep_latest=DEFAULT_KEEP_LATEST):
+    """
+    Returns the keys of `objects` to keep, mapped to why, and the objects to delete.
+
+    Args:
+        objects (list): `S3Object`s below `bucket_path`.
+        references (set): S3 URIs in use, objects equal to or below them are kept.
+        active_cluster_ids (list): clusters whose debug logs are kept.
+        since (float): objects modified since are kept.
+        keep_latest (int): number of most recently modified objects kept.
+    """
+    referenced_keys = sorted(uri[len('s3://{}/'.format(bucket)):] for uri in references)
+    log_prefixes = tuple(os.path.join(bucket_path, 'logs', cluster_id) + '/' for cluster_id in active_cluster_ids)
+    latest = {o.key for o in sorted(objects, key=lambda o: o.last_modified, reverse=True)[:keep_latest]}
+
+    keep, delete = {}, []
+    for obj in objects:
+        if any(obj.key == key or (key and obj.key.startswith(key)) for key in referenced_keys):
+            keep[obj.key] = 'referenced'
+        elif log_prefixes and obj.key.startswith(log_prefixes):
+            keep[obj.key] = 'active cluster'
+        elif obj.last_modified >= since:
+            keep[obj.key] = 'recent'
+        elif obj.key in latest:
+            keep[obj.key] = 'latest'
+        else:
+            delete.append(obj)
+    return keep, delete
+
+
+def delete_objects(s3_client, bucket, keys, batch_size=DELETE_BATCH_SIZE):
+    """Deletes `keys` in batches and returns the keys which could not be deleted."""
+    errors = []
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i:i + batch_size]
+        response = s3_client.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+        for error in response.get('Errors', []):
+            logger.warning('Failed to delete s3://%s/%s: %s', bucket, error['Key'], error.get('Message'))
+            errors.append(error['Key'])
+    return errors
+
+
+def collect(s3_client, emr_client, bucket, bucket_path, keep_days=DEFAULT_KEEP_DAYS, keep_latest=DEFAULT_KEEP_LATEST,
+            journal_dir=DEFAULT_JOURNAL_DIR, dry_run=False, now=None):
+    """
+    Deletes the unused objects below `bucket_path`, or only reports them when
+    `dry_run` is set, and returns a `Report`. Without an `emr_client` active
+    clusters are not looked up.
+    """
+    if not bucket_path.strip('/'):
+        raise ValueError('Refusing to collect garbage in the root of bucket {}.'.format(bucket))
+    bucket_path = bucket_path.rstrip('/') + '/'
+    since = (now if now is not None else time.time()) - keep_days * 24 * 60 * 60
+
+    references = journal_references(bucket, journal_dir, since)
+    active_cluster_ids = []
+    if emr_client is not None:
+        cluster_uris, active_cluster_ids = cluster_references(emr_client, bucket)
+        references |= cluster_uris
+    objects = list_prefix(s3_client, bucket, bucket_path)
+    keep, delete = plan(objects, bucket, bucket_path, references, active_cluster_ids, since, keep_latest)
+
+    deleted_bytes = sum(obj.size for obj in delete)
+    reasons = collections.Counter(keep.values())
+    logger.info('Keeping %d objects (%s), %s %d objects of %.1f MiB below s3://%s/%s', len(keep),
+                ', '.join('{} {}'.format(n, reason) for reason, n in sorted(reasons.items())) or 'none',
+                'would delete' if dry_run else 'deleting', len(delete), deleted_bytes / 1024.0 ** 2, bucket,
+                bucket_path)
+    for obj in delete:
+        logger.debug('%s s3://%s/%s', 'Would delete' if dry_run else 'Deleting', bucket, obj.key)
+    errors = [] if dry_run else delete_objects(s3_client, bucket, [obj.key for obj in delete])
+    return Report(sorted(keep), [obj.key for obj in delete], deleted_bytes, errors)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Delete staged files and logs below s3-path which are not used.')
+    parser.add_argument('--aws-region', required=True)
+    parser.add_argument('--s3-bucket', required=True)
+    parser.add_argument('--s3-path', default='sparksteps/')
+    parser.add_argument('--keep-days', type=float, default=DEFAULT_KEEP_DAYS)
+    parser.add_argument('--keep-latest', type=int, default=DEFAULT_KEEP_LATEST)
+    parser.add_argument('--journal-dir', default=DEFAULT_JOURNAL_DIR)
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--log-level', '-l', type=str.upper, default='INFO')
+    return parser
+
+
+def main(args=None):
+    args = create_parser().parse_args(args)
+    logging.basicConfig(format=LOGFORMAT)
+    logging.getLogger('sparksteps').setLevel(getattr(logging, args.log_level, None))
+
+    session = Session(aws_region=args.aws_region)
+    report = collect(session.s3.meta.client, session.emr, args.s3_bucket, args.s3_path,
+                     keep_days=args.keep_days, keep_latest=args.keep_latest, journal_dir=args.journal_dir,
+                     dry_run=args.dry_run)
+    if report.errors:
+        raise SystemExit('Failed to delete {} objects'.format(len(report.errors)))
+
+
+if __name__ == '__main__':
+    main()
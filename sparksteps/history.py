@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""Record the runs of apps in a local SQLite database.
+
+Every run records a digest of the app, the instance groups of its cluster, the
+duration of each step from the EMR timeline, its outcome and what it cost.
+Runs are only recorded when a database is given. The recorded runtimes of the
+steps of an app tell the waiter when the step it waits for is expected to
+finish, and
+``sparksteps-history`` reports the median and 95th percentile runtimes per app
+and step.
+"""
+import os
+import json
+import time
+import logging
+import sqlite3
+import argparse
+import threading
+
+from sparksteps.steps import path_digest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.sparksteps', 'history.sqlite')
+LOGFORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+ESTIMATE_RUNS = 20  # Number of recent successful runs runtimes are estimated from.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    app TEXT NOT NULL,
+    app_hash TEXT,
+    cluster_id TEXT,
+    instance_groups TEXT,
+    started_at REAL,
+    ended_at REAL,
+    outcome TEXT,
+    hourly_price REAL,
+    cost REAL
+);
+CREATE INDEX IF NOT EXISTS runs_app ON runs (app, outcome);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    state TEXT,
+    started_at REAL,
+    ended_at REAL
+);
+"""
+
+
+def app_name(path):
+    """
+    Returns the name runs of an app are recorded under: the URI of apps on S3
+    and the absolute path of local apps, so that apps sharing a file name are
+    told apart.
+
+    Examples:
+        >>> app_name('s3://my-bucket/apps/episodes.py'), app_name('/home/me/examples/../episodes.py')
+        ('s3://my-bucket/apps/episodes.py', '/home/me/episodes.py')
+    """
+    return path if path.startswith('s3://') else os.path.abspath(path)
+
+
+def app_hash(path):
+    """Returns a digest of a local app, or its URI for apps on S3."""
+    return path if path.startswith('s3://') else path_digest(path)
+
+
+def percentile(values, q):
+    """
+    Returns the `q`th percentile of `values` by linear interpolation.
+
+    Examples:
+        >>> percentile([10, 20, 30, 40], 50), percentile([10, 20, 30, 40], 95)
+        (25.0, 38.5)
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * q / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def instance_groups(emr_client, cluster_id):
+    """Returns the role, instance type, count, market and bid price of the instance groups of a cluster."""
+    groups = []
+    paginator = emr_client.get_paginator('list_instance_groups')
+    for page in paginator.paginate(ClusterId=cluster_id):
+        for group in page['InstanceGroups']:
+            groups.append({'role': group['InstanceGroupType'], 'instance_type': group['InstanceType'],
+                           'count': group.get('RequestedInstanceCount', 0), 'market': group.get('Market'),
+                           'bid_price': float(group['BidPrice']) if group.get('BidPrice') else None})
+    return groups
+
+
+def hourly_price(groups, demand_price_func):
+    """
+    Returns the hourly price of instance groups, spot instances at their bid
+    price and on-demand instances at `demand_price_func(instance_type)`.
+    """
+    return sum(g['count'] * (g['bid_price'] if g['market'] == 'SPOT' and g['bid_price'] is not None
+                             else demand_price_func(g['instance_type']))
+               for g in groups)
+
+
+class History(object):
+    """
+    Runs of apps stored in a SQLite database.
+
+    Args:
+        path (str): file the database is stored in.
+    """
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # Runs may be recorded from other threads than the one which opened the database.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def record_run(self, app, timings, outcome, cluster_id=None, groups=None, hourly_price=None, app_digest=None):
+        """
+        Records a run of `app` and the `StepTiming`s of its steps, returning the ID of the run.
+        """
+        starts = [t.start for t in timings if t.start is not None]
+        ends = [t.end for t in timings if t.end is not None]
+        started_at = min(starts) if starts else None
+        ended_at = max(ends) if ends else time.time()
+        cost = None
+        if hourly_price is not None and started_at is not None:
+            cost = hourly_price * (ended_at - started_at) / 3600.0
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO runs (app, app_hash, cluster_id, instance_groups, started_at, ended_at, outcome, '
+                'hourly_price, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (app_name(app), app_digest, cluster_id, json.dumps(groups) if groups is not None else None,
+                 started_at, ended_at, outcome, hourly_price, cost))
+            run_id = cursor.lastrowid
+            self._conn.executemany('INSERT INTO steps (run_id, name, state, started_at, ended_at) '
+                                   'VALUES (?, ?, ?, ?, ?)',
+                                   [(run_id, t.name, t.state, t.start, t.end) for t in timings])
+        logger.info('Recorded %s run of %s in %s', outcome, app_name(app), self.path)
+        return run_id
+
+    def runtimes(self, app, step, limit=ESTIMATE_RUNS):
+        """Returns the runtimes in seconds of `step` in the most recent successful runs of `app`."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT steps.ended_at - steps.started_at FROM steps JOIN runs ON runs.id = steps.run_id '
+                'WHERE runs.app = ? AND runs.outcome = ? AND steps.name = ? AND steps.state = ? '
+                'AND steps.started_at IS NOT NULL AND steps.ended_at IS NOT NULL '
+                'ORDER BY runs.id DESC LIMIT ?', (app_name(app), 'COMPLETED', step, 'COMPLETED', limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def estimate_runtime(self, app, step):
+        """Returns the median runtime in seconds of `step` in the recent successful runs of `app`, or None."""
+        return percentile(self.runtimes(app, step), 50)
+
+    def step_percentiles(self, app=None):
+        """
+        Returns the number of completed runs and the median and 95th percentile
+        duration in seconds of every step, per app.
+        """
+        query = ('SELECT runs.app, steps.name, steps.ended_at - steps.started_at FROM steps '
+                 'JOIN runs ON runs.id = steps.run_id '
+                 'WHERE steps.state = ? AND steps.started_at IS NOT NULL AND steps.ended_at IS NOT NULL')
+        params = ['COMPLETED']
+        if app is not None:
+            query += ' AND runs.app = ?'
+            params.append(app_name(app))
+        durations = {}
+        with self._lock:
+            for name, step, duration in self._conn.execute(query + ' ORDER BY runs.app, steps.rowid', params):
+                durations.setdefault((name, step), []).append(duration)
+        return [(name, step, len(values), percentile(values, 50), percentile(values, 95))
+                for (name, step), values in durations.items()]
+
+
+def format_percentiles(rows):
+    lines = ['{:<30} {:<40} {:>5} {:>9} {:>9}'.format('app', 'step', 'runs', 'p50 s', 'p95 s')]
+    lines.extend('{:<30} {:<40} {:>5} {:>9.1f} {:>9.1f}'.format(*row) for row in rows)
+    return '\n'.join(lines)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Report the median and 95th percentile step runtimes per app.')
+    parser.add_argument('app', nargs='?', help='only report on this app')
+    parser.add_argument('--history', default=DEFAULT_HISTORY_PATH)
+    parser.add_argument('--log-level', '-l', type=str.upper, default='INFO')
+    return parser
+
+
+def main(args=None):
+    args = create_parser().parse_args(args)
+    logging.basicConfig(format=LOGFORMAT)
+    logging.getLogger('sparksteps').setLevel(getattr(logging, args.log_level, None))
+
+    history = History(args.history)
+    try:
+        print(format_percentiles(history.step_percentiles(args.app)))
+    finally:
+        history.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Journal the completed phases of a run so that it can be resumed.
+
+Every launched cluster, uploaded object and submitted step is appended to the
+journal as a JSON line and synced to disk right away. When a run is resumed,
+live clusters are reused, files whose contents did not change are not
+uploaded again and steps which were submitted are not submitted again.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.sparksteps', 'journals')
+ACTIVE_CLUSTER_STATES = frozenset(['STARTING', 'BOOTSTRAPPING', 'RUNNING', 'WAITING'])
+# Arguments which do not change what a run launches, stages or submits.
+VOLATILE_ARGS = frozenset(['resume', 'journal', 'log_level', 'wait', 'dry_run', 'debug', 'history'])
+
+
+def default_journal_path(args_dict):
+    """Returns a journal path specific to the arguments of a run."""
+    args = {k: v for k, v in args_dict.items() if k not in VOLATILE_ARGS}
+    digest = hashlib.sha256(json.dumps(args, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return os.path.join(DEFAULT_JOURNAL_DIR, digest[:16] + '.jsonl')
+
+
+class Journal(object):
+    """
+    Append-only record of the phases of a run which have completed.
+
+    Args:
+        path (str): file the journal is stored in.
+        records (list): records of a previous attempt.
+    """
+    def __init__(self, path, records=()):
+        self.path = path
+        self.records = list(records)
+        # Clusters are launched while files are staged, both are recorded.
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path, resume=False):
+        """
+        Opens the journal at `path`. Unless resuming, or when the previous attempt
+        finished, the journal is cleared.
+        """
+        records = []
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # The last record may be incomplete when the previous attempt was killed while writing it.
+                        logger.warning('Ignoring incomplete journal record: %s', line.strip())
+            if any(r['event'] == 'finished' for r in records):
+                logger.info('Previous run recorded in %s has finished, starting over.', path)
+                records = []
+            else:
+                logger.info('Resuming from %d journal records in %s', len(records), path)
+        elif resume:
+            logger.info('No journal found at %s, starting over.', path)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        journal = cls(path, records)
+        if not records:
+            open(path, 'w').close()
+        return journal
+
+    def record(self, event, **fields):
+        """Appends a record to the journal and syncs it to disk."""
+        record = dict(fields, event=event)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            self.records.append(record)
+
+    def record_steps(self, cluster_id, step_ids):
+        self.record('steps', cluster_id=cluster_id, step_ids=list(step_ids))
+
+    def events(self, event):
+        return [r for r in self.records if r['event'] == event]
+
+    @property
+    def cluster_ids(self):
+        """IDs of the clusters launched by the last attempt which launched clusters."""
+        launches = self.events('clusters')
+        return launches[-1]['cluster_ids'] if launches else []
+
+    def active_cluster_ids(self, emr_client):
+        """
+        Returns the IDs of the recorded clusters if all of them are still alive,
+        otherwise an empty list.
+        """
+        cluster_ids = self.cluster_ids
+        for cluster_id in cluster_ids:
+            state = emr_client.describe_cluster(ClusterId=cluster_id)['Cluster']['Status']['State']
+            if state not in ACTIVE_CLUSTER_STATES:
+                logger.info('Recorded cluster %s is %s, launching new clusters.', cluster_id, state)
+                return []
+        return cluster_ids
+
+    def is_uploaded(self, bucket, key, digest):
+        return any(r['bucket'] == bucket and r['key'] == key and r['digest'] == digest
+                   for r in self.events('upload'))
+
+    def step_ids(self, cluster_id):
+        """IDs of the steps submitted to `cluster_id`, in order of submission."""
+        return [step_id for r in self.events('steps') if r['cluster_id'] == cluster_id for step_id in r['step_ids']]
+
+    def jobs(self):
+        """Maps the names of submitted pipeline jobs to their (cluster ID, step ID)."""
+        return {r['name']: (r['cluster_id'], r['step_id']) for r in self.events('job')}
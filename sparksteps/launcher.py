@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Overlap cluster provisioning with staging files onto S3."""
+import logging
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+
+def launch_clusters(emr_client, cluster_config, num_clusters=1):
+    """Launch `num_clusters` clusters using `cluster_config` and return their IDs."""
+    cluster_ids = []
+    for _ in range(num_clusters):
+        response = emr_client.run_job_flow(**cluster_config)
+        cluster_ids.append(response['JobFlowId'])
+        logger.info("Cluster ID: %s", response['JobFlowId'])
+    return cluster_ids
+
+
+def launch_and_stage(emr_client, launch, stage):
+    """
+    Runs `launch`, which requests clusters and returns their IDs, concurrently
+    with `stage`, which uploads files and returns the steps to submit, so
+    that steps can be submitted as soon as both have completed.
+
+    When staging fails the launched clusters are terminated, as no steps
+    will be submitted to them.
+
+    Returns:
+        tuple: the cluster IDs returned by `launch` and the result of `stage`.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        launch_future = executor.submit(launch)
+        stage_future = executor.submit(stage)
+        try:
+            staged = stage_future.result()
+        except Exception:
+            if launch_future.exception() is None and launch_future.result():
+                cluster_ids = launch_future.result()
+                logger.info("Staging failed, terminating clusters %s", ', '.join(cluster_ids))
+                emr_client.terminate_job_flows(JobFlowIds=cluster_ids)
+            raise
+        return launch_future.result(), staged
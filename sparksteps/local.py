@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Run the steps generated for EMR on the local machine.
+
+Files are staged to a directory standing in for S3, and the steps which would
+be submitted to EMR run against a local directory standing in for the home
+directory of the master node. Copies run in parallel, then unzips, after which
+apps are submitted to a local Spark installation.
+"""
+import os
+import time
+import shutil
+import logging
+import zipfile
+import subprocess
+import concurrent.futures
+
+from sparksteps.cache import parse_s3_uri
+from sparksteps.poll import FAILED_STATE, StepTiming
+from sparksteps.steps import REMOTE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_DIR = os.path.join(os.path.expanduser('~'), '.sparksteps', 'local')
+STAGING_WORKERS = 8  # Copies and unzips are I/O bound.
+# Commands which only exist on EMR clusters.
+EMR_ONLY_COMMANDS = frozenset(['s3-dist-cp', 'state-pusher-script'])
+
+
+def is_copy(step):
+    return step['HadoopJarStep']['Args'][:3] == ['aws', 's3', 'cp']
+
+
+def is_unzip(step):
+    return step['HadoopJarStep']['Args'][0] == 'unzip'
+
+
+def without_deploy_mode(args):
+    """
+    Removes the deploy mode from spark-submit arguments, local Spark only runs in client mode.
+
+    Examples:
+        >>> without_deploy_mode(['--deploy-mode', 'cluster', '--num-executors', '2'])
+        ['--num-executors', '2']
+    """
+    local_args = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg == '--deploy-mode':
+            skip = True
+        elif not arg.startswith('--deploy-mode='):
+            local_args.append(arg)
+    return local_args
+
+
+class LocalBucket(object):
+    def __init__(self, s3, name):
+        self.s3 = s3
+        self.name = name
+
+    def put_object(self, Key, Body):
+        path = self.s3.path(self.name, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(Body, f)
+        return {'Key': Key}
+
+
+class LocalS3(object):
+    """
+    Stand-in for a boto3 S3 resource, storing objects as files below `root`.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.meta = self
+        self.client = self
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def Bucket(self, name):
+        return LocalBucket(self, name)
+
+    def upload_file(self, Filename, Bucket, Key):
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path)
+
+
+class LocalRunner(object):
+    """
+    Runs EMR steps on the local machine.
+
+    Args:
+        root (str): directory standing in for the master node, the home
+            directory of the master node maps to `root`/home.
+        s3 (LocalS3): store the files of the steps were staged to.
+        spark_home (str): Spark installation running apps, defaults to spark-submit on the PATH.
+        s3_client: boto3 S3 client downloading objects which were not staged to `s3`.
+        step_concurrency_level (int): number of concurrent apps to run at once.
+    """
+    def __init__(self, root, s3, spark_home=None, s3_client=None, step_concurrency_level=1):
+        self.home = os.path.join(root, 'home')
+        self.log_dir = os.path.join(root, 'logs')
+        self.s3 = s3
+        self.spark_home = spark_home
+        self.s3_client = s3_client
+        self.step_concurrency_level = step_concurrency_level
+
+    def local_args(self, args):
+        """Maps paths on the master node to the local home directory."""
+        return [arg.replace(REMOTE_DIR, self.home + os.sep) for arg in args]
+
+    def copy(self, uri, dest_dir):
+        bucket, key = parse_s3_uri(uri)
+        src = self.s3.path(bucket, key)
+        dest = os.path.join(dest_dir, os.path.basename(key))
+        if os.path.exists(src):
+            shutil.copyfile(src, dest)
+        elif self.s3_client is not None:
+            self.s3_client.download_file(bucket, key, dest)
+        else:
+            raise FileNotFoundError('{} was not staged locally.'.format(uri))
+
+    def execute(self, name, args):
+        """Runs a command, writing its output to a log file, and returns whether it succeeded."""
+        if args[0] == 'spark-submit':
+            spark_submit = os.path.join(self.spark_home, 'bin', 'spark-submit') if self.spark_home else 'spark-submit'
+            args = [spark_submit] + without_deploy_mode(args[1:])
+        log_path = os.path.join(self.log_dir, '{}.log'.format(name.replace(os.sep, '_')))
+        with open(log_path, 'wb') as log:
+            returncode = subprocess.call(args, cwd=self.home, stdout=log, stderr=subprocess.STDOUT)
+        if returncode != 0:
+            logger.error('%s exited with status %d, see %s', name, returncode, log_path)
+        return returncode == 0
+
+    def run_step(self, step):
+        """Runs a single step and returns its `StepTiming`."""
+        name = step['Name']
+        args = self.local_args(step['HadoopJarStep']['Args'])
+        start = time.time()
+        state = 'COMPLETED'
+        try:
+            if is_copy(step):
+                self.copy(args[3], args[4])
+            elif is_unzip(step):
+                with zipfile.ZipFile(args[2]) as archive:
+                    archive.extractall(args[4])
+            elif args[0] in EMR_ONLY_COMMANDS:
+                logger.warning('Skipping %s, %s is only available on EMR', name, args[0])
+                state = 'SKIPPED'
+            elif not self.execute(name, args):
+                state = 'FAILED'
+        except (OSError, zipfile.BadZipFile) as e:
+            logger.error('%s failed: %s', name, e)
+            state = 'FAILED'
+        return StepTiming(name, state, start, time.time())
+
+    def run(self, emr_steps, concurrent_apps=False):
+        """
+        Runs `emr_steps` and returns a `StepTiming` per step.
+
+        Copies run in parallel, followed by unzips. The remaining steps run
+        one after another, or `step_concurrency_level` at a time when
+        `concurrent_apps` is set. Once a step fails, the steps EMR would cancel
+        are not run.
+        """
+        os.makedirs(self.home, exist_ok=True)
+        os.makedirs(self.log_dir, exist_ok=True)
+        copies = [s for s in emr_steps if is_copy(s)]
+        unzips = [s for s in emr_steps if is_unzip(s)]
+        others = [s for s in emr_steps if not is_copy(s) and not is_unzip(s)]
+        waves = [(copies, STAGING_WORKERS), (unzips, STAGING_WORKERS)]
+        if concurrent_apps:
+            waves.append((others, self.step_concurrency_level))
+        else:
+            waves.extend(([s], 1) for s in others)
+
+        timings = {}
+        cancelled = False
+        for wave, workers in waves:
+            if cancelled:
+                timings.update((id(s), StepTiming(s['Name'], 'CANCELLED', None, None)) for s in wave)
+                continue
+            if not wave:
+                continue
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(wave))) as executor:
+                for step, timing in zip(wave, executor.map(self.run_step, wave)):
+                    timings[id(step)] = timing
+                    if timing.state in FAILED_STATE and step['ActionOnFailure'] != 'CONTINUE':
+                        cancelled = True
+        return [timings[id(s)] for s in emr_steps]
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""Schedule pipelines of dependent Spark apps onto EMR clusters.
+
+A pipeline is described by a JSON file of the form::
+
+    {
+      "uploads": ["examples/lib"],
+      "jobs": {
+        "extract": {"app": "extract.py", "app_args": "--date 2020-01-01"},
+        "report": {"app": "report.py", "submit_args": "--deploy-mode cluster",
+                   "depends_on": ["extract"]}
+      }
+    }
+
+Jobs may declare the S3 URIs they read and write as "inputs" and "outputs",
+which allows skipping them when their results are cached.
+"""
+import json
+import shlex
+import logging
+import functools
+import collections
+
+from polling import poll
+
+from sparksteps import steps
+from sparksteps.poll import FAILED_STATE, NON_TERMINAL_STATES, get_step_states
+from sparksteps.submit import submit_after_staging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STEP_CONCURRENCY_LEVEL = 4
+DEFAULT_SLEEP_INTERVAL_SECONDS = 30
+
+Job = collections.namedtuple('Job', 'name app depends_on inputs outputs')
+Job.__new__.__defaults__ = ((), ())
+Pipeline = collections.namedtuple('Pipeline', 'jobs uploads')
+
+
+def parse_args_value(value):
+    """Accept spark-submit and app arguments either as a list or as a shell string."""
+    if value is None or isinstance(value, list):
+        return value
+    return shlex.split(value)
+
+
+def topological_order(jobs):
+    """
+    Returns `jobs` ordered such that every job follows the jobs it depends on,
+    raising a ValueError for unknown dependencies and cycles.
+    """
+    by_name = {job.name: job for job in jobs}
+    for job in jobs:
+        unknown = set(job.depends_on) - set(by_name)
+        if unknown:
+            raise ValueError('Job {} depends on unknown jobs: {}.'.format(job.name, ', '.join(sorted(unknown))))
+
+    ordered = []
+    visiting = set()
+    visited = set()
+
+    def visit(job, path):
+        if job.name in visited:
+            return
+        if job.name in visiting:
+            raise ValueError('Pipeline contains a cycle: {}.'.format(' -> '.join(path + [job.name])))
+        visiting.add(job.name)
+        for dependency in job.depends_on:
+            visit(by_name[dependency], path + [job.name])
+        visiting.discard(job.name)
+        visited.add(job.name)
+        ordered.append(job)
+
+    for job in jobs:
+        visit(job, [])
+    return ordered
+
+
+def parse_pipeline(spec):
+    """Parse a pipeline specification dictionary."""
+    if not spec.get('jobs'):
+        raise ValueError('Pipeline does not define any jobs.')
+
+    jobs = []
+    for name, job_spec in spec['jobs'].items():
+        if 'app' not in job_spec:
+            raise ValueError('Job {} does not specify an app.'.format(name))
+        app = steps.App(job_spec['app'],
+                        parse_args_value(job_spec.get('submit_args')),
+                        parse_args_value(job_spec.get('app_args')))
+        jobs.append(Job(name, app, tuple(job_spec.get('depends_on', ())),
+                        tuple(job_spec.get('inputs', ())), tuple(job_spec.get('outputs', ()))))
+    return Pipeline(topological_order(jobs), list(spec.get('uploads', [])))
+
+
+def sweep_jobs(app, variants):
+    """
+    Returns an independent job per variant of app arguments, each of which is
+    appended to the app arguments of `app`.
+
+    Examples:
+        >>> [job.name for job in sweep_jobs(steps.App('job.py', None, None), [['a'], ['b']])]
+        ['job.py [1]', 'job.py [2]']
+    """
+    basename = steps.get_basename(app.path)
+    return [Job('{} [{}]'.format(basename, i),
+                steps.App(app.path, app.submit_args, (app.app_args or []) + list(variant)),
+                ())
+            for i, variant in enumerate(variants, 1)]
+
+
+def load_pipeline(path):
+    """Load a pipeline specification from a JSON file."""
+    with open(path) as f:
+        return parse_pipeline(json.load(f))
+
+
+class JobStep(steps.SparkStep):
+    # A failing job must not cancel the steps of independent branches.
+    on_failure = 'CONTINUE'
+
+    def __init__(self, job):
+        super(JobStep, self).__init__(job.app.path, job.app.submit_args, job.app.app_args)
+        self.job_name = job.name
+
+    @property
+    def step_name(self):
+        return "Run {}".format(self.job_name)
+
+
+class PipelineScheduler(object):
+    """
+    Runs the jobs of a pipeline on one or more clusters, submitting each job as
+    soon as the jobs it depends on have completed. Each cluster runs up to
+    `step_concurrency_level` jobs at a time. When a job fails, the jobs which
+    (transitively) depend on it are cancelled while other branches carry on.
+
+    Submissions are recorded in `journal`, if given. Jobs recorded in it by a
+    previous attempt are matched by name and not submitted again.
+
+    Given a `cache`, jobs declaring outputs whose results are cached are
+    completed without submitting them, and completed jobs are recorded in it.
+    """
+    def __init__(self, emr_client, cluster_ids, jobs, step_concurrency_level=1, journal=None, cache=None):
+        self.emr_client = emr_client
+        self.cluster_ids = list(cluster_ids)
+        self.jobs = topological_order(jobs)
+        self.step_concurrency_level = step_concurrency_level
+        self.journal = journal
+        self.cache = cache
+        self.cache_keys = {}  # Job name to cache key
+        self.cached = set()
+        self.states = collections.OrderedDict((job.name, 'PENDING') for job in self.jobs)
+        self.placement = {}  # Job name to (cluster ID, step ID)
+        if journal is not None:
+            self.placement.update((name, tuple(placement)) for name, placement in journal.jobs().items()
+                                  if name in self.states and placement[0] in self.cluster_ids)
+
+    @property
+    def done(self):
+        return not any(state in NON_TERMINAL_STATES for state in self.states.values())
+
+    def running(self, cluster_id):
+        return [name for name, (cid, _) in self.placement.items()
+                if cid == cluster_id and self.states[name] in NON_TERMINAL_STATES]
+
+    def ready_jobs(self):
+        return [job for job in self.jobs
+                if job.name not in self.placement and self.states[job.name] == 'PENDING'
+                and all(self.states[d] == 'COMPLETED' for d in job.depends_on)]
+
+    def is_cached(self, job):
+        """Completes `job` if its results are cached, looking it up once."""
+        if self.cache is None or not job.outputs or job.name in self.cache_keys:
+            return False
+        key = self.cache_keys[job.name] = self.cache.key(job.app, job.inputs)
+        if self.cache.lookup(key) is None:
+            return False
+        logger.info('Job %s is cached, skipping it', job.name)
+        self.states[job.name] = 'COMPLETED'
+        self.cached.add(job.name)
+        return True
+
+    def uncached_ready_jobs(self):
+        """Returns the ready jobs which are not cached, completing the cached ones."""
+        while True:
+            ready = self.ready_jobs()
+            # Completing cached jobs may make the jobs depending on them ready.
+            if not [job for job in ready if self.is_cached(job)]:
+                return ready
+
+    def assign(self, jobs):
+        """Distribute `jobs` over the clusters with spare capacity, least loaded first."""
+        load = {cluster_id: len(self.running(cluster_id)) for cluster_id in self.cluster_ids}
+        assignment = collections.OrderedDict((cluster_id, []) for cluster_id in self.cluster_ids)
+        for job in jobs:
+            cluster_id = min(self.cluster_ids, key=lambda c: load[c])
+            if load[cluster_id] >= self.step_concurrency_level:
+                break
+            assignment[cluster_id].append(job)
+            load[cluster_id] += 1
+        return assignment
+
+    def record_submission(self, cluster_id, jobs, step_ids):
+        for job, step_id in zip(jobs, step_ids):
+            logger.info('Submitted job %s to cluster %s as step %s', job.name, cluster_id, step_id)
+            self.placement[job.name] = (cluster_id, step_id)
+            self.states[job.name] = 'PENDING'
+            if self.journal is not None:
+                self.journal.record('job', name=job.name, cluster_id=cluster_id, step_id=step_id)
+
+    def start(self, staging_steps):
+        """Stage files onto every cluster and submit the jobs which do not depend on other jobs."""
+        for cluster_id, jobs in self.assign(self.uncached_ready_jobs()).items():
+            if not staging_steps and not jobs:
+                continue
+            submitted_step_ids, on_submit = (), None
+            if self.journal is not None:
+                # Jobs submitted before are placed by name, only the staging steps lead the recorded steps.
+                submitted_step_ids = self.journal.step_ids(cluster_id)[:len(staging_steps)]
+                on_submit = functools.partial(self.journal.record_steps, cluster_id)
+            step_ids = submit_after_staging(self.emr_client, cluster_id, staging_steps,
+                                            [JobStep(job).step for job in jobs],
+                                            step_concurrency_level=self.step_concurrency_level,
+                                            submitted_step_ids=submitted_step_ids,
+                                            on_submit=on_submit)
+            self.record_submission(cluster_id, jobs, step_ids)
+
+    def submit_ready(self):
+        for cluster_id, jobs in self.assign(self.uncached_ready_jobs()).items():
+            if not jobs:
+                continue
+            response = self.emr_client.add_job_flow_steps(JobFlowId=cluster_id,
+                                                          Steps=[JobStep(job).step for job in jobs])
+            self.record_submission(cluster_id, jobs, response['StepIds'])
+
+    def cancel_downstream(self, failed_job):
+        for job in self.jobs:
+            if self.states[job.name] == 'PENDING' and job.name not in self.placement \
+                    and any(self.states[d] in FAILED_STATE for d in job.depends_on):
+                logger.info('Cancelling job %s because job %s did not complete', job.name, failed_job)
+                self.states[job.name] = 'CANCELLED'
+
+    def update(self):
+        """Refresh the states of submitted jobs and cancel the dependents of failed jobs."""
+        for cluster_id in self.cluster_ids:
+            running = self.running(cluster_id)
+            if not running:
+                continue
+            step_states = get_step_states(self.emr_client, cluster_id,
+                                          [self.placement[name][1] for name in running])
+            for name in running:
+                state = step_states.get(self.placement[name][1], 'PENDING')
+                if state != self.states[name]:
+                    logger.info('Job %s is now %s', name, state)
+                    if state == 'COMPLETED' and name in self.cache_keys:
+                        job = next(job for job in self.jobs if job.name == name)
+                        self.cache.store(self.cache_keys[name], job.app, job.outputs)
+                self.states[name] = state
+                if state in FAILED_STATE:
+                    self.cancel_downstream(name)
+
+    def summary(self):
+        """Returns a (job, state, cluster ID, step ID) tuple per job, cached jobs are in state CACHED."""
+        return [(job, 'CACHED' if job.name in self.cached else self.states[job.name]) +
+                self.placement.get(job.name, (None, None)) for job in self.jobs]
+
+    def step(self):
+        self.update()
+        self.submit_ready()
+        return self.done
+
+    def run(self, staging_steps, sleep_interval_s=DEFAULT_SLEEP_INTERVAL_SECONDS):
+        """
+        Runs the pipeline to completion and returns the final state of each job.
+        """
+        self.start(staging_steps)
+        if not self.done:
+            poll(self.step, step=sleep_interval_s, poll_forever=True)
+        return self.states
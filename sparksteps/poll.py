@@ -2,7 +2,11 @@
 """
 Utilities for polling for cluster status to determine if it's in a terminal state.
 """
+import time
 import logging
+import threading
+import collections
+
 from polling import poll
 
 
@@ -10,6 +14,14 @@ logger = logging.getLogger(__name__)
 
 NON_TERMINAL_STATES = frozenset(['PENDING', 'RUNNING', 'CONTINUE', 'CANCEL_PENDING'])
 FAILED_STATE = frozenset(['CANCELLED', 'FAILED', 'INTERRUPTED'])
+MAX_LIST_STEP_IDS = 10  # ListSteps accepts at most this many step IDs per call.
+
+ETA_FRACTION = 0.9  # Polling resumes once this share of the expected runtime has passed.
+NEAR_ETA_INTERVAL_SECONDS = 15  # Polling interval around the expected finish.
+MAX_ETA_SLEEP_SECONDS = 1800  # Longest sleep before the expected finish, so that failures are noticed.
+
+# Start and end are seconds since the epoch, None when the step did not start or end.
+StepTiming = collections.namedtuple('StepTiming', 'name state start end')
 
 
 def failure_message_from_response(response):
@@ -52,13 +64,185 @@ def is_step_complete(emr_client, jobflow_id, step_id):
     return True
 
 
-def wait_for_step_complete(emr_client, jobflow_id, step_id, sleep_interval_s):
+def get_step_states(emr_client, jobflow_id, step_ids):
+    """
+    Returns a dictionary mapping each of `step_ids` to its current state,
+    listing at most `MAX_LIST_STEP_IDS` steps per request
+    """
+    step_ids = list(step_ids)
+    if len(step_ids) == 1:
+        response = emr_client.describe_step(ClusterId=jobflow_id, StepId=step_ids[0])
+        return {step_ids[0]: response['Step']['Status']['State']}
+
+    states = {}
+    paginator = emr_client.get_paginator('list_steps')
+    for i in range(0, len(step_ids), MAX_LIST_STEP_IDS):
+        batch = step_ids[i:i + MAX_LIST_STEP_IDS]
+        for page in paginator.paginate(ClusterId=jobflow_id, StepIds=batch):
+            for step in page['Steps']:
+                states[step['Id']] = step['Status']['State']
+    return states
+
+
+def are_steps_complete(emr_client, jobflow_id, step_ids):
+    """
+    Returns the states of `step_ids` once all of them have reached a terminal state, None otherwise
+    """
+    states = get_step_states(emr_client, jobflow_id, step_ids)
+    pending = [step_id for step_id in step_ids if states.get(step_id, 'PENDING') in NON_TERMINAL_STATES]
+    logger.info('%d of %d steps complete', len(step_ids) - len(pending), len(step_ids))
+    if pending:
+        return None
+    return states
+
+
+def wait_for_steps_complete(emr_client, jobflow_id, step_ids, sleep_interval_s):
     """
-    Will poll EMR until provided step has a terminal status
+    Will poll EMR until all provided steps have a terminal status and returns their states.
+    Unlike `wait_for_step_complete` failed steps do not raise an exception.
     """
-    poll(
-        is_step_complete,
-        args=(emr_client, jobflow_id, step_id),
+    return poll(
+        are_steps_complete,
+        args=(emr_client, jobflow_id, step_ids),
         step=sleep_interval_s,
         poll_forever=True
     )
+
+
+def eta_sleep_s(elapsed_s, expected_s, sleep_interval_s):
+    """
+    Returns how long to sleep before polling again, given how long a step was
+    waited for and how long it is expected to take.
+
+    Until the expected finish draws near, the waiter sleeps until then. Around
+    the expected finish it polls frequently, and once the step takes much
+    longer than expected it falls back to `sleep_interval_s`.
+
+    Examples:
+        >>> eta_sleep_s(0, 1000, 150), eta_sleep_s(890, 1000, 150), eta_sleep_s(2000, 1000, 150)
+        (900.0, 15, 150)
+    """
+    if expected_s is None:
+        return sleep_interval_s
+    remaining_s = expected_s * ETA_FRACTION - elapsed_s
+    if remaining_s > NEAR_ETA_INTERVAL_SECONDS:
+        return min(remaining_s, MAX_ETA_SLEEP_SECONDS)
+    if elapsed_s < expected_s * 1.5:
+        return min(NEAR_ETA_INTERVAL_SECONDS, sleep_interval_s)
+    return sleep_interval_s
+
+
+def step_started_at(emr_client, jobflow_id, step_id):
+    """
+    Returns when a step started running in seconds since the epoch, or None while it is pending.
+    """
+    response = emr_client.describe_step(ClusterId=jobflow_id, StepId=step_id)
+    started = response['Step']['Status'].get('Timeline', {}).get('StartDateTime')
+    return started.timestamp() if started is not None else None
+
+
+def wait_for_step_complete(emr_client, jobflow_id, step_id, sleep_interval_s, expected_s=None):
+    """
+    Will poll EMR until provided step has a terminal status. Given the number
+    of seconds the step is expected to take, polls at a fixed interval until
+    the step runs and then around its expected finish.
+    """
+    if expected_s is None:
+        poll(
+            is_step_complete,
+            args=(emr_client, jobflow_id, step_id),
+            step=sleep_interval_s,
+            poll_forever=True
+        )
+        return
+    started_at = None
+    while not is_step_complete(emr_client, jobflow_id, step_id):
+        if started_at is None:
+            # Steps may wait for the cluster or for earlier steps, their runtime starts once they run.
+            started_at = step_started_at(emr_client, jobflow_id, step_id)
+        if started_at is None:
+            time.sleep(sleep_interval_s)
+        else:
+            time.sleep(eta_sleep_s(time.time() - started_at, expected_s, sleep_interval_s))
+
+
+def get_step_timings(emr_client, jobflow_id, step_ids):
+    """
+    Returns a `StepTiming` per step of `step_ids` from the timelines recorded by EMR
+    """
+    timings = []
+    for step_id in step_ids:
+        step = emr_client.describe_step(ClusterId=jobflow_id, StepId=step_id)['Step']
+        timeline = step['Status'].get('Timeline', {})
+        start, end = timeline.get('StartDateTime'), timeline.get('EndDateTime')
+        timings.append(StepTiming(step['Name'], step['Status']['State'],
+                                  start.timestamp() if start else None,
+                                  end.timestamp() if end else None))
+    return timings
+
+
+def log_step_timings(timings):
+    """
+    Logs how long each step ran and the wall clock time from the first start to the last end
+    """
+    for timing in timings:
+        if timing.start is not None and timing.end is not None:
+            logger.info('%s finished in state %s after %.1fs', timing.name, timing.state, timing.end - timing.start)
+        else:
+            logger.info('%s finished in state %s', timing.name, timing.state)
+    starts = [t.start for t in timings if t.start is not None]
+    ends = [t.end for t in timings if t.end is not None]
+    if starts and ends:
+        logger.info('%d steps took %.1fs', len(timings), max(ends) - min(starts))
+
+
+class Poller(object):
+    """
+    Calls `step` every `interval_s` seconds from a background thread until
+    stopped or `finished`. Polling is best effort: failing steps are logged
+    with `failure_message`, formatted with the ID of the cluster, and retried.
+
+    Args:
+        cluster_id (str): cluster to poll.
+        interval_s (int): seconds between steps.
+    """
+    thread_name = 'sparksteps-poller'
+    failure_message = 'Failed to poll cluster %s'
+
+    def __init__(self, cluster_id, interval_s):
+        self.cluster_id = cluster_id
+        self.interval_s = interval_s
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def step(self):
+        raise NotImplementedError
+
+    def finished(self):
+        """Returns whether polling is no longer needed."""
+        return False
+
+    def retarget(self, cluster_id):
+        """Polls `cluster_id` from now on, such as a cluster relaunched in place of the polled one."""
+        self.cluster_id = cluster_id
+
+    def run(self):
+        while not self._stopped.wait(self.interval_s):
+            try:
+                self.step()
+            except Exception:
+                # Polling must not fail the run, the next step tries again.
+                logger.exception(self.failure_message, self.cluster_id)
+            if self.finished():
+                return
+
+    def start(self, interval_s=None):
+        if interval_s is not None:
+            self.interval_s = interval_s
+        self._thread = threading.Thread(target=self.run, name=self.thread_name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Validate the S3 locations a run depends on before launching a cluster.
+
+A mistyped input path otherwise only surfaces once the Spark step fails, after
+the cluster has been provisioned. The bootstrap script, S3 uploads, declared
+inputs and the S3 URIs in the app arguments are checked to exist, except for
+URIs below the outputs declared with `outputs`. The outputs and the S3 path
+sparksteps stages files to are checked to be writable, by writing and deleting
+an empty object below them. All checks run concurrently and their failures are
+reported together.
+"""
+import os
+import uuid
+import logging
+import collections
+import concurrent.futures
+
+from sparksteps.cache import parse_s3_uri, s3_exists
+
+logger = logging.getLogger(__name__)
+
+CHECK_WORKERS = 16
+GLOB_CHARACTERS = '*?[{'
+
+Check = collections.namedtuple('Check', 'description uri error')
+
+
+def s3_arguments(args):
+    """
+    Returns the S3 URIs in `args` along with the name of the option they are passed to.
+
+    Examples:
+        >>> s3_arguments(['--input', 's3://b/in/', '--output=s3://b/out/', 'date=2020-01-01', 's3://b/x,s3://b/y'])
+        [('--input', 's3://b/in/'), ('--output', 's3://b/out/'), ('', 's3://b/x'), ('', 's3://b/y')]
+    """
+    uris = []
+    name = ''
+    for arg in args or []:
+        if arg.startswith('-') and '=' not in arg:
+            name = arg
+            continue
+        arg_name, value = name, arg
+        if '=' in arg and not arg.startswith('s3://'):
+            arg_name, value = arg.split('=', 1)
+        uris.extend((arg_name, uri) for uri in value.split(',') if uri.startswith('s3://'))
+        name = ''
+    return uris
+
+
+def literal_prefix(uri):
+    """
+    Returns the part of `uri` before its first glob character.
+
+    Examples:
+        >>> literal_prefix('s3://b/episodes/date=2020-*/part-0')
+        's3://b/episodes/date=2020-'
+    """
+    for i, char in enumerate(uri):
+        if char in GLOB_CHARACTERS:
+            return uri[:i]
+    return uri
+
+
+def check_exists(s3_client, uri):
+    """Returns why nothing exists below `uri`, or None if something does."""
+    try:
+        if not s3_exists(s3_client, literal_prefix(uri)):
+            return 'no objects found'
+    except s3_client.exceptions.ClientError as e:
+        return str(e)
+    return None
+
+
+def check_object(s3_client, uri):
+    """Returns why the object `uri` cannot be read, or None if it can."""
+    bucket, key = parse_s3_uri(uri)
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+    except s3_client.exceptions.ClientError as e:
+        return str(e)
+    return None
+
+
+def check_writable(s3_client, uri):
+    """Returns why no object can be written below `uri`, or None if one can."""
+    bucket, prefix = parse_s3_uri(literal_prefix(uri))
+    key = os.path.join(prefix, '_sparksteps_preflight_{}'.format(uuid.uuid4().hex))
+    try:
+        s3_client.put_object(Bucket=bucket, Key=key, Body=b'')
+        s3_client.delete_object(Bucket=bucket, Key=key)
+    except s3_client.exceptions.ClientError as e:
+        return str(e)
+    return None
+
+
+def planned_checks(args_dict):
+    """Returns the checks of a run as (description, check function, uri) tuples."""
+    checks = [('staging path is writable', check_writable,
+               os.path.join('s3://', args_dict['s3_bucket'], args_dict.get('s3_path') or ''))]
+    if (args_dict.get('app') or '').startswith('s3://'):
+        checks.append(('app exists', check_object, args_dict['app']))
+    if args_dict.get('bootstrap_script'):
+        checks.append(('bootstrap script exists', check_object, args_dict['bootstrap_script']))
+    checks.extend(('bootstrap input exists', check_exists, uri)
+                  for uri in args_dict.get('bootstrap_inputs') or [] if uri.startswith('s3://'))
+    checks.extend(('upload exists', check_exists, path)
+                  for path in args_dict.get('uploads') or [] if path.startswith('s3://'))
+    checks.extend(('input exists', check_exists, uri) for uri in args_dict.get('inputs') or [])
+    outputs = list(args_dict.get('outputs') or [])
+    # App arguments which are not declared as outputs are read by the app.
+    checks.extend(('{} exists'.format(name or 'app argument'), check_exists, uri)
+                  for name, uri in s3_arguments(args_dict.get('app_args'))
+                  if not any(uri.startswith(output) for output in outputs))
+    checks.extend(('output is writable', check_writable, uri) for uri in outputs)
+
+    # The same location is only checked once.
+    unique = collections.OrderedDict()
+    for description, check, uri in checks:
+        unique.setdefault((check, uri), description)
+    return [(description, check, uri) for (check, uri), description in unique.items()]
+
+
+def run_checks(s3_client, args_dict, max_workers=CHECK_WORKERS):
+    """Runs the checks of a run concurrently and returns a `Check` per location."""
+    checks = planned_checks(args_dict)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        errors = list(executor.map(lambda c: c[1](s3_client, c[2]), checks))
+    return [Check(description, uri, error) for (description, _, uri), error in zip(checks, errors)]
+
+
+def format_report(results):
+    """Returns a report of the failed checks."""
+    failed = [r for r in results if r.error]
+    lines = ['{} of {} pre-flight checks failed:'.format(len(failed), len(results))]
+    lines.extend('  {}: {} ({})'.format(r.description, r.uri, r.error) for r in failed)
+    return '\n'.join(lines)
+
+
+def validate(s3_client, args_dict):
+    """
+    Checks the S3 locations of a run, raising a ValueError reporting every
+    failed check if any fails.
+    """
+    results = run_checks(s3_client, args_dict)
+    if any(r.error for r in results):
+        raise ValueError(format_report(results))
+    logger.info('Passed %d pre-flight checks', len(results))
+    return results
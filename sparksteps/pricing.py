@@ -5,6 +5,7 @@ import datetime
 import itertools
 import logging
 import collections
+import concurrent.futures
 
 logger = logging.getLogger(__name__)
 
@@ -169,3 +170,67 @@ def get_bid_price(ec2_client, pricing_client, instance_type, availability_zone=N
     bid_price, is_spot = determine_best_price(demand_price, best_zone)
     bid_price_rounded = round(bid_price, 2)  # AWS requires max 3 decimal places
     return bid_price_rounded, is_spot
+
+
+def determine_prices(args, ec2, pricing_client, bid_price_func=None):
+    """
+    Checks `args` in order to determine whether spot pricing should be
+     used for instance groups within the EMR cluster, and if this is the
+     case attempts to determine the optimal bid price.
+
+    Bid prices are looked up with `bid_price_func(instance_type, availability_zone)`,
+     which defaults to `get_bid_price`.
+    """
+    # Check if we need to do anything
+    pricing_properties = (
+        'dynamic_pricing_master', 'dynamic_pricing_core', 'dynamic_pricing_task')
+    if not any([x in args for x in pricing_properties]):
+        return args
+
+    availability_zone = None
+    subnet_id = args.get('ec2_subnet_id')
+    if subnet_id:
+        # We need to determine the AZ associated with the provided EC2 subnet ID
+        # in order to look up spot prices in the correct region.
+        availability_zone = get_availability_zone(ec2, subnet_id)
+        if not availability_zone:
+            logger.info("Could not determine availability zone for subnet '%s'", subnet_id)
+
+    if bid_price_func is None:
+        def bid_price_func(instance_type, availability_zone):
+            return get_bid_price(ec2, pricing_client, instance_type, availability_zone)
+
+    # Mutate a copy of args.
+    args = args.copy()
+
+    # Look the bid prices up concurrently, once per instance type.
+    instance_types = sorted({args[p.replace('dynamic_pricing', 'instance_type')]
+                             for p in pricing_properties if args.get(p)})
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(instance_types), 1)) as executor:
+        bid_prices = dict(zip(instance_types, executor.map(
+            lambda t: bid_price_func(t, availability_zone), instance_types)))
+
+    # Determine bid prices for the instance types for which we want to
+    # use bid pricing.
+    for price_property in pricing_properties:
+        if price_property not in args:
+            continue
+
+        if args[price_property]:
+            instance_type_key = price_property.replace(
+                'dynamic_pricing', 'instance_type')
+            instance_type = args[instance_type_key]
+            instance_group = price_property.replace('dynamic_pricing_', '')
+            bid_price, is_spot = bid_prices[instance_type]
+            if is_spot:
+                logger.info("Using spot pricing with a bid price of $%.2f"
+                            " for %s instances in the %s instance group.",
+                            bid_price, instance_type,
+                            instance_group)
+                bid_key = price_property.replace('dynamic_pricing', 'bid_price')
+                args[bid_key] = str(bid_price)
+            else:
+                logger.info("Spot price for %s in the %s instance group too high."
+                            " Using on-demand price of $%.2f",
+                            instance_type, instance_group, bid_price)
+    return args
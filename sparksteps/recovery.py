@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Recover from steps failing because cluster instances were lost.
+
+Spot instances are reclaimed when capacity runs out or the spot price rises
+above the bid, failing the steps which ran on them. Such failures are told
+apart from failures of the app itself by the state change reasons of the
+cluster and of its instance groups. The instance groups which lost instances
+are resized, a task group whose bid is no longer viable is replaced by an
+on-demand one, the capacity a spot core group lost is moved to an on-demand
+task group when its bid is no longer viable, and a terminated cluster is
+relaunched. Only the steps which did not complete are submitted again.
+"""
+import logging
+import collections
+
+from sparksteps.poll import FAILED_STATE, failure_message_from_response, wait_for_steps_complete
+
+logger = logging.getLogger(__name__)
+
+LOST_INSTANCE_CODES = frozenset(['INSTANCE_FAILURE'])
+LOST_INSTANCE_MESSAGES = ('spot interruption', 'spot instances were interrupted', 'reclaimed')
+# Clusters ended by a user, the budget guard or the app itself are never recovered.
+UNRECOVERABLE_CLUSTER_CODES = frozenset(['USER_REQUEST', 'STEP_FAILURE', 'ALL_STEPS_COMPLETED'])
+TERMINATED_CLUSTER_STATES = frozenset(['TERMINATING', 'TERMINATED', 'TERMINATED_WITH_ERRORS'])
+ENDED_GROUP_STATES = frozenset(['TERMINATING', 'ENDED'])
+RESIZABLE_GROUP_STATES = frozenset(['RUNNING'])
+
+LostInstances = collections.namedtuple('LostInstances', 'cluster_terminated groups availability_zone')
+
+
+def is_lost_instance_reason(reason):
+    """
+    Returns whether an EMR state change reason blames lost instances.
+
+    Examples:
+        >>> is_lost_instance_reason({'Code': 'INSTANCE_FAILURE', 'Message': 'Instance i-1 failed.'})
+        True
+        >>> is_lost_instance_reason({'Code': 'VALIDATION_ERROR', 'Message': 'Instance was reclaimed.'})
+        True
+        >>> is_lost_instance_reason({'Code': 'STEP_FAILURE', 'Message': 'Steps completed with errors'})
+        False
+        >>> is_lost_instance_reason({'Code': 'VALIDATION_ERROR', 'Message': 'Insufficient capacity.'})
+        False
+    """
+    if not reason or reason.get('Code') in UNRECOVERABLE_CLUSTER_CODES:
+        return False
+    message = (reason.get('Message') or '').lower()
+    return reason.get('Code') in LOST_INSTANCE_CODES or any(m in message for m in LOST_INSTANCE_MESSAGES)
+
+
+def find_lost_instances(emr_client, cluster_id):
+    """
+    Returns the instance groups of a cluster which lost instances, or None
+    when neither the cluster nor its instance groups lost any.
+
+    Only state change reasons blaming lost instances count: a group short of
+    its requested instances may just be resizing. Ended groups of a live
+    cluster are skipped. The groups of a cluster terminated because it lost
+    instances have all ended, its spot groups are returned to decide which
+    roles to relaunch on-demand.
+    """
+    cluster = emr_client.describe_cluster(ClusterId=cluster_id)['Cluster']
+    status = cluster['Status']
+    cluster_reason = status.get('StateChangeReason') or {}
+    if cluster_reason.get('Code') in UNRECOVERABLE_CLUSTER_CODES:
+        return None
+    cluster_terminated = status['State'] in TERMINATED_CLUSTER_STATES
+    if cluster_terminated and not is_lost_instance_reason(cluster_reason):
+        return None
+
+    groups = []
+    paginator = emr_client.get_paginator('list_instance_groups')
+    for page in paginator.paginate(ClusterId=cluster_id):
+        for group in page['InstanceGroups']:
+            if cluster_terminated:
+                lost = group.get('Market') == 'SPOT'
+            else:
+                lost = (group['Status']['State'] not in ENDED_GROUP_STATES and
+                        is_lost_instance_reason(group['Status'].get('StateChangeReason')))
+            if lost:
+                groups.append(group)
+
+    if not cluster_terminated and not groups:
+        return None
+    return LostInstances(cluster_terminated=cluster_terminated,
+                         groups=groups,
+                         availability_zone=cluster.get('Ec2InstanceAttributes', {}).get('Ec2AvailabilityZone'))
+
+
+def is_bid_viable(group, bid_price_func, availability_zone=None):
+    """
+    Returns whether the bid of a spot instance group is at least the bid
+    `bid_price_func(instance_type, availability_zone)` currently recommends.
+    """
+    bid_price, is_spot = bid_price_func(group['InstanceType'], availability_zone)
+    return is_spot and bid_price <= float(group['BidPrice'])
+
+
+def replacement_group(group, bid_price_func, availability_zone=None):
+    """
+    Returns the configuration of an instance group replacing a spot `group`,
+    on-demand unless spot pricing is still recommended at a higher bid.
+    """
+    config = {
+        'Name': group['Name'],
+        'Market': 'ON_DEMAND',
+        'InstanceRole': group['InstanceGroupType'],
+        'InstanceType': group['InstanceType'],
+        'InstanceCount': group['RequestedInstanceCount'],
+    }
+    bid_price, is_spot = bid_price_func(group['InstanceType'], availability_zone)
+    if is_spot:
+        config['Market'] = 'SPOT'
+        config['BidPrice'] = str(bid_price)
+    if group.get('EbsBlockDevices'):
+        config['EbsConfiguration'] = {
+            'EbsBlockDeviceConfigs': [{'VolumeSpecification': device['VolumeSpecification'], 'VolumesPerInstance': 1}
+                                      for device in group['EbsBlockDevices']],
+            'EbsOptimized': group.get('EbsOptimized', False)
+        }
+    return config
+
+
+def recover_instance_groups(emr_client, cluster_id, groups, bid_price_func, availability_zone=None):
+    """
+    Restores the instance groups of a live cluster which lost instances.
+
+    Groups are resized back to their requested instance count. A spot task
+    group whose bid is no longer viable is shrunk to zero instances and
+    replaced. The market and bid of the core group cannot be changed, when its
+    bid is no longer viable the instances it lost are replaced by a task group
+    instead, and the core group keeps its running instances.
+    """
+    for group in groups:
+        if group['InstanceGroupType'] == 'MASTER':
+            continue
+        lost_count = group['RequestedInstanceCount'] - group.get('RunningInstanceCount', 0)
+        if (group['InstanceGroupType'] == 'TASK' and group.get('Market') == 'SPOT' and
+                not is_bid_viable(group, bid_price_func, availability_zone)):
+            config = replacement_group(group, bid_price_func, availability_zone)
+            logger.info("Bid of %s is no longer viable, replacing it with %d %s %s instances",
+                        group['Id'], config['InstanceCount'], config['Market'], config['InstanceType'])
+            emr_client.modify_instance_groups(
+                ClusterId=cluster_id, InstanceGroups=[{'InstanceGroupId': group['Id'], 'InstanceCount': 0}])
+            emr_client.add_instance_groups(JobFlowId=cluster_id, InstanceGroups=[config])
+        elif (group['InstanceGroupType'] == 'CORE' and group.get('Market') == 'SPOT' and lost_count > 0 and
+                not is_bid_viable(group, bid_price_func, availability_zone)):
+            config = dict(replacement_group(group, bid_price_func, availability_zone),
+                          Name='{} replacement'.format(group['Name']), InstanceRole='TASK', InstanceCount=lost_count)
+            logger.info("Bid of %s is no longer viable, replacing its %d lost instances with %s %s task instances",
+                        group['Id'], lost_count, config['Market'], config['InstanceType'])
+            if group['Status']['State'] in RESIZABLE_GROUP_STATES:
+                # Otherwise EMR keeps requesting spot instances at the old bid.
+                emr_client.modify_instance_groups(
+                    ClusterId=cluster_id,
+                    InstanceGroups=[{'InstanceGroupId': group['Id'], 'InstanceCount': group['RunningInstanceCount']}])
+            emr_client.add_instance_groups(JobFlowId=cluster_id, InstanceGroups=[config])
+        elif group['Status']['State'] in RESIZABLE_GROUP_STATES:
+            logger.info("Resizing %s back to %d instances", group['Id'], group['RequestedInstanceCount'])
+            emr_client.modify_instance_groups(
+                ClusterId=cluster_id,
+                InstanceGroups=[{'InstanceGroupId': group['Id'], 'InstanceCount': group['RequestedInstanceCount']}])
+        else:
+            logger.info("%s is %s, EMR is replacing its instances", group['Id'], group['Status']['State'])
+
+
+def on_demand_roles(groups, bid_price_func, availability_zone=None):
+    """Returns the lower case roles of the spot `groups` whose bid is no longer viable."""
+    return sorted({group['InstanceGroupType'].lower() for group in groups
+                   if group.get('Market') == 'SPOT' and not is_bid_viable(group, bid_price_func, availability_zone)})
+
+
+def step_failure_message(emr_client, cluster_id, step_id):
+    message = 'EMR job failed'
+    failure_message = failure_message_from_response(emr_client.describe_step(ClusterId=cluster_id, StepId=step_id))
+    if failure_message:
+        message += ' ' + failure_message
+    return message
+
+
+def wait_and_recover(emr_client, cluster_id, emr_steps, step_ids, sleep_interval_s, max_recoveries,
+                     bid_price_func, relaunch=None, num_staging_steps=0, on_submit=None, on_relaunch=None):
+    """
+    Waits for the submitted `emr_steps` to complete, recovering up to
+    `max_recoveries` times from failures caused by lost instances.
+
+    Args:
+        emr_client: boto3 EMR client
+        cluster_id (str): cluster the steps were submitted to.
+        emr_steps (list): submitted steps.
+        step_ids (list): IDs of `emr_steps`.
+        sleep_interval_s (int): seconds between polls.
+        max_recoveries (int): number of times to recover.
+        bid_price_func: returns the recommended (bid price, is_spot) of an
+            instance type in an availability zone.
+        relaunch: launches a cluster replacing a terminated one, given the
+            roles of the instance groups to launch on-demand, and returns its ID.
+        num_staging_steps (int): number of leading steps which stage files
+            on the cluster, resubmitted when the cluster is relaunched.
+        on_submit: called with a cluster ID and the IDs of resubmitted steps.
+        on_relaunch: called with the ID of a terminated cluster and of the cluster replacing it.
+
+    Returns:
+        str: the ID of the cluster the steps completed on.
+
+    Raises:
+        Exception: when steps failed for other reasons or could not be recovered.
+    """
+    pending = list(zip(range(len(emr_steps)), step_ids))
+    recoveries = 0
+    while True:
+        states = wait_for_steps_complete(emr_client, cluster_id, [step_id for _, step_id in pending],
+                                         sleep_interval_s)
+        failed = [(i, step_id) for i, step_id in pending if states[step_id] in FAILED_STATE]
+        if not failed:
+            return cluster_id
+
+        # Steps after a failed one are cancelled, the first failure says why.
+        message = step_failure_message(emr_client, cluster_id, failed[0][1])
+        lost = find_lost_instances(emr_client, cluster_id)
+        if lost is None:
+            raise Exception(message)
+        if recoveries >= max_recoveries:
+            raise Exception('{} after recovering from lost instances {} times'.format(message, recoveries))
+        recoveries += 1
+        logger.warning("Steps failed because instances were lost, recovering (%d of %d)", recoveries, max_recoveries)
+
+        resubmit = [i for i, _ in failed]
+        if lost.cluster_terminated:
+            if relaunch is None:
+                raise Exception('{}, cluster {} terminated'.format(message, cluster_id))
+            terminated_cluster_id = cluster_id
+            cluster_id = relaunch(on_demand_roles(lost.groups, bid_price_func, lost.availability_zone))
+            logger.info("Relaunched cluster %s", cluster_id)
+            if on_relaunch is not None:
+                on_relaunch(terminated_cluster_id, cluster_id)
+            # Files staged on the lost cluster have to be staged again.
+            resubmit = sorted(set(range(num_staging_steps)) | set(resubmit))
+        else:
+            recover_instance_groups(emr_client, cluster_id, lost.groups, bid_price_func, lost.availability_zone)
+
+        new_step_ids = emr_client.add_job_flow_steps(
+            JobFlowId=cluster_id, Steps=[emr_steps[i] for i in resubmit])['StepIds']
+        logger.info("Resubmitted %d steps: %s", len(new_step_ids), ', '.join(new_step_ids))
+        if on_submit is not None:
+            on_submit(cluster_id, new_step_ids)
+        pending = list(zip(resubmit, new_step_ids))
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""Long running submission server with an HTTP API.
+
+Jobs are submitted to existing clusters by POSTing a JSON job spec to ``/jobs``::
+
+    {
+      "cluster_id": "j-1K48XXXXXXHCB",
+      "app": "s3://my-bucket/apps/episodes.py",
+      "uploads": ["s3://my-bucket/libs/lib.zip"],
+      "submit_args": "--deploy-mode cluster",
+      "app_args": ["--input", "s3://my-bucket/episodes.avro"]
+    }
+
+The server does not authenticate requests, local `app` and `uploads` paths are
+therefore rejected unless the server was given a `staging_dir`, in which case
+paths inside it are uploaded to the `s3_bucket` of the server. The files of each
+job are staged below their own S3 prefix and copied into their own directory on
+the master node, ``/home/hadoop/`` in the arguments of a job refers to it. Jobs
+are queued and the steps of all jobs queued for the same cluster within the
+batch window are submitted with a single request. ``GET /jobs/<id>`` returns the state and step
+IDs of a job and ``GET /metrics`` the queue depth and latencies.
+"""
+import os
+import json
+import math
+import time
+import uuid
+import logging
+import argparse
+import threading
+import collections
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from sparksteps.pipeline import parse_args_value
+from sparksteps.session import DEFAULT_MAX_POOL_CONNECTIONS, Session
+from sparksteps.steps import REMOTE_DIR
+from sparksteps.submit import MAX_STEPS_PER_REQUEST
+
+logger = logging.getLogger(__name__)
+LOGFORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+DEFAULT_BATCH_WINDOW_SECONDS = 1.0
+MAX_JOBS = 10000  # Number of jobs kept around to answer status requests.
+LATENCY_WINDOW = 1000  # Number of recent latencies metrics are computed over.
+
+
+def percentile(values, q):
+    """
+    Returns the `q`th percentile of `values` using the nearest rank method.
+
+    Examples:
+        >>> percentile([1, 2, 3, 4], 50)
+        2
+    """
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(q / 100.0 * len(ordered))) - 1, 0)]
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return None
+    return {'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'max': max(latencies)}
+
+
+def in_job_dir(step, job_id):
+    """
+    Returns `step` with the remote directory in its arguments replaced by the
+    directory of a job, so that files of concurrent jobs do not collide.
+
+    Examples:
+        >>> in_job_dir({'HadoopJarStep': {'Args': ['spark-submit', '/home/hadoop/app.py']}}, 'a1')
+        {'HadoopJarStep': {'Args': ['spark-submit', '/home/hadoop/jobs/a1/app.py']}}
+    """
+    job_dir = os.path.join(REMOTE_DIR, 'jobs', job_id, '')
+    args = [arg.replace(REMOTE_DIR, job_dir) for arg in step['HadoopJarStep']['Args']]
+    return dict(step, HadoopJarStep=dict(step['HadoopJarStep'], Args=args))
+
+
+class QueuedJob(object):
+    def __init__(self, cluster_id, steps, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.cluster_id = cluster_id
+        self.steps = steps
+        self.state = 'QUEUED'
+        self.step_ids = []
+        self.error = None
+        self.queued_at = time.time()
+        self.submitted_at = None
+
+    def to_dict(self):
+        return {'id': self.id, 'cluster_id': self.cluster_id, 'state': self.state,
+                'step_ids': self.step_ids, 'error': self.error}
+
+
+class SubmissionQueue(object):
+    """
+    Queues jobs and submits their steps from a background thread. Once a job
+    arrives the queue waits `batch_window_s` for more jobs and then submits the
+    steps of all queued jobs of a cluster with as few requests as possible.
+    """
+    def __init__(self, emr_client, batch_window_s=DEFAULT_BATCH_WINDOW_SECONDS, max_batch_size=MAX_STEPS_PER_REQUEST):
+        self.emr_client = emr_client
+        self.batch_window_s = batch_window_s
+        self.max_batch_size = max_batch_size
+        self.jobs = collections.OrderedDict()
+        self.pending = collections.deque()
+        self.queue_latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.submit_latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.counts = collections.Counter(dict.fromkeys(
+            ('jobs_queued', 'jobs_submitted', 'jobs_failed', 'batches', 'steps_submitted'), 0))
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def put(self, cluster_id, steps, job_id=None):
+        """Queues the steps of a job and returns the job."""
+        if not steps:
+            raise ValueError('Job does not have any steps.')
+        if len(steps) > self.max_batch_size:
+            raise ValueError('Job has {} steps, at most {} are allowed.'.format(len(steps), self.max_batch_size))
+        job = QueuedJob(cluster_id, steps, job_id)
+        with self._condition:
+            self.jobs[job.id] = job
+            while len(self.jobs) > MAX_JOBS:
+                self.jobs.popitem(last=False)
+            self.pending.append(job)
+            self.counts['jobs_queued'] += 1
+            self._condition.notify()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def take_batches(self):
+        """
+        Removes all pending jobs from the queue and returns them grouped into
+        (cluster ID, jobs) batches of at most `max_batch_size` steps, in queue order.
+        """
+        with self._condition:
+            jobs, self.pending = list(self.pending), collections.deque()
+        by_cluster = collections.OrderedDict()
+        for job in jobs:
+            by_cluster.setdefault(job.cluster_id, []).append(job)
+
+        batches = []
+        for cluster_id, cluster_jobs in by_cluster.items():
+            batch, size = [], 0
+            for job in cluster_jobs:
+                if size + len(job.steps) > self.max_batch_size:
+                    batches.append((cluster_id, batch))
+                    batch, size = [], 0
+                batch.append(job)
+                size += len(job.steps)
+            batches.append((cluster_id, batch))
+        return batches
+
+    def submit_batch(self, cluster_id, jobs):
+        start = time.time()
+        try:
+            response = self.emr_client.add_job_flow_steps(
+                JobFlowId=cluster_id, Steps=[step for job in jobs for step in job.steps])
+        except Exception as e:
+            logger.exception('Failed to submit %d jobs to cluster %s', len(jobs), cluster_id)
+            for job in jobs:
+                job.state = 'FAILED'
+                job.error = str(e)
+            self.counts['jobs_failed'] += len(jobs)
+            return
+
+        submitted_at = time.time()
+        step_ids = iter(response['StepIds'])
+        for job in jobs:
+            job.step_ids = [next(step_ids) for _ in job.steps]
+            job.state = 'SUBMITTED'
+            job.submitted_at = submitted_at
+            self.queue_latencies.append(start - job.queued_at)
+        self.submit_latencies.append(submitted_at - start)
+        self.counts['batches'] += 1
+        self.counts['jobs_submitted'] += len(jobs)
+        self.counts['steps_submitted'] += sum(len(job.steps) for job in jobs)
+        logger.info('Submitted %d jobs to cluster %s', len(jobs), cluster_id)
+
+    def flush(self):
+        """Submits all pending jobs."""
+        for cluster_id, jobs in self.take_batches():
+            self.submit_batch(cluster_id, jobs)
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self.pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped and not self.pending:
+                    return
+                stopped = self._stopped
+            if not stopped:
+                # Give jobs for the same cluster a chance to join the batch.
+                time.sleep(self.batch_window_s)
+            self.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='sparksteps-submit', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread once all pending jobs have been submitted."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def metrics(self):
+        with self._condition:
+            queue_depth = len(self.pending)
+        return dict(self.counts,
+                    queue_depth=queue_depth,
+                    queue_latency_s=latency_summary(list(self.queue_latencies)),
+                    submit_latency_s=latency_summary(list(self.submit_latencies)))
+
+
+class SubmissionHandler(BaseHTTPRequestHandler):
+    server_version = 'sparksteps'
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            return self.send_json(200, self.server.queue.metrics())
+        if self.path.startswith('/jobs/'):
+            job = self.server.queue.get(self.path[len('/jobs/'):])
+            if job is not None:
+                return self.send_json(200, job.to_dict())
+        self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        from boto3.exceptions import S3UploadFailedError
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        if self.path != '/jobs':
+            return self.send_json(404, {'error': 'Not found'})
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            job_id = uuid.uuid4().hex
+            job = self.server.queue.put(spec.get('cluster_id'), self.server.stage(spec, job_id), job_id)
+        except (ValueError, FileNotFoundError) as e:
+            return self.send_json(400, {'error': str(e)})
+        except (ClientError, BotoCoreError, S3UploadFailedError) as e:
+            # Files are staged to the bucket of the server, failing to do so is not the fault of the request.
+            logger.exception('Failed to stage the files of a job')
+            return self.send_json(502, {'error': str(e)})
+        self.send_json(202, job.to_dict())
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class SubmissionServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    HTTP server staging the files of incoming jobs, each request on its own
+    thread, and handing their steps to a `SubmissionQueue`. Local files are
+    only staged from inside `staging_dir`, relative paths are relative to it.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, session, queue, s3_bucket=None, s3_path='sparksteps/', staging_dir=None):
+        HTTPServer.__init__(self, server_address, SubmissionHandler)
+        self.session = session
+        self.queue = queue
+        self.s3_bucket = s3_bucket
+        self.s3_path = s3_path
+        self.staging_dir = os.path.realpath(staging_dir) if staging_dir else None
+
+    def local_path(self, path):
+        """Returns the real path of a local file of a job, raising a ValueError unless it is inside `staging_dir`."""
+        if self.staging_dir is None:
+            raise ValueError('Local paths are not accepted, pass S3 URIs or start the server with --staging-dir.')
+        real_path = os.path.realpath(os.path.join(self.staging_dir, path))
+        if os.path.commonpath([real_path, self.staging_dir]) != self.staging_dir:
+            raise ValueError('{} is not inside the staging directory.'.format(path))
+        return real_path
+
+    def stage(self, spec, job_id):
+        """
+        Uploads the local files of a job spec below the S3 prefix of the job
+        and returns its steps, which copy them into the directory of the job.
+        """
+        if not isinstance(spec, dict) or not spec.get('cluster_id') or not spec.get('app'):
+            raise ValueError('Job spec requires a cluster_id and an app.')
+        # Files are only ever staged to the bucket and path of the server, never to ones of the request.
+        paths = [p if p.startswith('s3://') else self.local_path(p)
+                 for p in [spec['app']] + list(spec.get('uploads') or [])]
+        app, uploads = paths[0], paths[1:]
+        if self.s3_bucket is None and not all(p.startswith('s3://') for p in uploads + [app]):
+            raise ValueError('s3_bucket is required to stage local files.')
+        emr_steps = self.session.stage(self.s3_bucket, os.path.join(self.s3_path, 'jobs', job_id), app,
+                                       parse_args_value(spec.get('submit_args')),
+                                       parse_args_value(spec.get('app_args')),
+                                       uploads)
+        emr_steps = [in_job_dir(step, job_id) for step in emr_steps]
+        # Steps of unrelated jobs may be submitted together, a failing app must not cancel the others.
+        # A failing staging step keeps cancelling the steps after it, so that an app never runs without its files.
+        return emr_steps[:-1] + [dict(emr_steps[-1], ActionOnFailure='CONTINUE')]
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Serve an HTTP API submitting Spark apps to EMR clusters.')
+    parser.add_argument('--aws-region', required=True)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--s3-bucket')
+    parser.add_argument('--s3-path', default='sparksteps/')
+    parser.add_argument('--staging-dir')
+    parser.add_argument('--batch-window', type=float, default=DEFAULT_BATCH_WINDOW_SECONDS)
+    parser.add_argument('--max-pool-connections', type=int, default=DEFAULT_MAX_POOL_CONNECTIONS)
+    parser.add_argument('--log-level', '-l', type=str.upper, default='INFO')
+    return parser
+
+
+def main():
+    args = create_parser().parse_args()
+    logging.basicConfig(format=LOGFORMAT)
+    logging.getLogger('sparksteps').setLevel(getattr(logging, args.log_level, None))
+
+    session = Session(aws_region=args.aws_region,
+                      max_pool_connections=args.max_pool_connections)
+    queue = SubmissionQueue(session.emr, batch_window_s=args.batch_window)
+    server = SubmissionServer((args.host, args.port), session, queue, args.s3_bucket, args.s3_path,
+                              staging_dir=args.staging_dir)
+    queue.start()
+    logger.info('Listening on %s:%d', args.host, server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Reusable API for launching clusters and submitting Spark apps from one process.
+
+A session holds the AWS clients used by sparksteps, which are created once and
+share connection pools, so that many submissions avoid setting up new clients
+and connections::
+
+    session = Session(aws_region='us-east-1')
+    cluster_ids = session.launch(release_label='emr-6.2.0', instance_type_master='m5.xlarge',
+                                 num_core=2, instance_type_core='m5.xlarge', dynamic_pricing_core=True,
+                                 keep_alive=True)
+    emr_steps = session.stage('my-bucket', 'sparksteps', 'episodes.py', uploads=['lib'])
+    step_ids = session.submit(cluster_ids[0], emr_steps)
+    session.wait(cluster_ids[0], step_ids[-1])
+
+"""
+import time
+import logging
+import threading
+
+from sparksteps import steps
+from sparksteps import cluster
+from sparksteps import pricing
+from sparksteps import launcher
+from sparksteps import submit
+from sparksteps.poll import wait_for_step_complete, wait_for_steps_complete
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+DEFAULT_SLEEP_INTERVAL_SECONDS = 150
+# Spot prices move, bid prices are therefore only reused for a while.
+BID_PRICE_TTL_SECONDS = 15 * 60
+
+
+class Session(object):
+    """
+    Holds the EMR, S3, EC2 and Pricing clients of one AWS region along with
+    recently looked up bid prices.
+
+    Clients are created on first use and are safe to share between threads.
+    S3 resources are not thread safe, each thread gets its own.
+
+    Args:
+        aws_region (str): region to create clients in.
+        boto_session: `boto3.session.Session` to create clients from, by default
+            a new session is created in `aws_region`.
+        max_pool_connections (int): maximum number of connections each client keeps in its pool.
+        bid_price_ttl_s (int): number of seconds bid prices are cached for.
+    """
+    def __init__(self, aws_region=None, boto_session=None, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+                 bid_price_ttl_s=BID_PRICE_TTL_SECONDS):
+        # Deferred as importing boto3 accounts for most of the startup time.
+        import boto3
+        from botocore.config import Config
+
+        self.boto_session = boto_session or boto3.session.Session(region_name=aws_region)
+        self.aws_region = aws_region or self.boto_session.region_name
+        self.config = Config(max_pool_connections=max_pool_connections)
+        self.bid_price_ttl_s = bid_price_ttl_s
+        self._clients = {}
+        self._local = threading.local()
+        # boto3 sessions are not thread safe, creating clients is serialized.
+        self._lock = threading.Lock()
+        self._bid_prices = {}
+
+    def client(self, service_name):
+        """Returns the client of `service_name`, creating it on first use."""
+        with self._lock:
+            if service_name not in self._clients:
+                self._clients[service_name] = self.boto_session.client(
+                    service_name, region_name=self.aws_region, config=self.config)
+            return self._clients[service_name]
+
+    @property
+    def emr(self):
+        return self.client('emr')
+
+    @property
+    def ec2(self):
+        return self.client('ec2')
+
+    @property
+    def pricing(self):
+        return self.client('pricing')
+
+    @property
+    def s3(self):
+        """The S3 resource of the calling thread."""
+        if not hasattr(self._local, 's3'):
+            with self._lock:
+                self._local.s3 = self.boto_session.resource('s3', region_name=self.aws_region, config=self.config)
+        return self._local.s3
+
+    def get_bid_price(self, instance_type, availability_zone=None):
+        """
+        Returns the bid price of `instance_type` and whether to use spot
+        pricing, reusing prices looked up less than `bid_price_ttl_s` ago.
+        """
+        key = (instance_type, availability_zone)
+        cached = self._bid_prices.get(key)
+        if cached is not None and time.time() - cached[0] < self.bid_price_ttl_s:
+            return cached[1]
+        bid_price = pricing.get_bid_price(self.ec2, self.pricing, instance_type, availability_zone)
+        self._bid_prices[key] = (time.time(), bid_price)
+        return bid_price
+
+    def determine_prices(self, args):
+        """Same as `pricing.determine_prices` using the cached bid prices of this session."""
+        return pricing.determine_prices(args, self.ec2, self.pricing, bid_price_func=self.get_bid_price)
+
+    def launch(self, num_clusters=1, **kw):
+        """
+        Launches `num_clusters` clusters configured by `cluster.emr_config` style
+        keyword arguments, determining bid prices for the instance groups with
+        dynamic pricing enabled, and returns their IDs.
+        """
+        kw = self.determine_prices(kw)
+        return launcher.launch_clusters(self.emr, cluster.emr_config(**kw), num_clusters)
+
+    def stage(self, bucket, bucket_path, app, submit_args=None, app_args=None, uploads=None, s3_dist_cp=None,
+              compaction=None):
+        """Uploads `app` and `uploads` to S3 and returns the steps which run `app`."""
+        return steps.setup_steps(self.s3, bucket, bucket_path, app, submit_args, app_args,
+                                 list(uploads or []), s3_dist_cp, compaction=compaction)
+
+    def stage_concurrent(self, bucket, bucket_path, apps, uploads=None):
+        """
+        Uploads the files of `apps` once and returns the staging steps and a step per app.
+        """
+        return steps.setup_concurrent_steps(self.s3, bucket, bucket_path, apps, uploads)
+
+    def submit(self, cluster_id, emr_steps, **kw):
+        """Submits `emr_steps` to a cluster with `submit.add_steps` and returns their IDs."""
+        return submit.add_steps(self.emr, cluster_id, emr_steps, **kw)
+
+    def wait(self, cluster_id, step_ids, sleep_interval_s=DEFAULT_SLEEP_INTERVAL_SECONDS):
+        """
+        Waits for a step to complete, raising an exception when it fails.
+        Given a list of step IDs, waits for all of them and returns their states instead.
+        """
+        if isinstance(step_ids, str):
+            wait_for_step_complete(self.emr, cluster_id, step_ids, sleep_interval_s)
+            return None
+        return wait_for_steps_complete(self.emr, cluster_id, step_ids, sleep_interval_s)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Size clusters and Spark partitions from the size of the input of an app.
+
+The objects below the S3 input prefixes of an app are listed concurrently to
+measure the number of bytes it reads. The cluster is given enough nodes to
+process the input in a few waves of tasks per executor core, and the input
+and shuffle partitions are sized such that every core has work.
+"""
+import math
+import logging
+import collections
+import concurrent.futures
+
+from sparksteps import tuning
+from sparksteps.cache import parse_s3_uri
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_NODES = 20
+LISTING_WORKERS = 16
+BYTES_PER_CORE = 1024 ** 3  # Input each executor core processes, 8 waves of default sized partitions.
+DEFAULT_PARTITION_BYTES = 128 * 1024 ** 2  # Default of spark.sql.files.maxPartitionBytes.
+MIN_PARTITION_BYTES = 16 * 1024 ** 2
+SHUFFLE_PARTITION_BYTES = 128 * 1024 ** 2
+
+InputSize = collections.namedtuple('InputSize', 'total_bytes num_objects')
+Sizing = collections.namedtuple('Sizing', 'num_core num_task max_partition_bytes shuffle_partitions')
+
+
+def list_prefix(s3_client, bucket, prefix, delimiter=None):
+    """Returns the total size and number of objects below a prefix, and the common prefixes if `delimiter` is set."""
+    total_bytes, num_objects, common_prefixes = 0, 0, []
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    for page in s3_client.get_paginator('list_objects_v2').paginate(**kwargs):
+        for obj in page.get('Contents', []):
+            total_bytes += obj['Size']
+            num_objects += 1
+        common_prefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+    return total_bytes, num_objects, common_prefixes
+
+
+def measure_inputs(s3_client, uris, max_workers=LISTING_WORKERS):
+    """
+    Returns the total size and number of objects below the S3 URIs `uris`.
+
+    The top level of every URI is listed first, after which the "directories"
+    below it, such as the partitions of a table, are listed concurrently.
+    """
+    def list_top_level(uri):
+        bucket, prefix = parse_s3_uri(uri)
+        return bucket, list_prefix(s3_client, bucket, prefix, delimiter='/')
+
+    total_bytes, num_objects = 0, 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for bucket, (size, count, prefixes) in executor.map(list_top_level, uris):
+            total_bytes += size
+            num_objects += count
+            futures.extend(executor.submit(list_prefix, s3_client, bucket, prefix) for prefix in prefixes)
+        for future in futures:
+            size, count, _ = future.result()
+            total_bytes += size
+            num_objects += count
+    logger.info('Inputs contain %d objects totalling %.1f GiB', num_objects, total_bytes / 1024.0 ** 3)
+    return InputSize(total_bytes, num_objects)
+
+
+def total_cores(**kw):
+    """Returns the number of executor cores of a cluster given emr_config style keyword arguments."""
+    layout = tuning.executor_layout(tuning.worker_node_counts(**kw))
+    return layout.instances * layout.cores
+
+
+def size_cluster(input_bytes, max_nodes=DEFAULT_MAX_NODES, **kw):
+    """
+    Derives the number of core and task nodes and the partitioning of an app
+    reading `input_bytes` bytes, given emr_config style keyword arguments.
+
+    Nodes are added to the task group when a task instance type is set, in
+    which case the core group keeps its configured size, otherwise to the core group.
+
+    Examples:
+        >>> size_cluster(100 * 1024 ** 3, instance_type_core='m5.2xlarge')
+        Sizing(num_core=15, num_task=0, max_partition_bytes=134217728, shuffle_partitions=870)
+    """
+    instance_type_name = kw.get('instance_type_task') or kw.get('instance_type_core')
+    if not instance_type_name:
+        raise ValueError('Sizing the cluster requires a core or task instance type.')
+    instance_type = tuning.get_instance_type(instance_type_name)
+
+    cores_needed = int(math.ceil(input_bytes / float(BYTES_PER_CORE)))
+    # One vCPU per node is left to the daemons.
+    nodes = max(1, min(max_nodes, int(math.ceil(cores_needed / float(max(instance_type.vcpus - 1, 1))))))
+    if kw.get('instance_type_task'):
+        num_core = kw.get('num_core') or 1
+        num_task = max(nodes - num_core, 1)
+    else:
+        num_core, num_task = nodes, kw.get('num_task') or 0
+
+    cores = total_cores(**dict(kw, num_core=num_core, num_task=num_task))
+    min_partitions = cores * tuning.TASKS_PER_CORE
+    # Small inputs are split finer so that every core has a partition to read.
+    input_partitions = max(min_partitions, int(math.ceil(input_bytes / float(DEFAULT_PARTITION_BYTES))))
+    max_partition_bytes = max(MIN_PARTITION_BYTES, int(math.ceil(input_bytes / float(input_partitions))))
+    max_partition_bytes = min(max_partition_bytes, DEFAULT_PARTITION_BYTES)
+    # Round up to whole waves of tasks.
+    shuffle_partitions = max(min_partitions, int(math.ceil(input_bytes / float(SHUFFLE_PARTITION_BYTES))))
+    shuffle_partitions = int(math.ceil(shuffle_partitions / float(cores))) * cores
+
+    logger.info('Sized the cluster for %.1f GiB of input: %d core and %d task nodes, '
+                'partitions of at most %d bytes and %d shuffle partitions',
+                input_bytes / 1024.0 ** 3, num_core, num_task, max_partition_bytes, shuffle_partitions)
+    return Sizing(num_core, num_task, max_partition_bytes, shuffle_partitions)
+
+
+def sized_submit_args(submit_args, sizing):
+    """
+    Appends the partition settings of `sizing` to spark-submit arguments,
+    unless the arguments configure them already.
+
+    Examples:
+        >>> sized_submit_args(['--conf', 'spark.sql.shuffle.partitions=10'], Sizing(2, 0, 1024, 64))
+        ['--conf', 'spark.sql.shuffle.partitions=10', '--conf', 'spark.sql.files.maxPartitionBytes=1024']
+    """
+    submit_args = list(submit_args or [])
+    for key, value in (('spark.sql.files.maxPartitionBytes', sizing.max_partition_bytes),
+                       ('spark.sql.shuffle.partitions', sizing.shuffle_partitions)):
+        if not any(arg.startswith(key + '=') for arg in submit_args):
+            submit_args.extend(['--conf', '{}={}'.format(key, value)])
+    return submit_args
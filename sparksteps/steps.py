@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 """Create EMR steps and upload files."""
 import os
+import hashlib
+import logging
+import collections
 import tempfile
 import zipfile
 from urllib.parse import urlparse
 
+logger = logging.getLogger(__name__)
+
 REMOTE_DIR = '/home/hadoop/'
 
+App = collections.namedtuple('App', 'path submit_args app_args')
+
 
 def get_basename(path):
     return os.path.basename(os.path.normpath(path))
@@ -19,6 +26,24 @@ def ls_recursive(dirname):
             yield os.path.join(dirpath, f)
 
 
+def path_digest(path):
+    """
+    Returns a digest of the contents of a file, or of the names and contents
+    of the files in a directory.
+    """
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(dirpath, f) for dirpath, _, filenames in os.walk(path) for f in filenames)
+    else:
+        paths = [path]
+    for file_path in paths:
+        digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
 def zip_to_s3(s3_resource, dirpath, bucket, key):
     """Zip folder and upload to S3."""
     with tempfile.SpooledTemporaryFile() as tmp:
@@ -161,10 +186,37 @@ class S3DistCp(CmdStep):
         return ['s3-dist-cp'] + self.s3_dist_cp
 
 
-def get_download_steps(s3_resource, bucket, bucket_path, src_path):
+class CompactionStep(S3DistCp):
+    @property
+    def step_name(self):
+        return "Compaction step"
+
+
+def upload(s3_resource, src_path, bucket, key, journal=None):
+    """
+    Upload a file, or a zipped directory, to S3 unless `journal` records that
+    the same contents were uploaded to `key` before.
+    """
+    digest = None
+    if journal is not None:
+        digest = path_digest(src_path)
+        if journal.is_uploaded(bucket, key, digest):
+            logger.info('Skipping upload of %s, already uploaded to s3://%s/%s', src_path, bucket, key)
+            return
+    if os.path.isdir(src_path):
+        zip_to_s3(s3_resource, src_path, bucket, key=key)
+    else:
+        s3_resource.meta.client.upload_file(src_path, bucket, key)
+    if journal is not None:
+        journal.record('upload', bucket=bucket, key=key, digest=digest)
+
+
+def get_download_steps(s3_resource, bucket, bucket_path, src_path, journal=None):
     """
     Return list of step instances necessary to download file/directory resources onto the EMR master node.
-    May upload local files and directories to S3 to make them available to EMR.
+    May upload local files and directories to S3 to make them available to EMR, unless
+    `s3_resource` is None in which case the steps are returned without uploading anything.
+    Uploads are recorded in `journal`, if given, and skipped when it shows they happened before.
     """
     steps = []
     basename = get_basename(src_path)
@@ -180,13 +232,15 @@ def get_download_steps(s3_resource, bucket, bucket_path, src_path):
         # Directory, will zip and push to S3 first before adding EMR copy/unzip step
         basename = basename + '.zip'
         dest_path = os.path.join(default_dest_path, basename)
-        zip_to_s3(s3_resource, src_path, bucket, key=dest_path)
+        if s3_resource is not None:
+            upload(s3_resource, src_path, bucket, dest_path, journal)
         copy_step = CopyStep(bucket, default_dest_path, basename)
         steps.extend([copy_step, UnzipStep(src_path)])
     elif os.path.isfile(src_path):
         # File, upload to S3 and add copy step
         dest_path = os.path.join(default_dest_path, basename)
-        s3_resource.meta.client.upload_file(src_path, bucket, dest_path)
+        if s3_resource is not None:
+            upload(s3_resource, src_path, bucket, dest_path, journal)
         copy_step = CopyStep(bucket, default_dest_path, basename)
         steps.append(copy_step)
     else:
@@ -197,17 +251,43 @@ def get_download_steps(s3_resource, bucket, bucket_path, src_path):
 
 
 def setup_steps(s3, bucket, bucket_path, app_path, submit_args=None, app_args=None,
-                uploads=None, s3_dist_cp=None):
+                uploads=None, s3_dist_cp=None, journal=None, compaction=None):
     cmd_steps = []
-    paths = uploads or []
-    paths.append(app_path)
+    paths = list(uploads or []) + [app_path]
 
     for src_path in paths:
-        cmd_steps.extend(get_download_steps(s3, bucket, bucket_path, src_path))
+        cmd_steps.extend(get_download_steps(s3, bucket, bucket_path, src_path, journal))
 
     cmd_steps.append(SparkStep(app_path, submit_args, app_args))
 
+    if compaction is not None:
+        cmd_steps.append(CompactionStep(compaction))
+
     if s3_dist_cp is not None:
         cmd_steps.append(S3DistCp(s3_dist_cp))
 
     return [s.step for s in cmd_steps]
+
+
+def setup_concurrent_steps(s3, bucket, bucket_path, apps, uploads=None, journal=None):
+    """
+    Stage `uploads` and the scripts of `apps` once and return the staging steps
+    together with a run step per app. The run steps do not depend on one another
+    and may execute concurrently once all staging steps have completed.
+    """
+    paths = list(uploads or [])
+    remote_apps = {}
+    for app in apps:
+        basename = get_basename(app.path)
+        if remote_apps.setdefault(basename, app.path) != app.path:
+            raise ValueError('Apps {} and {} would both be staged as {}.'.format(
+                remote_apps[basename], app.path, os.path.join(REMOTE_DIR, basename)))
+        if app.path not in paths:
+            paths.append(app.path)
+
+    staging_steps = []
+    for src_path in paths:
+        staging_steps.extend(get_download_steps(s3, bucket, bucket_path, src_path, journal))
+
+    app_steps = [SparkStep(app.path, app.submit_args, app.app_args) for app in apps]
+    return [s.step for s in staging_steps], [s.step for s in app_steps]
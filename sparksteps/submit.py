@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Submit steps to an EMR cluster."""
+import logging
+
+from polling import poll
+
+from sparksteps.poll import FAILED_STATE, NON_TERMINAL_STATES, wait_for_step_complete
+
+logger = logging.getLogger(__name__)
+
+STAGING_SLEEP_INTERVAL_SECONDS = 15
+CAPACITY_SLEEP_INTERVAL_SECONDS = 30
+# EMR accepts at most 256 steps per request and 256 active steps per cluster.
+MAX_STEPS_PER_REQUEST = 256
+MAX_ACTIVE_STEPS = 256
+# Submitting half the active step limit at a time means the next chunk can be
+# submitted while steps of the previous chunk are still pending.
+DEFAULT_CHUNK_SIZE = MAX_ACTIVE_STEPS // 2
+
+
+def list_step_ids(emr_client, cluster_id, states):
+    """Returns the IDs of the steps of a cluster which are in one of `states`."""
+    step_ids = []
+    paginator = emr_client.get_paginator('list_steps')
+    for page in paginator.paginate(ClusterId=cluster_id, StepStates=list(states)):
+        step_ids.extend(step['Id'] for step in page['Steps'])
+    return step_ids
+
+
+def has_capacity(emr_client, cluster_id, num_steps, submitted_step_ids, max_active_steps):
+    """
+    Returns True when the cluster has room for `num_steps` more active steps,
+    raising an exception when one of `submitted_step_ids` did not complete.
+    """
+    failed = set(list_step_ids(emr_client, cluster_id, FAILED_STATE)).intersection(submitted_step_ids)
+    if failed:
+        raise Exception('EMR steps {} did not complete, not submitting the remaining steps'.format(
+            ', '.join(sorted(failed))))
+    num_active = len(list_step_ids(emr_client, cluster_id, NON_TERMINAL_STATES))
+    logger.info('%d active steps on cluster %s', num_active, cluster_id)
+    return num_active + num_steps <= max_active_steps
+
+
+def add_steps(emr_client, cluster_id, steps, chunk_size=DEFAULT_CHUNK_SIZE, max_active_steps=MAX_ACTIVE_STEPS,
+              sleep_interval_s=CAPACITY_SLEEP_INTERVAL_SECONDS, on_submit=None):
+    """
+    Submits `steps` to a cluster, in order, in chunks of at most `chunk_size` steps.
+
+    The first chunk is submitted right away. Every following chunk is submitted
+    once earlier steps have finished and the cluster has room for it, and only
+    if none of the previously submitted steps failed, so steps never run out of order.
+    `on_submit(step_ids)` is called with the step IDs of every chunk once it has been submitted.
+
+    Returns:
+        list: the step IDs of all `steps`.
+    """
+    if not 0 < chunk_size <= min(MAX_STEPS_PER_REQUEST, max_active_steps):
+        raise ValueError('Chunk size must be between 1 and {}.'.format(min(MAX_STEPS_PER_REQUEST, max_active_steps)))
+
+    step_ids = []
+    for start in range(0, len(steps), chunk_size):
+        chunk = steps[start:start + chunk_size]
+        if step_ids:
+            logger.info('Waiting for room to submit steps %d to %d...', start + 1, start + len(chunk))
+            poll(has_capacity,
+                 args=(emr_client, cluster_id, len(chunk), step_ids, max_active_steps),
+                 step=sleep_interval_s,
+                 poll_forever=True)
+        response = emr_client.add_job_flow_steps(JobFlowId=cluster_id, Steps=chunk)
+        step_ids.extend(response['StepIds'])
+        if on_submit is not None:
+            on_submit(response['StepIds'])
+    return step_ids
+
+
+def submit_after_staging(emr_client, cluster_id, staging_steps, steps, step_concurrency_level=1,
+                         sleep_interval_s=STAGING_SLEEP_INTERVAL_SECONDS, submitted_step_ids=(), on_submit=None):
+    """
+    Submits `staging_steps` followed by `steps` at once, so the cluster is
+    never left without pending steps.
+
+    Staging steps depend on one another (archives are unzipped after they have
+    been copied) and are therefore executed with a step concurrency level of 1.
+    Once staging completes, the step concurrency level of the cluster is raised
+    to `step_concurrency_level` so that `steps` may run concurrently.
+
+    When resuming, `submitted_step_ids` are the IDs of the leading steps of
+    `staging_steps + steps` which were submitted before and are not submitted again.
+    The steps must be the same as in the previous attempt, callers resuming with
+    other `steps` only pass the IDs of staging steps.
+
+    Returns:
+        list: the step IDs of `steps`.
+    """
+    concurrent = step_concurrency_level > 1 and staging_steps
+    submitted_step_ids = list(submitted_step_ids)
+    if concurrent and not submitted_step_ids:
+        level = emr_client.describe_cluster(ClusterId=cluster_id)['Cluster'].get('StepConcurrencyLevel', 1)
+        if level != 1:
+            emr_client.modify_cluster(ClusterId=cluster_id, StepConcurrencyLevel=1)
+
+    all_step_ids = submitted_step_ids + add_steps(emr_client, cluster_id,
+                                                  (staging_steps + steps)[len(submitted_step_ids):],
+                                                  on_submit=on_submit)
+    step_ids = all_step_ids[len(staging_steps):]
+
+    if concurrent:
+        logger.info('Waiting for %d staging steps to complete...', len(staging_steps))
+        wait_for_step_complete(emr_client, cluster_id, all_step_ids[len(staging_steps) - 1], sleep_interval_s)
+    if step_concurrency_level > 1:
+        emr_client.modify_cluster(ClusterId=cluster_id, StepConcurrencyLevel=step_concurrency_level)
+    return step_ids
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""Derive Spark executor configurations from EC2 instance resources."""
+import logging
+import collections
+
+logger = logging.getLogger(__name__)
+
+InstanceType = collections.namedtuple('InstanceType', 'name vcpus memory_gib local_disks')
+ExecutorLayout = collections.namedtuple('ExecutorLayout', 'cores memory_mb memory_overhead_mb instances')
+
+# Number of vCPUs, memory (GiB) and instance store volumes of the EC2
+# instance types commonly used with EMR.
+INSTANCE_TYPES = {t.name: t for t in [
+    InstanceType('m4.large', 2, 8, 0),
+    InstanceType('m4.xlarge', 4, 16, 0),
+    InstanceType('m4.2xlarge', 8, 32, 0),
+    InstanceType('m4.4xlarge', 16, 64, 0),
+    InstanceType('m4.10xlarge', 40, 160, 0),
+    InstanceType('m4.16xlarge', 64, 256, 0),
+    InstanceType('m5.xlarge', 4, 16, 0),
+    InstanceType('m5.2xlarge', 8, 32, 0),
+    InstanceType('m5.4xlarge', 16, 64, 0),
+    InstanceType('m5.8xlarge', 32, 128, 0),
+    InstanceType('m5.12xlarge', 48, 192, 0),
+    InstanceType('m5.16xlarge', 64, 256, 0),
+    InstanceType('m5.24xlarge', 96, 384, 0),
+    InstanceType('m5d.xlarge', 4, 16, 1),
+    InstanceType('m5d.2xlarge', 8, 32, 1),
+    InstanceType('m5d.4xlarge', 16, 64, 2),
+    InstanceType('m5d.8xlarge', 32, 128, 2),
+    InstanceType('m5d.12xlarge', 48, 192, 2),
+    InstanceType('m5d.16xlarge', 64, 256, 4),
+    InstanceType('m5d.24xlarge', 96, 384, 4),
+    InstanceType('c3.xlarge', 4, 7.5, 2),
+    InstanceType('c3.2xlarge', 8, 15, 2),
+    InstanceType('c3.4xlarge', 16, 30, 2),
+    InstanceType('c3.8xlarge', 32, 60, 2),
+    InstanceType('c4.large', 2, 3.75, 0),
+    InstanceType('c4.xlarge', 4, 7.5, 0),
+    InstanceType('c4.2xlarge', 8, 15, 0),
+    InstanceType('c4.4xlarge', 16, 30, 0),
+    InstanceType('c4.8xlarge', 36, 60, 0),
+    InstanceType('c5.xlarge', 4, 8, 0),
+    InstanceType('c5.2xlarge', 8, 16, 0),
+    InstanceType('c5.4xlarge', 16, 32, 0),
+    InstanceType('c5.9xlarge', 36, 72, 0),
+    InstanceType('c5.12xlarge', 48, 96, 0),
+    InstanceType('c5.18xlarge', 72, 144, 0),
+    InstanceType('c5.24xlarge', 96, 192, 0),
+    InstanceType('c5d.xlarge', 4, 8, 1),
+    InstanceType('c5d.2xlarge', 8, 16, 1),
+    InstanceType('c5d.4xlarge', 16, 32, 1),
+    InstanceType('c5d.9xlarge', 36, 72, 1),
+    InstanceType('c5d.18xlarge', 72, 144, 2),
+    InstanceType('r4.xlarge', 4, 30.5, 0),
+    InstanceType('r4.2xlarge', 8, 61, 0),
+    InstanceType('r4.4xlarge', 16, 122, 0),
+    InstanceType('r4.8xlarge', 32, 244, 0),
+    InstanceType('r4.16xlarge', 64, 488, 0),
+    InstanceType('r5.xlarge', 4, 32, 0),
+    InstanceType('r5.2xlarge', 8, 64, 0),
+    InstanceType('r5.4xlarge', 16, 128, 0),
+    InstanceType('r5.8xlarge', 32, 256, 0),
+    InstanceType('r5.12xlarge', 48, 384, 0),
+    InstanceType('r5.16xlarge', 64, 512, 0),
+    InstanceType('r5.24xlarge', 96, 768, 0),
+    InstanceType('r5d.xlarge', 4, 32, 1),
+    InstanceType('r5d.2xlarge', 8, 64, 1),
+    InstanceType('r5d.4xlarge', 16, 128, 2),
+    InstanceType('r5d.8xlarge', 32, 256, 2),
+    InstanceType('r5d.12xlarge', 48, 384, 2),
+    InstanceType('r5d.24xlarge', 96, 768, 4),
+    InstanceType('i3.xlarge', 4, 30.5, 1),
+    InstanceType('i3.2xlarge', 8, 61, 1),
+    InstanceType('i3.4xlarge', 16, 122, 2),
+    InstanceType('i3.8xlarge', 32, 244, 4),
+    InstanceType('i3.16xlarge', 64, 488, 8),
+]}
+
+MAX_EXECUTOR_CORES = 5  # Beyond this HDFS/S3 throughput per executor degrades.
+MAX_RESERVED_MEMORY_MB = 8192  # Memory kept back for the OS and Hadoop daemons.
+MEMORY_OVERHEAD_FRACTION = 0.1
+MIN_MEMORY_OVERHEAD_MB = 384
+# Container of the YARN application master of client mode apps: spark.yarn.am.memory and its minimum overhead.
+AM_CONTAINER_MB = 512 + MIN_MEMORY_OVERHEAD_MB
+TASKS_PER_CORE = 2
+SCALING_OPTIONS = ('managed_scaling_min', 'managed_scaling_max', 'autoscale_max')
+
+
+def get_instance_type(name):
+    """Look `name` up in the instance type catalog."""
+    try:
+        return INSTANCE_TYPES[name]
+    except KeyError:
+        raise ValueError('Unknown instance type {}, unable to derive Spark executor settings.'.format(name))
+
+
+def yarn_memory_mb(instance_type):
+    """
+    Approximates the memory EMR makes available to YARN containers on a node,
+    which is the instance memory minus a reservation for the OS and daemons.
+
+    Examples:
+        >>> yarn_memory_mb(INSTANCE_TYPES['m5.xlarge'])
+        12288
+    """
+    memory_mb = int(instance_type.memory_gib * 1024)
+    reserved_mb = min(max(memory_mb // 4, 1024), MAX_RESERVED_MEMORY_MB)
+    return memory_mb - reserved_mb
+
+
+def executors_per_node(instance_type, executor_cores):
+    # One vCPU is left to the NodeManager and DataNode daemons.
+    return max((instance_type.vcpus - 1) // executor_cores, 1)
+
+
+def executor_cores(node_counts):
+    """
+    Picks the number of cores per executor (at most MAX_EXECUTOR_CORES) which leaves
+    the fewest vCPUs unused across the cluster, preferring larger executors on ties.
+    """
+    usable_cores = min(t.vcpus - 1 for t in node_counts)
+    if usable_cores < 2:
+        return 1
+    # Single core executors waste no vCPUs but lose the benefits of sharing a JVM.
+    candidates = range(min(usable_cores, MAX_EXECUTOR_CORES), 1, -1)
+    return max(candidates,
+               key=lambda c: sum(count * executors_per_node(t, c) * c for t, count in node_counts.items()))
+
+
+def executor_instances(node_counts, cores, container_mb):
+    """
+    Returns the number of executors of `container_mb` the cluster holds next to
+    the YARN application master, which takes an executor's place unless the
+    memory left over on some node fits its container.
+    """
+    per_node = {t: min(executors_per_node(t, cores), yarn_memory_mb(t) // container_mb) for t in node_counts}
+    instances = sum(count * per_node[t] for t, count in node_counts.items())
+    if all(yarn_memory_mb(t) - per_node[t] * container_mb < AM_CONTAINER_MB for t in node_counts):
+        instances -= 1
+    return instances
+
+
+def executor_layout(node_counts):
+    """
+    Determines an executor size that fits on every node of the cluster and
+    the number of such executors the cluster can hold.
+
+    Executors either fill the YARN memory of the nodes, giving up one executor
+    for the application master, or are shrunk such that the application master
+    fits next to them on one node, whichever leaves executors more memory.
+
+    Args:
+        node_counts (dict): maps InstanceType to the number of nodes of that type.
+
+    Returns:
+        ExecutorLayout: executor cores, heap, overhead and number of instances.
+
+    Examples:
+        >>> executor_layout({INSTANCE_TYPES['m5.xlarge']: 2}).instances
+        2
+    """
+    cores = executor_cores(node_counts)
+    container_mb = min(yarn_memory_mb(t) // executors_per_node(t, cores) for t in node_counts)
+    candidates = [container_mb] + [min((yarn_memory_mb(t) - AM_CONTAINER_MB) // executors_per_node(t, cores),
+                                       container_mb)
+                                   for t in node_counts]
+    container_mb = max(candidates, key=lambda c: (executor_instances(node_counts, cores, c) * c, c))
+    instances = max(executor_instances(node_counts, cores, container_mb), 1)
+    memory_mb = int(container_mb / (1 + MEMORY_OVERHEAD_FRACTION))
+    overhead_mb = max(container_mb - memory_mb, MIN_MEMORY_OVERHEAD_MB)
+    memory_mb = container_mb - overhead_mb
+    return ExecutorLayout(cores, memory_mb, overhead_mb, instances)
+
+
+def worker_node_counts(**kw):
+    """
+    Returns a mapping from InstanceType to node count for the nodes Spark executors
+    will run on, given emr_config style keyword arguments.
+    """
+    node_counts = collections.Counter()
+    for instance_group in ('core', 'task'):
+        num_instances = kw.get('num_{}'.format(instance_group)) or 0
+        if num_instances:
+            instance_type = get_instance_type(kw.get('instance_type_{}'.format(instance_group)))
+            node_counts[instance_type] += num_instances
+    if not node_counts:
+        # Single node clusters run executors on the master node.
+        node_counts[get_instance_type(kw.get('instance_type_master', 'm4.large'))] = 1
+    return node_counts
+
+
+def is_dynamic_allocation_enabled(defaults):
+    """
+    Returns whether raw `defaults` leave Spark dynamic allocation enabled, as EMR does by default.
+
+    Examples:
+        >>> is_dynamic_allocation_enabled(['spark-defaults', 'spark.dynamicAllocation.enabled=false'])
+        False
+        >>> is_dynamic_allocation_enabled(['spark', 'maximizeResourceAllocation=true'])
+        True
+    """
+    enabled = True
+    classification = None
+    for token in defaults or []:
+        if '=' not in token:
+            classification = token
+        elif classification == 'spark-defaults':
+            key, value = token.split('=', 1)
+            if key == 'spark.dynamicAllocation.enabled':
+                enabled = value.strip().lower() != 'false'
+    return enabled
+
+
+def spark_defaults(**kw):
+    """
+    Returns the tuned `spark-defaults` configuration in the raw format consumed
+    by `cluster.parse_conf`, given emr_config style keyword arguments.
+
+    The number of executors is only set when dynamic allocation is disabled and
+    the cluster does not scale, setting it turns dynamic allocation off on
+    Spark 2 and leaves added nodes idle.
+
+    Examples:
+        >>> spark_defaults(instance_type_core='m5.2xlarge', num_core=4)[:3]
+        ['spark-defaults', 'spark.executor.cores=3', 'spark.executor.memory=10763m']
+    """
+    node_counts = worker_node_counts(**kw)
+    layout = executor_layout(node_counts)
+    parallelism = layout.instances * layout.cores * TASKS_PER_CORE
+
+    for instance_group in ('core', 'task'):
+        if not kw.get('num_{}'.format(instance_group)):
+            continue
+        instance_type = get_instance_type(kw.get('instance_type_{}'.format(instance_group)))
+        if not instance_type.local_disks and not kw.get('ebs_volume_size_{}'.format(instance_group)):
+            logger.warning('%s nodes have no instance store and no additional EBS volumes, '
+                           'shuffle spills will compete with the root volume.', instance_type.name)
+
+    logger.info('Tuned Spark for %d executors with %d cores and %dm memory (%dm overhead).',
+                layout.instances, layout.cores, layout.memory_mb, layout.memory_overhead_mb)
+    conf = [
+        'spark-defaults',
+        'spark.executor.cores={}'.format(layout.cores),
+        'spark.executor.memory={}m'.format(layout.memory_mb),
+        'spark.executor.memoryOverhead={}m'.format(layout.memory_overhead_mb),
+    ]
+    scaling = any(kw.get(option) is not None for option in SCALING_OPTIONS)
+    if not scaling and not is_dynamic_allocation_enabled(kw.get('defaults')):
+        conf.append('spark.executor.instances={}'.format(layout.instances))
+    conf.extend([
+        'spark.default.parallelism={}'.format(parallelism),
+        'spark.sql.shuffle.partitions={}'.format(parallelism),
+    ])
+    return conf
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Sample the utilization of a cluster while its steps run and recommend a size.
+
+YARN memory and vCore utilization and HDFS usage are sampled at a fixed
+interval from CloudWatch, from the YARN ResourceManager of the cluster, or from
+any callable returning a `Sample`, such as a recorded trace. Samples are stored
+as whole percentages, one byte each, and the resolution is halved whenever the
+series grows beyond its capacity, so memory stays bounded for long runs.
+
+Once the steps complete, the 95th percentile utilization determines the
+capacity the workers needed. Every size of the same instance family is
+considered and the cheapest number of nodes providing that capacity, with
+headroom, is recommended along with the estimated cost difference.
+"""
+import json
+import math
+import time
+import array
+import logging
+import collections
+import urllib.request
+
+from sparksteps import tuning
+from sparksteps import autoscale
+from sparksteps.poll import Poller
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_INTERVAL_SECONDS = 60
+MAX_POINTS = 1440
+MISSING = 255  # Stored for metrics which were not available.
+TARGET_UTILIZATION_PCT = 70.0  # Utilization a right-sized cluster peaks at, leaving headroom.
+HDFS_PRESSURE_PCT = 80.0  # Above this HDFS usage workers are not shrunk.
+
+FIELDS = ('memory_pct', 'vcores_pct', 'hdfs_pct')
+Sample = collections.namedtuple('Sample', FIELDS)
+Recommendation = collections.namedtuple('Recommendation', [
+    'role', 'instance_type', 'num_nodes', 'recommended_instance_type', 'recommended_num_nodes',
+    'hourly_cost_delta', 'run_cost_delta', 'reason'])
+
+
+class TimeSeries(object):
+    """
+    Samples taken at a fixed interval, stored as whole percentages.
+
+    Examples:
+        >>> series = TimeSeries(interval_s=60, max_points=4)
+        >>> for pct in (10, 20, 30, 40, 50):
+        ...     series.add(Sample(pct, None, 5))
+        >>> series.interval_s, list(series.points['memory_pct'])
+        (120, [15, 35, 50])
+    """
+    def __init__(self, interval_s=DEFAULT_SAMPLE_INTERVAL_SECONDS, max_points=MAX_POINTS, start=None):
+        self.interval_s = interval_s
+        self.max_points = max_points
+        self.start = start
+        self.points = {field: array.array('B') for field in FIELDS}
+
+    def __len__(self):
+        return len(self.points[FIELDS[0]])
+
+    def add(self, sample):
+        if self.start is None:
+            self.start = time.time()
+        for field in FIELDS:
+            value = getattr(sample, field)
+            self.points[field].append(MISSING if value is None else int(round(min(max(value, 0), 100))))
+        if len(self) > self.max_points:
+            self.downsample()
+
+    def downsample(self):
+        """Halves the resolution of the series, averaging pairs of samples."""
+        for field in FIELDS:
+            points = self.points[field]
+            merged = array.array('B')
+            for i in range(0, len(points), 2):
+                pair = [p for p in points[i:i + 2] if p != MISSING]
+                merged.append(int(round(sum(pair) / float(len(pair)))) if pair else MISSING)
+            self.points[field] = merged
+        self.interval_s *= 2
+
+    def percentile(self, field, q):
+        """Returns the `q`th percentile of a metric, or None when it was never available."""
+        values = sorted(p for p in self.points[field] if p != MISSING)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * q / 100.0))]
+
+    def to_dict(self):
+        return {'start': self.start, 'interval_s': self.interval_s,
+                'points': {field: list(points) for field, points in self.points.items()}}
+
+    @classmethod
+    def from_dict(cls, data, max_points=MAX_POINTS):
+        series = cls(data['interval_s'], max_points, data['start'])
+        for field in FIELDS:
+            series.points[field] = array.array('B', data['points'][field])
+        return series
+
+
+class CloudWatchUtilization(autoscale.CloudWatchMetrics):
+    """
+    Samples the YARN memory and HDFS utilization EMR publishes to CloudWatch.
+    EMR does not publish vCore utilization.
+
+    Args:
+        cloudwatch_client: boto3 CloudWatch client
+    """
+    METRICS = (('memory_available_pct', 'YARNMemoryAvailablePercentage'), ('hdfs_pct', 'HDFSUtilization'))
+
+    def sample(self, values):
+        if 'memory_available_pct' not in values:
+            # Metrics are only published once the cluster is running.
+            return None
+        return Sample(100 - values['memory_available_pct'], None, values.get('hdfs_pct'))
+
+
+class YarnUtilization(object):
+    """
+    Samples YARN memory and vCore utilization from the ResourceManager REST API
+    of the master node, which must be reachable from this machine.
+
+    Args:
+        emr_client: boto3 EMR client, used to look the master node up.
+        port (int): port of the ResourceManager web service.
+    """
+    def __init__(self, emr_client, port=8088, timeout_s=10):
+        self.emr_client = emr_client
+        self.port = port
+        self.timeout_s = timeout_s
+        self._masters = {}
+
+    def master(self, cluster_id):
+        if cluster_id not in self._masters:
+            cluster = self.emr_client.describe_cluster(ClusterId=cluster_id)['Cluster']
+            if not cluster.get('MasterPublicDnsName'):
+                return None
+            self._masters[cluster_id] = cluster['MasterPublicDnsName']
+        return self._masters[cluster_id]
+
+    def __call__(self, cluster_id):
+        master = self.master(cluster_id)
+        if master is None:
+            return None
+        url = 'http://{}:{}/ws/v1/cluster/metrics'.format(master, self.port)
+        with urllib.request.urlopen(url, timeout=self.timeout_s) as response:
+            metrics = json.loads(response.read().decode('utf-8'))['clusterMetrics']
+        if not metrics.get('totalMB'):
+            return None
+        return Sample(100.0 * metrics['allocatedMB'] / metrics['totalMB'],
+                      100.0 * metrics['allocatedVirtualCores'] / metrics['totalVirtualCores'], None)
+
+
+class RecordedUtilization(autoscale.RecordedMetrics):
+    """
+    Replays a recorded trace of samples, one per call, and None once the
+    trace is exhausted.
+
+    Args:
+        samples (list): `Sample`s or dicts with the fields of `Sample`.
+    """
+    SAMPLE = Sample
+
+
+class UtilizationSampler(Poller):
+    """
+    Samples the utilization of a cluster into a `TimeSeries` from a background thread.
+
+    Args:
+        cluster_id (str): cluster to sample.
+        metrics: returns a `Sample` of a cluster, or None when none is available.
+        interval_s (int): seconds between samples.
+    """
+    thread_name = 'sparksteps-utilization'
+    failure_message = 'Failed to sample the utilization of cluster %s'
+
+    def __init__(self, cluster_id, metrics, interval_s=DEFAULT_SAMPLE_INTERVAL_SECONDS, max_points=MAX_POINTS):
+        Poller.__init__(self, cluster_id, interval_s)
+        self.metrics = metrics
+        self.series = TimeSeries(interval_s, max_points)
+
+    def step(self):
+        """Takes a sample, returning it or None when none was available."""
+        sample = self.metrics(self.cluster_id)
+        if sample is not None:
+            self.series.add(sample)
+        return sample
+
+
+def family(instance_type_name):
+    return instance_type_name.split('.', 1)[0]
+
+
+def recommend(series, price_func, duration_s=None, **kw):
+    """
+    Recommends the instance type and number of nodes of the task group, or of
+    the core group when there are no task nodes, given the utilization sampled
+    while the steps ran and emr_config style keyword arguments.
+
+    Args:
+        series (TimeSeries): utilization of the cluster.
+        price_func: returns the hourly price of an instance type.
+        duration_s (float): how long the steps ran, to estimate the cost difference of the run.
+
+    Returns:
+        Recommendation: or None when no utilization was sampled.
+    """
+    peaks = [series.percentile(field, 95) for field in ('memory_pct', 'vcores_pct')]
+    peaks = [p for p in peaks if p is not None]
+    if not peaks:
+        return None
+    peak = max(peaks)
+    hdfs_peak = series.percentile('hdfs_pct', 95)
+
+    role = 'task' if kw.get('num_task') else 'core'
+    other = 'core' if role == 'task' else 'task'
+    current = tuning.get_instance_type(kw['instance_type_{}'.format(role)])
+    num_nodes = kw['num_{}'.format(role)]
+    fixed_vcpus = fixed_memory = 0
+    if kw.get('num_{}'.format(other)):
+        fixed = tuning.get_instance_type(kw['instance_type_{}'.format(other)])
+        fixed_vcpus, fixed_memory = fixed.vcpus * kw['num_' + other], fixed.memory_gib * kw['num_' + other]
+
+    # Capacity the workers needed to peak at the target utilization.
+    scale = peak / TARGET_UTILIZATION_PCT
+    needed_vcpus = (fixed_vcpus + current.vcpus * num_nodes) * scale - fixed_vcpus
+    needed_memory = (fixed_memory + current.memory_gib * num_nodes) * scale - fixed_memory
+    if hdfs_peak is not None and hdfs_peak >= HDFS_PRESSURE_PCT and role == 'core':
+        # HDFS is stored on the core nodes, which must keep their capacity.
+        needed_vcpus = max(needed_vcpus, current.vcpus * num_nodes)
+        needed_memory = max(needed_memory, current.memory_gib * num_nodes)
+
+    candidates = []
+    for instance_type in tuning.INSTANCE_TYPES.values():
+        if family(instance_type.name) != family(current.name):
+            continue
+        nodes = max(1, int(math.ceil(max(needed_vcpus / instance_type.vcpus,
+                                         needed_memory / instance_type.memory_gib))))
+        # The current instance type wins ties.
+        candidates.append((nodes * price_func(instance_type.name), instance_type.name != current.name,
+                           instance_type.name, nodes))
+    cost, _, recommended_type, recommended_nodes = min(candidates)
+    hourly_delta = cost - num_nodes * price_func(current.name)
+
+    if (recommended_type, recommended_nodes) == (current.name, num_nodes):
+        reason = 'utilization peaked at {:.0f}%, the size fits'.format(peak)
+    elif hourly_delta < 0:
+        reason = 'utilization peaked at {:.0f}%, the {} nodes are oversized'.format(peak, role)
+    else:
+        reason = 'utilization peaked at {:.0f}%, the {} nodes are undersized'.format(peak, role)
+    run_delta = hourly_delta * duration_s / 3600.0 if duration_s is not None else None
+    return Recommendation(role, current.name, num_nodes, recommended_type, recommended_nodes,
+                          hourly_delta, run_delta, reason)
+
+
+def format_recommendation(recommendation):
+    """Returns a human readable recommendation."""
+    r = recommendation
+    text = '{}: {} {} x {} -> {} x {} ({:+.2f} USD per hour'.format(
+        r.reason.capitalize(), r.role, r.num_nodes, r.instance_type, r.recommended_num_nodes,
+        r.recommended_instance_type, r.hourly_cost_delta)
+    if r.run_cost_delta is not None:
+        text += ', {:+.2f} USD for this run'.format(r.run_cost_delta)
+    return text + ')'
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Test autoscaling the task group."""
+import os
+import shlex
+
+import pytest
+
+from unittest.mock import MagicMock
+
+from sparksteps import __main__
+from sparksteps.autoscale import CloudWatchMetrics, RecordedMetrics, Sample, TaskGroupScaler
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+TRACE = os.path.join(DIR_PATH, 'data', 'autoscale_trace.json')
+
+
+def mock_emr_client(core_count, task_count, task_state='RUNNING'):
+    """Returns a mocked EMR client whose task group follows `modify_instance_groups`."""
+    groups = [
+        {'Id': 'ig-core', 'InstanceGroupType': 'CORE', 'RequestedInstanceCount': core_count,
+         'RunningInstanceCount': core_count, 'Status': {'State': 'RUNNING'}},
+        {'Id': 'ig-task', 'InstanceGroupType': 'TASK', 'RequestedInstanceCount': task_count,
+         'RunningInstanceCount': task_count, 'Status': {'State': task_state}},
+    ]
+
+    def modify_instance_groups(ClusterId, InstanceGroups):
+        groups[1]['RequestedInstanceCount'] = groups[1]['RunningInstanceCount'] = InstanceGroups[0]['InstanceCount']
+
+    client = MagicMock()
+    client.get_paginator.return_value.paginate.side_effect = lambda **kw: [{'InstanceGroups': groups}]
+    client.modify_instance_groups.side_effect = modify_instance_groups
+    return client
+
+
+def test_task_group_scaler_with_recorded_trace():
+    client = mock_emr_client(core_count=2, task_count=2)
+    # The scaler started a cooldown before the trace was recorded.
+    now = [-300]
+    scaler = TaskGroupScaler(client, 'j-1', RecordedMetrics.load(TRACE), min_count=1, max_count=8,
+                             scale_out_cooldown_s=300, scale_in_cooldown_s=300, clock=lambda: now[0])
+    sizes = []
+    for now[0] in range(0, 13 * 60, 60):
+        sizes.append(scaler.step())
+
+    # Pending containers grow the group to its maximum, idle memory shrinks it once the cooldown passed.
+    assert scaler.resizes == [(0, 2, 8), (300, 8, 4), (600, 4, 1)]
+    assert [s for s in sizes if s is not None] == [8, 4, 1]
+    assert client.modify_instance_groups.call_count == 3
+    client.modify_instance_groups.assert_called_with(
+        ClusterId='j-1', InstanceGroups=[{'InstanceGroupId': 'ig-task', 'InstanceCount': 1}])
+
+
+def test_task_group_scaler_waits_for_warm_up():
+    client = mock_emr_client(core_count=2, task_count=2)
+    now = [1000]
+    scaler = TaskGroupScaler(client, 'j-1', MagicMock(return_value=Sample(12, 8, 0)), min_count=1, max_count=8,
+                             scale_out_cooldown_s=300, scale_in_cooldown_s=300, clock=lambda: now[0])
+    for now[0] in range(1000, 1300, 60):
+        assert scaler.step() is None
+    client.modify_instance_groups.assert_not_called()
+    now[0] = 1300
+    assert scaler.step() == 8
+
+
+def test_task_group_scaler_waits_for_resize():
+    client = mock_emr_client(core_count=2, task_count=2, task_state='RESIZING')
+    metrics = MagicMock(return_value=Sample(10, 4, 0))
+    scaler = TaskGroupScaler(client, 'j-1', metrics, min_count=0, max_count=10)
+    assert scaler.step() is None
+    metrics.assert_not_called()
+    client.modify_instance_groups.assert_not_called()
+
+
+def test_task_group_scaler_bounds():
+    with pytest.raises(ValueError):
+        TaskGroupScaler(MagicMock(), 'j-1', MagicMock(), min_count=5, max_count=2)
+
+
+def test_cloudwatch_metrics():
+    cloudwatch = MagicMock()
+    cloudwatch.get_metric_data.return_value = {'MetricDataResults': [
+        {'Id': 'containers_pending', 'Values': [3.0, 1.0]},
+        {'Id': 'containers_allocated', 'Values': [12.0]},
+        {'Id': 'memory_available_pct', 'Values': [20.0]},
+    ]}
+    metrics = CloudWatchMetrics(cloudwatch)
+    assert metrics('j-1') == Sample(3.0, 12.0, 20.0)
+    query = cloudwatch.get_metric_data.call_args[1]['MetricDataQueries'][0]
+    assert query['MetricStat']['Metric']['Dimensions'] == [{'Name': 'JobFlowId', 'Value': 'j-1'}]
+
+    cloudwatch.get_metric_data.return_value = {'MetricDataResults': [
+        {'Id': 'containers_pending', 'Values': []},
+    ]}
+    assert metrics('j-1') is None
+
+
+def test_parser_with_autoscale():
+    parser = __main__.create_parser()
+    cmd_args_str = "episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 --wait "
+    args = __main__.parse_cli_args(parser, args=shlex.split(
+        cmd_args_str + "--num-task 2 --instance-type-task m5.xlarge --autoscale-max 10"))
+    assert args['autoscale_min'] == 0
+    assert args['autoscale_max'] == 10
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--autoscale-max 10"))
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(
+            cmd_args_str + "--num-task 2 --autoscale-min 4 --autoscale-max 2"))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Test caching the result of bootstrap scripts."""
+import os
+import shlex
+import shutil
+import subprocess
+
+import boto3
+import pytest
+
+from moto import mock_s3
+
+from sparksteps import __main__
+from sparksteps import bootstrap
+from sparksteps.cluster import emr_config
+
+TEST_BUCKET = 'sparksteps-test'
+SCRIPT_URI = 's3://{}/bootstrap.sh'.format(TEST_BUCKET)
+FAKE_AWS = r"""#!/bin/bash
+# Copies between local files and "s3://" URIs mapped below $FAKE_S3.
+args=()
+for arg in "$@"; do
+    [ "$arg" = "--only-show-errors" ] || args+=("$arg")
+done
+src="${args[2]/#s3:\/\//$FAKE_S3/}"
+dst="${args[3]/#s3:\/\//$FAKE_S3/}"
+mkdir -p "$(dirname "$dst")"
+cp "$src" "$dst"
+"""
+
+
+@pytest.fixture
+def s3_client():
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    with mock_s3():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=TEST_BUCKET)
+        client.put_object(Bucket=TEST_BUCKET, Key='bootstrap.sh', Body=b'pip install numpy')
+        yield client
+
+
+def test_bootstrap_digest(s3_client):
+    digest = bootstrap.bootstrap_digest(s3_client, SCRIPT_URI, 'emr-6.2.0', ['/opt/lib'])
+    assert digest == bootstrap.bootstrap_digest(s3_client, SCRIPT_URI, 'emr-6.2.0', ['/opt/lib'])
+    assert digest != bootstrap.bootstrap_digest(s3_client, SCRIPT_URI, 'emr-6.3.0', ['/opt/lib'])
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='bootstrap.sh', Body=b'pip install numpy pandas')
+    assert digest != bootstrap.bootstrap_digest(s3_client, SCRIPT_URI, 'emr-6.2.0', ['/opt/lib'])
+
+
+def test_plan_bootstrap_cache(s3_client):
+    args = {'s3_bucket': TEST_BUCKET, 's3_path': 'sparksteps/', 'bootstrap_script': SCRIPT_URI,
+            'release_label': 'emr-6.2.0', 'bootstrap_cache_paths': ['/opt/lib'], 'bootstrap_inputs': None}
+    planned = __main__.plan_bootstrap_cache(s3_client, args)
+    wrapper_key = bootstrap.wrapper_key('sparksteps/')
+    assert planned['bootstrap_wrapper'] == 's3://{}/{}'.format(TEST_BUCKET, wrapper_key)
+    assert s3_client.get_object(Bucket=TEST_BUCKET, Key=wrapper_key)['Body'].read().decode() == \
+        bootstrap.WRAPPER_SCRIPT
+    assert planned['bootstrap_cache_uri'].startswith('s3://{}/sparksteps/bootstrap-cache/emr-6.2.0/'.format(
+        TEST_BUCKET))
+
+    config = emr_config(instance_type_master='m5.xlarge', **planned)
+    assert config['BootstrapActions'] == [{'Name': 'bootstrap', 'ScriptBootstrapAction': {
+        'Path': planned['bootstrap_wrapper'], 'Args': [SCRIPT_URI, planned['bootstrap_cache_uri'], '/opt/lib']}}]
+
+    # Existing clusters are not bootstrapped.
+    assert __main__.plan_bootstrap_cache(s3_client, dict(args, cluster_id='j-1')) == dict(args, cluster_id='j-1')
+
+
+@pytest.mark.skipif(shutil.which('bash') is None or shutil.which('tar') is None, reason='requires bash and tar')
+def test_wrapper_script(tmpdir):
+    bin_dir, fake_s3 = tmpdir.mkdir('bin'), tmpdir.mkdir('s3')
+    for name, body in (('aws', FAKE_AWS), ('sudo', '#!/bin/bash\nexec "$@"\n')):
+        bin_dir.join(name).write(body)
+        bin_dir.join(name).chmod(0o755)
+    wrapper = tmpdir.join('wrapper.sh')
+    wrapper.write(bootstrap.WRAPPER_SCRIPT)
+    info = tmpdir.join('instance.json')
+    info.write('{"isMaster": true}')
+    cached_dir = tmpdir.join('opt', 'lib')
+    fake_s3.mkdir('bucket').join('bootstrap.sh').write(
+        '#!/bin/bash\nmkdir -p {0} && echo built > {0}/native.so\n'.format(cached_dir))
+    env = dict(os.environ, PATH='{}:{}'.format(bin_dir, os.environ['PATH']), FAKE_S3=str(fake_s3),
+               SPARKSTEPS_INSTANCE_INFO=str(info))
+    cmd = ['bash', str(wrapper), 's3://bucket/bootstrap.sh', 's3://bucket/cache/abc', str(cached_dir)]
+
+    # On a miss the script runs and its result is published.
+    subprocess.run(cmd, env=env, check=True, stdout=subprocess.PIPE)
+    published = fake_s3.join('bucket', 'cache').listdir()
+    assert len(published) == 1 and published[0].basename.startswith('abc-')
+
+    # On a hit the result is extracted without running the script.
+    shutil.rmtree(str(cached_dir))
+    fake_s3.join('bucket', 'bootstrap.sh').write('#!/bin/bash\nexit 1\n')
+    out = subprocess.run(cmd, env=env, check=True, stdout=subprocess.PIPE).stdout.decode()
+    assert out.startswith('Extracting cached bootstrap result')
+    assert cached_dir.join('native.so').read() == 'built\n'
+
+
+def test_parser_with_bootstrap_cache():
+    parser = __main__.create_parser()
+    cmd_args_str = ("episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 "
+                    "--bootstrap-cache-paths /usr/local/lib/python3.7 ")
+    args = __main__.parse_cli_args(parser, args=shlex.split(
+        cmd_args_str + "--bootstrap-script s3://b/bootstrap.sh --bootstrap-inputs s3://b/requirements.txt"))
+    assert args['bootstrap_cache_paths'] == ['/usr/local/lib/python3.7']
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str))
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "lib --bootstrap-script s3://b/b.sh"))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Test terminating clusters exceeding their budget."""
+import shlex
+
+import pytest
+
+from unittest.mock import MagicMock
+
+from sparksteps import __main__
+from sparksteps.budget import REASON_TAG, BudgetGuard, running_instance_groups
+
+
+def emr_client(task_count=4):
+    emr = MagicMock()
+    groups = [
+        {'InstanceGroupType': 'MASTER', 'InstanceType': 'm5.xlarge', 'RunningInstanceCount': 1, 'Market': 'ON_DEMAND'},
+        {'InstanceGroupType': 'CORE', 'InstanceType': 'm5.xlarge', 'RunningInstanceCount': 2, 'Market': 'ON_DEMAND',
+         'EbsBlockDevices': [{'VolumeSpecification': {'VolumeType': 'gp2', 'SizeInGB': 730}, 'Device': '/dev/sdb'}]},
+        {'InstanceGroupType': 'TASK', 'InstanceType': 'm5.xlarge', 'RunningInstanceCount': task_count,
+         'Market': 'SPOT', 'BidPrice': '0.1'},
+    ]
+    pages = {'list_instance_groups': [{'InstanceGroups': groups}],
+             'list_steps': [{'Steps': [{'Id': 's-1'}, {'Id': 's-2'}]}]}
+    emr.get_paginator.side_effect = lambda name: MagicMock(**{'paginate.return_value': pages[name]})
+    return emr
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_running_instance_groups():
+    groups = running_instance_groups(emr_client(), 'j-1')
+    assert [(g.role, g.count, g.bid_price) for g in groups] == [('MASTER', 1, None), ('CORE', 2, None),
+                                                                ('TASK', 4, 0.1)]
+    assert groups[1].ebs_volumes == [('gp2', 730)]
+
+
+def test_guard_terminates_over_max_cost():
+    emr, clock, exceeded = emr_client(), Clock(), []
+    guard = BudgetGuard(emr, 'j-1', lambda instance_type: 0.2, max_cost=2.0, clock=clock,
+                        on_exceeded=lambda **kw: exceeded.append(kw))
+    assert guard.step() is None
+    # 3 x 0.2 on demand, 2 x 0.1 for the EBS volumes and 4 x 0.1 spot per hour.
+    assert guard.hourly_cost == pytest.approx(1.2)
+    clock.now = 3600
+    assert guard.step() is None
+    assert guard.accrued_cost == pytest.approx(1.2)
+    emr.terminate_job_flows.assert_not_called()
+
+    clock.now = 7200
+    assert guard.step() == 'accrued cost 2.40 USD exceeded max-cost 2.00 USD'
+    emr.cancel_steps.assert_called_once_with(ClusterId='j-1', StepIds=['s-1', 's-2'],
+                                             StepCancellationOption='SEND_INTERRUPT')
+    emr.add_tags.assert_called_once_with(ResourceId='j-1', Tags=[{'Key': REASON_TAG, 'Value': guard.reason}])
+    emr.terminate_job_flows.assert_called_once_with(JobFlowIds=['j-1'])
+    assert exceeded == [{'cluster_id': 'j-1', 'reason': guard.reason, 'cost': pytest.approx(2.4), 'runtime_s': 7200}]
+
+    # The cluster is only terminated once.
+    clock.now = 10800
+    assert guard.step() is None
+    emr.terminate_job_flows.assert_called_once()
+
+
+def test_guard_terminates_over_max_runtime():
+    emr, clock = emr_client(), Clock()
+    emr.cancel_steps.side_effect = Exception('ValidationException')
+    guard = BudgetGuard(emr, 'j-1', lambda instance_type: 0.2, max_runtime_s=600, clock=clock)
+    clock.now = 600
+    assert guard.step() == 'runtime 600s exceeded max-runtime 600s'
+    emr.terminate_job_flows.assert_called_once_with(JobFlowIds=['j-1'])
+
+    with pytest.raises(ValueError):
+        BudgetGuard(emr, 'j-1', lambda instance_type: 0.2)
+
+
+def test_guard_terminates_when_tagging_fails():
+    emr, clock = emr_client(), Clock()
+    emr.add_tags.side_effect = Exception('AccessDenied')
+    guard = BudgetGuard(emr, 'j-1', lambda instance_type: 0.2, max_runtime_s=600, clock=clock)
+    clock.now = 600
+    assert guard.step() is not None
+    emr.terminate_job_flows.assert_called_once_with(JobFlowIds=['j-1'])
+
+
+def test_guard_retries_failed_termination():
+    emr, clock = emr_client(), Clock()
+    emr.terminate_job_flows.side_effect = [Exception('ThrottlingException'), {}]
+    guard = BudgetGuard(emr, 'j-1', lambda instance_type: 0.2, max_runtime_s=600, clock=clock)
+    clock.now = 600
+    with pytest.raises(Exception, match='ThrottlingException'):
+        guard.step()
+    assert guard.reason is None
+    clock.now = 660
+    assert guard.step() == 'runtime 660s exceeded max-runtime 600s'
+    assert emr.terminate_job_flows.call_count == 2
+
+
+def test_parser_with_max_cost():
+    parser = __main__.create_parser()
+    cmd_args_str = "episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 "
+    args = __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--wait --max-cost 25.5"))
+    assert (args['max_cost'], args['max_runtime']) == (25.5, None)
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--max-runtime 3600"))
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--wait --max-cost -1"))
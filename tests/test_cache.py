@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Test the step cache."""
+import os
+import shlex
+
+import boto3
+import pytest
+
+from unittest.mock import patch
+
+from moto import mock_emr, mock_s3
+
+from sparksteps import __main__
+from sparksteps.cache import StepCache, s3_fingerprint
+from sparksteps.steps import App
+
+TEST_BUCKET = 'sparksteps-test'
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+EPISODES_APP = os.path.join(DIR_PATH, 'data', 'episodes.py')
+LIB_DIR = os.path.join(DIR_PATH, 'data', 'dir')
+
+
+@pytest.fixture(scope='function')
+def s3_client():
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    with mock_s3():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=TEST_BUCKET)
+        yield client
+
+
+def test_s3_fingerprint(s3_client):
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='input/part-0', Body=b'a')
+    fingerprint = s3_fingerprint(s3_client, 's3://{}/input/'.format(TEST_BUCKET))
+    assert fingerprint == s3_fingerprint(s3_client, 's3://{}/input/'.format(TEST_BUCKET))
+
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='input/part-0', Body=b'b')
+    assert s3_fingerprint(s3_client, 's3://{}/input/'.format(TEST_BUCKET)) != fingerprint
+
+
+def test_cache_key(s3_client):
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='input/part-0', Body=b'a')
+    inputs = ['s3://{}/input/'.format(TEST_BUCKET)]
+    cache = StepCache(s3_client, TEST_BUCKET, 'sparksteps/', uploads=[LIB_DIR])
+    app = App(EPISODES_APP, None, ['--date', '2020-01-01'])
+    key = cache.key(app, inputs)
+
+    assert cache.key(app, inputs) == key
+    assert StepCache(s3_client, TEST_BUCKET, 'sparksteps/', uploads=[LIB_DIR]).key(app, inputs) == key
+    assert cache.key(app._replace(app_args=['--date', '2020-01-02']), inputs) != key
+    assert cache.key(app._replace(submit_args=['--deploy-mode', 'cluster']), inputs) != key
+    assert StepCache(s3_client, TEST_BUCKET, 'sparksteps/').key(app, inputs) != key
+
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='input/part-1', Body=b'b')
+    assert cache.key(app, inputs) != key
+
+
+def test_cache_lookup(s3_client):
+    cache = StepCache(s3_client, TEST_BUCKET, 'sparksteps/')
+    app = App(EPISODES_APP, None, None)
+    output = 's3://{}/output/'.format(TEST_BUCKET)
+    assert cache.lookup('abc') is None
+
+    cache.store('abc', app, [output])
+    assert s3_client.head_object(Bucket=TEST_BUCKET, Key='sparksteps/cache/abc.json')
+    # Outputs which no longer exist invalidate the record.
+    assert cache.lookup('abc') is None
+
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='output/_SUCCESS', Body=b'')
+    assert cache.lookup('abc')['outputs'] == [output]
+
+
+def test_parser_with_cache():
+    parser = __main__.create_parser()
+    cmd_args_str = "episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 --cache "
+    args = __main__.parse_cli_args(parser, args=shlex.split(
+        cmd_args_str + "--wait --inputs s3://bucket/input/ --outputs s3://bucket/output/"))
+    assert args['inputs'] == ['s3://bucket/input/']
+    assert args['outputs'] == ['s3://bucket/output/']
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--wait"))
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(
+            cmd_args_str + "--wait --outputs s3://bucket/output/ --sweep-args='--date 2020-01-01'"))
+
+
+def test_main_skips_cached_app(tmpdir):
+    argv = ['sparksteps', EPISODES_APP, '--s3-bucket', TEST_BUCKET, '--aws-region', 'us-east-1',
+            '--release-label', 'emr-6.2.0', '--uploads', LIB_DIR, '--cache', '--wait',
+            '--outputs', 's3://{}/output/'.format(TEST_BUCKET), '--journal', str(tmpdir.join('run.jsonl')),
+            '--history', str(tmpdir.join('history.sqlite'))]
+    credentials = {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing'}
+    with mock_emr(), mock_s3(), patch.dict(os.environ, credentials):
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=TEST_BUCKET)
+        client.put_object(Bucket=TEST_BUCKET, Key='output/_SUCCESS', Body=b'')
+        app = App(EPISODES_APP, None, None)
+        cache = StepCache(client, TEST_BUCKET, 'sparksteps/', uploads=[LIB_DIR])
+        cache.store(cache.key(app), app, ['s3://{}/output/'.format(TEST_BUCKET)])
+
+        with patch('sys.argv', argv), patch('sparksteps.launcher.launch_clusters') as mock_launch:
+            __main__.main()
+        mock_launch.assert_not_called()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Test building compaction steps."""
+import os
+import shlex
+
+import boto3
+import pytest
+
+from moto import mock_s3
+
+from sparksteps import __main__
+from sparksteps.compaction import compaction_args, group_by_pattern
+from sparksteps.steps import setup_steps
+
+TEST_BUCKET = 'sparksteps-test'
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+EPISODES_APP = os.path.join(DIR_PATH, 'data', 'episodes.py')
+
+
+@pytest.fixture(scope='function')
+def s3_client():
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    with mock_s3():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=TEST_BUCKET)
+        yield client
+
+
+def test_compaction_args(s3_client):
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='output/_SUCCESS', Body=b'')
+    for date in ('2020-01-01', '2020-01-02'):
+        for part in range(3):
+            key = 'output/date={}/part-0000{}-c000.json.gz'.format(date, part)
+            s3_client.put_object(Bucket=TEST_BUCKET, Key=key, Body=b'a' * 100)
+
+    src = 's3://{}/output/'.format(TEST_BUCKET)
+    args = compaction_args(s3_client, src, 's3://{}/compacted/'.format(TEST_BUCKET), target_size_mb=128)
+    assert args == ['--src', src, '--dest', 's3://{}/compacted/'.format(TEST_BUCKET),
+                    '--groupBy', r'.*/([^/]+)/part[^/]*(\.json)\.gz', '--targetSize', '128', '--outputCodec', 'gzip']
+
+    # Files which are large enough already are left alone.
+    assert compaction_args(s3_client, src, 's3://{}/compacted/'.format(TEST_BUCKET), target_size_mb=0) is None
+
+
+def test_compaction_args_without_sample(s3_client):
+    with pytest.raises(ValueError, match='No files to sample'):
+        compaction_args(s3_client, 'hdfs:///output', 's3://{}/output/'.format(TEST_BUCKET),
+                        sample_uri='s3://{}/missing/'.format(TEST_BUCKET), output_codec='snappy')
+
+    # Dry runs show the default pattern without listing files.
+    args = __main__.plan_compaction(None, {'compact_src': 'hdfs:///output', 'compact_dest': 's3://bucket/output/',
+                                           'compact_target_size': 256, 'compact_codec': 'snappy'})['compaction']
+    assert args[args.index('--groupBy') + 1] == r'.*/(part)-[^/]*'
+    assert args[args.index('--outputCodec') + 1] == 'snappy'
+
+
+def test_compaction_refuses_parquet(s3_client):
+    src, dest = 's3://{}/output/'.format(TEST_BUCKET), 's3://{}/compacted/'.format(TEST_BUCKET)
+    # Formats which cannot be verified are refused as well: without sampled files or without an S3 client.
+    for client in (s3_client, None):
+        with pytest.raises(ValueError):
+            compaction_args(client, src, dest)
+        with pytest.raises(ValueError):
+            compaction_args(client, 'hdfs:///output', dest)
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='output/part-00000.snappy.parquet', Body=b'a')
+    with pytest.raises(ValueError, match='cannot be compacted'):
+        compaction_args(s3_client, src, dest)
+
+
+def test_group_by_pattern_mixed_depths():
+    with pytest.raises(ValueError):
+        group_by_pattern(['out/part-0', 'out/date=1/part-1'], 'out/')
+
+
+def test_setup_steps_with_compaction():
+    compaction = ['--src', 'hdfs:///output', '--dest', 's3://bucket/output/']
+    emr_steps = setup_steps(None, TEST_BUCKET, 'sparksteps', EPISODES_APP, s3_dist_cp=['--src', 'hdfs:///logs'],
+                            compaction=compaction)
+    assert [s['Name'] for s in emr_steps] == ['Copy episodes.py', 'Run episodes.py', 'Compaction step',
+                                              'S3DistCp step']
+    assert emr_steps[2]['HadoopJarStep']['Args'] == ['s3-dist-cp'] + compaction
+
+
+def test_parser_with_compaction():
+    parser = __main__.create_parser()
+    cmd_args_str = EPISODES_APP + " --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 "
+    compact_args_str = cmd_args_str + "--compact-src hdfs:///output --compact-dest s3://bucket/output/ "
+    args = __main__.parse_cli_args(parser, args=shlex.split(compact_args_str + "--compact-sample s3://bucket/output/"))
+    assert args['compact_target_size'] == 256
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--compact-src hdfs:///output"))
+    # The output of the app cannot be sampled before it ran.
+    for extra_args_str in ("", "--compact-sample hdfs:///previous"):
+        with pytest.raises(ValueError, match='compact-src requires compact-sample'):
+            __main__.parse_cli_args(parser, args=shlex.split(compact_args_str + extra_args_str))
+
+    # Without an S3 client the files are assumed to be named the way Spark names them.
+    steps = __main__.dry_run(dict(args, cluster_id='j-1'))['Steps']
+    assert steps[-1]['Name'] == 'Compaction step'
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Test the Spark event log analysis."""
+import os
+import json
+import shlex
+
+import boto3
+import pytest
+
+from moto import mock_s3
+
+from sparksteps import __main__
+from sparksteps import eventlog
+
+TEST_BUCKET = 'sparksteps-test'
+
+
+def task_end(stage_id, executor_id, launch_ms, finish_ms, spill=0, gc=0, read=0, written=0):
+    return {'Event': 'SparkListenerTaskEnd', 'Stage ID': stage_id, 'Stage Attempt ID': 0,
+            'Task Info': {'Executor ID': executor_id, 'Launch Time': launch_ms, 'Finish Time': finish_ms},
+            'Task Metrics': {'JVM GC Time': gc, 'Memory Bytes Spilled': 3 * spill, 'Disk Bytes Spilled': spill,
+                             'Shuffle Read Metrics': {'Remote Bytes Read': read, 'Local Bytes Read': read},
+                             'Shuffle Write Metrics': {'Shuffle Bytes Written': written}}}
+
+
+def stage_completed(stage_id, submitted_ms, completed_ms):
+    return {'Event': 'SparkListenerStageCompleted',
+            'Stage Info': {'Stage ID': stage_id, 'Stage Attempt ID': 0, 'Stage Name': 'stage {}'.format(stage_id),
+                           'Submission Time': submitted_ms, 'Completion Time': completed_ms}}
+
+
+def event_log():
+    events = [
+        {'Event': 'SparkListenerLogStart', 'Spark Version': '3.0.1'},
+        {'Event': 'SparkListenerApplicationStart', 'Timestamp': 0},
+        {'Event': 'SparkListenerExecutorAdded', 'Timestamp': 0, 'Executor ID': '1',
+         'Executor Info': {'Total Cores': 2}},
+        task_end(0, '1', 0, 1000, gc=100, written=50),
+        task_end(0, '1', 0, 1000, gc=100, written=50),
+        task_end(0, '1', 1000, 5000, spill=10, gc=300, written=50),
+        stage_completed(0, 0, 5000),
+        task_end(1, '1', 5000, 6000, read=75),
+        stage_completed(1, 5000, 6000),
+        {'Event': 'SparkListenerApplicationEnd', 'Timestamp': 10000},
+    ]
+    return [json.dumps(e, separators=(',', ':')).encode('utf-8') for e in events]
+
+
+def test_analyze():
+    report = eventlog.analyze(event_log())
+    assert report.duration_s == 10
+    first, second = report.stages
+    assert (first.stage_id, first.duration_s, first.num_tasks) == (0, 5, 3)
+    assert (first.task_median_s, first.task_max_s, first.skew) == (1, 4, 4)
+    assert (first.spill_bytes, first.gc_s, first.shuffle_write_bytes) == (10, 0.5, 150)
+    assert second.shuffle_read_bytes == 150
+    # 2 cores for 10 seconds, busy for 7 seconds.
+    assert (report.executor_core_s, report.executor_idle_s) == (20, 13)
+    assert 'idle for 13s of 20s (65%)' in eventlog.format_report(report)
+
+
+def test_analyze_bounded_memory():
+    analyzer = eventlog.EventLogAnalyzer()
+    for i in range(10000):
+        analyzer.feed(task_end(0, '1', 0, 1000 if i % 2 else 3000))
+    assert len(analyzer.running[(0, 0)].task_durations.values) == eventlog.RESERVOIR_SIZE
+    analyzer.feed(stage_completed(0, 0, 3000))
+    assert not analyzer.running
+    assert analyzer.report().stages[0].num_tasks == 10000
+
+
+def test_analyze_s3(monkeypatch):
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    with mock_s3():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=TEST_BUCKET)
+        lines = event_log()
+        client.put_object(Bucket=TEST_BUCKET, Key='logs/run/application_1_0001', Body=b'\n'.join(lines) + b'\n')
+        # Rolled over logs are read in order.
+        rolled = 'logs/run/eventlog_v2_application_1_0002/'
+        for i, chunk in enumerate((lines[:5], lines[5:8], lines[8:]), 1):
+            client.put_object(Bucket=TEST_BUCKET, Key='{}events_{}_application_1_0002'.format(rolled, i),
+                              Body=b'\n'.join(chunk))
+        client.put_object(Bucket=TEST_BUCKET, Key=rolled + 'appstatus_application_1_0002', Body=b'')
+
+        monkeypatch.setattr(eventlog, 'READ_CHUNK_BYTES', 64)
+        reports = __main__.report_event_logs(client, 's3://{}/logs/run/'.format(TEST_BUCKET))
+        assert list(reports) == ['application_1_0001', 'eventlog_v2_application_1_0002']
+        assert reports['application_1_0001'] == reports['eventlog_v2_application_1_0002'] == eventlog.analyze(lines)
+
+
+def test_parser_with_event_log():
+    parser = __main__.create_parser()
+    cmd_args_str = "episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 --event-log "
+    assert __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--wait"))['event_log']
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str))
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--wait --step-concurrency-level 2"))
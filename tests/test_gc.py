@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Test collecting unused staged files and logs."""
+import os
+import json
+import time
+
+import boto3
+import pytest
+
+from moto import mock_s3
+from unittest.mock import MagicMock
+
+from sparksteps import gc
+
+TEST_BUCKET = 'sparksteps-test'
+KEYS = ['sparksteps/loose.txt', 'sparksteps/sources/episodes.py', 'sparksteps/sources/old.py',
+        'sparksteps/logs/j-ACTIVE/steps/s-1/stderr.gz', 'sparksteps/logs/j-OLD/steps/s-1/stderr.gz',
+        'sparksteps/eventlogs/run-1/application_1_0001', 'sparksteps/eventlogs/run-2/application_1_0002',
+        'sparksteps/bootstrap-cache/emr-6.2.0/abc-x86_64.tar.gz', 'other/keep.txt']
+# Every object is older than the retention period.
+LATER = time.time() + 30 * 24 * 60 * 60
+
+
+def emr_client():
+    emr = MagicMock()
+    pages = {
+        'list_clusters': [{'Clusters': [{'Id': 'j-ACTIVE'}]}],
+        'list_steps': [{'Steps': [{'Config': {'Args': ['aws', 's3', 'cp',
+                                                       's3://{}/sparksteps/sources/episodes.py'.format(TEST_BUCKET),
+                                                       '/home/hadoop/']}}]}],
+        'list_bootstrap_actions': [{'BootstrapActions': [{
+            'ScriptPath': 's3://{}/sparksteps/bootstrap-cache/wrapper.sh'.format(TEST_BUCKET),
+            'Args': ['s3://scripts/bootstrap.sh', 's3://{}/sparksteps/bootstrap-cache/emr-6.2.0/abc'.format(
+                TEST_BUCKET)]}]}],
+    }
+    emr.get_paginator.side_effect = lambda name: MagicMock(**{'paginate.return_value': pages[name]})
+    return emr
+
+
+@pytest.fixture
+def s3_client():
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    with mock_s3():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=TEST_BUCKET)
+        for key in KEYS:
+            client.put_object(Bucket=TEST_BUCKET, Key=key, Body=b'x')
+        yield client
+
+
+def write_journal(path, records, mtime=None):
+    with open(path, 'w') as f:
+        f.writelines(json.dumps(r) + '\n' for r in records)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def remaining_keys(s3_client):
+    return sorted(o['Key'] for o in s3_client.list_objects_v2(Bucket=TEST_BUCKET)['Contents'])
+
+
+def test_collect(s3_client, tmpdir):
+    write_journal(str(tmpdir.join('recent.jsonl')), [
+        {'event': 'event_log', 'uri': 's3://{}/sparksteps/eventlogs/run-1/'.format(TEST_BUCKET)}], LATER)
+    # Journals older than the retention period do not keep objects.
+    write_journal(str(tmpdir.join('old.jsonl')), [
+        {'event': 'upload', 'bucket': TEST_BUCKET, 'key': 'sparksteps/sources/old.py', 'digest': 'abc'}], 0)
+    expected = ['sparksteps/eventlogs/run-2/application_1_0002', 'sparksteps/loose.txt',
+                'sparksteps/logs/j-OLD/steps/s-1/stderr.gz', 'sparksteps/sources/old.py']
+
+    report = gc.collect(s3_client, emr_client(), TEST_BUCKET, 'sparksteps', keep_latest=0,
+                        journal_dir=str(tmpdir), dry_run=True, now=LATER)
+    assert sorted(report.deleted) == sorted(expected)
+    assert report.deleted_bytes == 4
+    assert len(remaining_keys(s3_client)) == len(KEYS)
+
+    report = gc.collect(s3_client, emr_client(), TEST_BUCKET, 'sparksteps/', keep_latest=0,
+                        journal_dir=str(tmpdir), now=LATER)
+    assert report.errors == []
+    assert remaining_keys(s3_client) == sorted(set(KEYS) - set(expected))
+
+
+def test_collect_keeps_recent_and_latest(s3_client, tmpdir):
+    report = gc.collect(s3_client, None, TEST_BUCKET, 'sparksteps/', journal_dir=str(tmpdir), dry_run=True)
+    assert report.deleted == []
+
+    report = gc.collect(s3_client, None, TEST_BUCKET, 'sparksteps/', keep_latest=3, journal_dir=str(tmpdir),
+                        dry_run=True, now=LATER)
+    assert len(report.kept) == 3
+    assert len(report.deleted) == len(KEYS) - 4
+
+    with pytest.raises(ValueError):
+        gc.collect(s3_client, None, TEST_BUCKET, '/', journal_dir=str(tmpdir))
+
+
+def test_delete_objects_in_batches():
+    client = MagicMock()
+    client.delete_objects.side_effect = [{}, {'Errors': [{'Key': 'c', 'Message': 'Access Denied'}]}]
+    assert gc.delete_objects(client, TEST_BUCKET, ['a', 'b', 'c'], batch_size=2) == ['c']
+    assert [c[1]['Delete']['Objects'] for c in client.delete_objects.call_args_list] == [
+        [{'Key': 'a'}, {'Key': 'b'}], [{'Key': 'c'}]]
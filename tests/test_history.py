@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Test the run history and ETA-aware polling."""
+import os
+import shlex
+import datetime
+
+import pytest
+
+from unittest.mock import MagicMock, patch
+
+from sparksteps import __main__
+from sparksteps import history as run_history
+from sparksteps.history import History, hourly_price
+from sparksteps.poll import StepTiming, wait_for_step_complete
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+EPISODES_APP = os.path.join(DIR_PATH, 'data', 'episodes.py')
+
+
+def timings(duration_s, start=1000.0, state='COMPLETED'):
+    return [StepTiming('Copy episodes.py', 'COMPLETED', start, start + 10),
+            StepTiming('Run episodes.py', state, start + 10, start + duration_s)]
+
+
+def test_record_and_estimate(tmpdir):
+    history = History(str(tmpdir.join('history', 'runs.sqlite')))
+    assert history.estimate_runtime(EPISODES_APP, 'Run episodes.py') is None
+    for duration_s in (100, 300, 200):
+        history.record_run(EPISODES_APP, timings(duration_s), 'COMPLETED', 'j-1', hourly_price=3.6)
+    history.record_run(EPISODES_APP, timings(5000, state='FAILED'), 'FAILED', 'j-1')
+    # Runtimes are those of the step, without the staging steps before it.
+    assert history.estimate_runtime(os.path.relpath(EPISODES_APP), 'Run episodes.py') == 190
+    assert history.runtimes(EPISODES_APP, 'Run episodes.py', limit=2) == [190, 290]
+    assert history.estimate_runtime(EPISODES_APP, 'Copy episodes.py') == 10
+    # Apps sharing a file name are told apart.
+    assert history.estimate_runtime('s3://my-bucket/apps/episodes.py', 'Run episodes.py') is None
+
+    rows = history.step_percentiles()
+    assert [row[:3] for row in rows] == [(EPISODES_APP, 'Copy episodes.py', 4),
+                                         (EPISODES_APP, 'Run episodes.py', 3)]
+    assert rows[1][3:] == (190, pytest.approx(280))
+    history.close()
+
+    # Costs are recorded with the run.
+    cost = History(str(tmpdir.join('history', 'runs.sqlite')))._conn.execute(
+        'SELECT cost FROM runs WHERE outcome = ? ORDER BY id LIMIT 1', ('COMPLETED',)).fetchone()[0]
+    assert cost == pytest.approx(0.1)
+
+
+def test_hourly_price():
+    groups = [{'role': 'MASTER', 'instance_type': 'm5.xlarge', 'count': 1, 'market': 'ON_DEMAND', 'bid_price': None},
+              {'role': 'TASK', 'instance_type': 'm5.xlarge', 'count': 4, 'market': 'SPOT', 'bid_price': 0.1}]
+    assert hourly_price(groups, lambda instance_type: 0.192) == pytest.approx(0.592)
+
+
+def test_wait_sleeps_until_expected_finish():
+    # The step waits for the cluster for 300 seconds, its state and timeline are described on every poll.
+    states = iter(['PENDING', 'PENDING', 'PENDING', 'PENDING', 'RUNNING', 'RUNNING', 'RUNNING', 'RUNNING',
+                   'COMPLETED'])
+    clock = [0.0]
+
+    def describe_step(**kw):
+        state = next(states)
+        timeline = {'StartDateTime': datetime.datetime.fromtimestamp(300.0)} if state != 'PENDING' else {}
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'Step': {'Status': {'State': state,
+                                                                                 'Timeline': timeline}}}
+
+    emr = MagicMock()
+    emr.describe_step.side_effect = describe_step
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    with patch('sparksteps.poll.time.sleep', side_effect=sleep) as mock_sleep, \
+            patch('sparksteps.poll.time.time', side_effect=lambda: clock[0]):
+        wait_for_step_complete(emr, 'j-1', 's-1', sleep_interval_s=150, expected_s=1000)
+    assert [c[0][0] for c in mock_sleep.call_args_list] == [150, 150, 900.0, 15, 15]
+
+
+def test_run_app_records_history(tmpdir):
+    history = History(str(tmpdir.join('history.sqlite')))
+    history.record_run(EPISODES_APP, timings(600), 'COMPLETED')
+    emr = MagicMock()
+    emr.add_job_flow_steps.return_value = {'StepIds': ['s-1']}
+    emr.get_paginator.return_value.paginate.return_value = [{'InstanceGroups': [
+        {'InstanceGroupType': 'CORE', 'InstanceType': 'm5.xlarge', 'RequestedInstanceCount': 2, 'Market': 'SPOT',
+         'BidPrice': '0.5'}]}]
+    args = {'app': EPISODES_APP, 'wait': 30}
+
+    with patch('sparksteps.__main__.wait_for_step_complete') as mock_wait, \
+            patch('sparksteps.__main__.get_step_timings', return_value=timings(500)):
+        __main__.run_app(emr, ['j-1'], [{'Name': 'Run episodes.py'}], args, session=MagicMock(), history=history)
+    mock_wait.assert_called_once_with(emr, 'j-1', 's-1', sleep_interval_s=30, expected_s=590)
+    assert history.runtimes(EPISODES_APP, 'Run episodes.py') == [490, 590]
+
+    with patch('sparksteps.__main__.wait_for_step_complete', side_effect=Exception('EMR job failed')), \
+            patch('sparksteps.__main__.get_step_timings', return_value=timings(50, state='FAILED')):
+        with pytest.raises(Exception, match='EMR job failed'):
+            __main__.run_app(emr, ['j-1'], [{'Name': 'Run episodes.py'}], args, history=history)
+    assert history._conn.execute('SELECT outcome, hourly_price FROM runs ORDER BY id DESC').fetchall()[:2] == [
+        ('FAILED', None), ('COMPLETED', 1.0)]
+
+
+def test_main_reports_percentiles(tmpdir, capsys):
+    path = str(tmpdir.join('history.sqlite'))
+    history = History(path)
+    history.record_run(EPISODES_APP, timings(100), 'COMPLETED')
+    history.close()
+    run_history.main([EPISODES_APP, '--history', path])
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].split() == ['app', 'step', 'runs', 'p50', 's', 'p95', 's']
+    assert out[2].split() == [EPISODES_APP, 'Run', 'episodes.py', '1', '90.0', '90.0']
+
+
+def test_parser_with_history():
+    parser = __main__.create_parser()
+    cmd_args_str = "episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 "
+    # Runs are only recorded when asked to.
+    assert __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str))['history'] is None
+    args = __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--history /tmp/history.sqlite"))
+    assert args['history'] == '/tmp/history.sqlite'
+    with pytest.raises(ValueError, match='history cannot be combined with max-recoveries'):
+        __main__.parse_cli_args(parser, args=shlex.split(
+            cmd_args_str + "--history /tmp/history.sqlite --wait --max-recoveries 2"))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Test resuming runs from a journal."""
+import os
+
+import boto3
+import moto
+from moto.emr.models import emr_backends
+
+from unittest.mock import MagicMock, patch
+
+from sparksteps import __main__
+from sparksteps.journal import Journal, default_journal_path
+from sparksteps.steps import setup_steps
+
+TEST_BUCKET = 'sparksteps-test'
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(DIR_PATH, 'data')
+LIB_DIR = os.path.join(DATA_DIR, 'dir')
+EPISODES_APP = os.path.join(DATA_DIR, 'episodes.py')
+
+
+def test_journal_resume(tmpdir):
+    path = str(tmpdir.join('journals', 'run.jsonl'))
+    journal = Journal.open(path)
+    journal.record('clusters', cluster_ids=['j-1'])
+    journal.record_steps('j-1', ['s-1', 's-2'])
+    journal.record_steps('j-2', ['s-3'])
+    journal.record_steps('j-1', ['s-4'])
+    with open(path, 'a') as f:
+        f.write('{"event": "steps", "cluster_id"')
+
+    resumed = Journal.open(path, resume=True)
+    assert resumed.cluster_ids == ['j-1']
+    assert resumed.step_ids('j-1') == ['s-1', 's-2', 's-4']
+
+    # Without resuming the journal starts over.
+    assert Journal.open(path).records == []
+    assert Journal.open(path, resume=True).records == []
+
+
+def test_finished_journal_starts_over(tmpdir):
+    path = str(tmpdir.join('run.jsonl'))
+    journal = Journal.open(path)
+    journal.record('clusters', cluster_ids=['j-1'])
+    journal.record('finished')
+    assert Journal.open(path, resume=True).cluster_ids == []
+
+
+def test_active_cluster_ids(tmpdir):
+    journal = Journal(str(tmpdir.join('run.jsonl')), [{'event': 'clusters', 'cluster_ids': ['j-1', 'j-2']}])
+    emr = MagicMock()
+    emr.describe_cluster.return_value = {'Cluster': {'Status': {'State': 'WAITING'}}}
+    assert journal.active_cluster_ids(emr) == ['j-1', 'j-2']
+    emr.describe_cluster.side_effect = [{'Cluster': {'Status': {'State': 'RUNNING'}}},
+                                        {'Cluster': {'Status': {'State': 'TERMINATED'}}}]
+    assert journal.active_cluster_ids(emr) == []
+
+
+def test_default_journal_path():
+    args = {'app': 'episodes.py', 'app_args': ['--input', 'a'], 'resume': False, 'log_level': 'INFO'}
+    path = default_journal_path(args)
+    assert path.endswith('.jsonl')
+    assert default_journal_path(dict(args, resume=True, log_level='DEBUG')) == path
+    assert default_journal_path(dict(args, app_args=['--input', 'b'])) != path
+
+
+@moto.mock_s3
+def test_uploads_are_not_repeated(tmpdir):
+    s3 = boto3.resource('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket=TEST_BUCKET)
+    path = str(tmpdir.join('run.jsonl'))
+    steps = setup_steps(s3, TEST_BUCKET, 'sparksteps', EPISODES_APP, uploads=[LIB_DIR], journal=Journal.open(path))
+
+    journal = Journal.open(path, resume=True)
+    keys = sorted(r['key'] for r in journal.events('upload'))
+    assert keys == ['sparksteps/sources/dir.zip', 'sparksteps/sources/episodes.py']
+    with patch('sparksteps.steps.zip_to_s3') as mock_zip, patch.object(s3.meta.client, 'upload_file') as mock_upload:
+        assert setup_steps(s3, TEST_BUCKET, 'sparksteps', EPISODES_APP, uploads=[LIB_DIR], journal=journal) == steps
+    mock_zip.assert_not_called()
+    mock_upload.assert_not_called()
+
+
+def test_run_app_resumes_submission(tmpdir):
+    journal = Journal.open(str(tmpdir.join('run.jsonl')))
+    journal.record_steps('j-1', ['s-1', 's-2'])
+    emr = MagicMock()
+    emr.add_job_flow_steps.return_value = {'StepIds': ['s-3']}
+    emr.describe_step.return_value = {'Step': {'Name': 'Run episodes.py', 'Status': {'State': 'COMPLETED'}}}
+    emr_steps = [{'Name': 'Copy lib.zip'}, {'Name': 'Unzip lib.zip'}, {'Name': 'Run episodes.py'}]
+
+    with patch('sparksteps.__main__.wait_for_step_complete') as mock_wait:
+        __main__.run_app(emr, ['j-1'], emr_steps, {'wait': 30}, journal)
+    emr.add_job_flow_steps.assert_called_once_with(JobFlowId='j-1', Steps=[{'Name': 'Run episodes.py'}])
+    mock_wait.assert_called_once_with(emr, 'j-1', 's-3', sleep_interval_s=30)
+    assert journal.step_ids('j-1') == ['s-1', 's-2', 's-3']
+
+    # Once every step has been submitted only the wait remains.
+    emr.reset_mock()
+    with patch('sparksteps.__main__.wait_for_step_complete') as mock_wait:
+        __main__.run_app(emr, ['j-1'], emr_steps, {'wait': 30}, journal)
+    emr.add_job_flow_steps.assert_not_called()
+    mock_wait.assert_called_once_with(emr, 'j-1', 's-3', sleep_interval_s=30)
+
+
+def test_main_resume(tmpdir):
+    argv = ['sparksteps', EPISODES_APP, '--s3-bucket', TEST_BUCKET, '--aws-region', 'us-east-1',
+            '--release-label', 'emr-6.2.0', '--uploads', LIB_DIR, '--keep-alive',
+            '--journal', str(tmpdir.join('run.jsonl')),
+            '--history', str(tmpdir.join('history.sqlite'))]
+    credentials = {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing'}
+    with moto.mock_emr(), moto.mock_s3(), patch.dict(os.environ, credentials):
+        boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket=TEST_BUCKET)
+
+        # The first attempt dies before submitting any steps.
+        with patch('sys.argv', argv), patch('sparksteps.submit.add_steps', side_effect=RuntimeError('killed')):
+            try:
+                __main__.main()
+            except RuntimeError:
+                pass
+        clusters = emr_backends['us-east-1'].clusters
+        assert len(clusters) == 1
+
+        with patch('sys.argv', argv + ['--resume']), patch('sparksteps.steps.zip_to_s3') as mock_zip:
+            __main__.main()
+        mock_zip.assert_not_called()
+        assert len(clusters) == 1
+        steps = list(clusters.values())[0].steps
+        assert [s.name for s in steps] == ['Copy dir.zip', 'Unzip dir.zip', 'Copy episodes.py', 'Run episodes.py']
+
+
+def test_main_without_journal(tmpdir):
+    argv = ['sparksteps', EPISODES_APP, '--s3-bucket', TEST_BUCKET, '--aws-region', 'us-east-1',
+            '--release-label', 'emr-6.2.0', '--keep-alive']
+    credentials = {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing'}
+    with moto.mock_emr(), moto.mock_s3(), patch.dict(os.environ, credentials):
+        boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket=TEST_BUCKET)
+        # Runs are only journaled, and uploads digested, when asked to.
+        with patch('sys.argv', argv), patch('sparksteps.__main__.Journal.open') as mock_open, \
+                patch('sparksteps.steps.path_digest') as mock_digest:
+            __main__.main()
+        mock_open.assert_not_called()
+        mock_digest.assert_not_called()
+        steps = list(emr_backends['us-east-1'].clusters.values())[0].steps
+        assert [s.name for s in steps] == ['Copy episodes.py', 'Run episodes.py']
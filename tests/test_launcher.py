@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Test overlapping cluster provisioning with staging."""
+import threading
+
+import pytest
+
+from unittest.mock import MagicMock
+
+from sparksteps.launcher import launch_and_stage, launch_clusters
+
+
+def test_launch_clusters():
+    emr = MagicMock()
+    emr.run_job_flow.side_effect = [{'JobFlowId': 'j-1'}, {'JobFlowId': 'j-2'}]
+    assert launch_clusters(emr, {'Name': 'test'}, num_clusters=2) == ['j-1', 'j-2']
+    emr.run_job_flow.assert_called_with(Name='test')
+
+
+def test_launch_and_stage_overlap():
+    launching = threading.Event()
+    staging = threading.Event()
+
+    def launch():
+        launching.set()
+        # Only completes when staging runs at the same time.
+        assert staging.wait(timeout=5)
+        return ['j-1']
+
+    def stage():
+        staging.set()
+        assert launching.wait(timeout=5)
+        return ['step']
+
+    assert launch_and_stage(MagicMock(), launch, stage) == (['j-1'], ['step'])
+
+
+def test_launch_and_stage_terminates_on_staging_failure():
+    emr = MagicMock()
+
+    def stage():
+        raise FileNotFoundError('missing.jar does not exist')
+
+    with pytest.raises(FileNotFoundError):
+        launch_and_stage(emr, lambda: ['j-1', 'j-2'], stage)
+    emr.terminate_job_flows.assert_called_once_with(JobFlowIds=['j-1', 'j-2'])
+
+
+def test_launch_and_stage_launch_failure():
+    emr = MagicMock()
+
+    def launch():
+        raise ValueError('Core nodes specified without instance type.')
+
+    with pytest.raises(ValueError):
+        launch_and_stage(emr, launch, lambda: ['step'])
+    emr.terminate_job_flows.assert_not_called()
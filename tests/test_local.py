@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Test the local backend."""
+import os
+import sys
+import json
+import shlex
+
+import pytest
+
+from unittest.mock import patch
+
+from sparksteps import __main__
+from sparksteps.local import LocalRunner, LocalS3
+from sparksteps.steps import setup_steps
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+EPISODES_APP = os.path.join(DIR_PATH, 'data', 'episodes.py')
+EPISODES_AVRO = os.path.join(DIR_PATH, 'data', 'episodes.avro')
+LIB_DIR = os.path.join(DIR_PATH, 'data', 'dir')
+
+# Records its arguments and exits with $FAKE_SPARK_EXIT after sleeping $FAKE_SPARK_SLEEP seconds.
+FAKE_SPARK_SUBMIT = """#!{python}
+import os, sys, json, time
+time.sleep(float(os.environ.get('FAKE_SPARK_SLEEP', 0)))
+app = [arg for arg in sys.argv if arg.endswith('.py')][0]
+with open(os.path.join(os.environ['FAKE_SPARK_OUT'], os.path.basename(app) + '.json'), 'w') as f:
+    json.dump(sys.argv[1:], f)
+sys.exit(int(os.environ.get('FAKE_SPARK_EXIT', 0)))
+"""
+
+
+@pytest.fixture(scope='function')
+def spark_home(tmpdir):
+    spark_submit = tmpdir.mkdir('spark').mkdir('bin').join('spark-submit')
+    spark_submit.write(FAKE_SPARK_SUBMIT.format(python=sys.executable))
+    spark_submit.chmod(0o755)
+    out = tmpdir.mkdir('out')
+    with patch.dict(os.environ, {'FAKE_SPARK_OUT': str(out)}):
+        yield str(tmpdir.join('spark'))
+
+
+def parse_args(cmd_args_str):
+    return __main__.parse_cli_args(__main__.create_parser(), args=shlex.split(cmd_args_str))
+
+
+def test_run_local(spark_home, tmpdir):
+    local_dir = str(tmpdir.join('local'))
+    args = parse_args("""{app} --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 \
+      --backend local --local-dir {local_dir} --spark-home {spark_home} \
+      --uploads {lib} {avro} \
+      --submit-args="--deploy-mode cluster --jars /home/hadoop/dir/test.jar" \
+      --app-args="--input /home/hadoop/episodes.avro" \
+      --s3-dist-cp="--src hdfs:///output --dest s3://my-bucket/output"
+    """.format(app=EPISODES_APP, local_dir=local_dir, spark_home=spark_home, lib=LIB_DIR, avro=EPISODES_AVRO))
+    timings = __main__.run_local(args)
+
+    assert [(t.name, t.state) for t in timings] == [
+        ('Copy dir.zip', 'COMPLETED'), ('Unzip dir.zip', 'COMPLETED'), ('Copy episodes.avro', 'COMPLETED'),
+        ('Copy episodes.py', 'COMPLETED'), ('Run episodes.py', 'COMPLETED'), ('S3DistCp step', 'SKIPPED')]
+    home = os.path.join(local_dir, 'home')
+    assert os.path.exists(os.path.join(home, 'dir', 'test.jar'))
+    assert os.path.exists(os.path.join(home, 'episodes.avro'))
+    with open(os.path.join(str(tmpdir.join('out')), 'episodes.py.json')) as f:
+        assert json.load(f) == ['--jars', os.path.join(home, 'dir', 'test.jar'), os.path.join(home, 'episodes.py'),
+                                '--input', os.path.join(home, 'episodes.avro')]
+
+
+def test_local_runner_failure(spark_home, tmpdir):
+    s3 = LocalS3(str(tmpdir.join('s3')))
+    emr_steps = setup_steps(s3, 'my-bucket', 'sparksteps', EPISODES_APP, s3_dist_cp=['--src', 'hdfs:///output'])
+    runner = LocalRunner(str(tmpdir.join('local')), s3, spark_home=spark_home)
+    with patch.dict(os.environ, {'FAKE_SPARK_EXIT': '1'}):
+        timings = runner.run(emr_steps)
+    # Steps after the failed one are cancelled, as on EMR.
+    assert [t.state for t in timings] == ['COMPLETED', 'FAILED', 'CANCELLED']
+    assert os.path.exists(str(tmpdir.join('local', 'logs', 'Run episodes.py.log')))
+
+    # Objects which were not staged locally cannot be copied without an S3 client.
+    emr_steps = setup_steps(s3, 'my-bucket', 'sparksteps', 's3://other-bucket/app.py')
+    assert [t.state for t in runner.run(emr_steps)] == ['FAILED', 'CANCELLED']
+
+
+def test_run_local_concurrent_apps(spark_home, tmpdir):
+    other_app = tmpdir.join('other.py')
+    other_app.write('')
+    args = parse_args("""{app} --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 \
+      --backend local --local-dir {local_dir} --spark-home {spark_home} \
+      --app-spec {other} --step-concurrency-level 2
+    """.format(app=EPISODES_APP, local_dir=tmpdir.join('local'), spark_home=spark_home, other=other_app))
+    with patch.dict(os.environ, {'FAKE_SPARK_SLEEP': '0.5'}):
+        timings = __main__.run_local(args)
+    first, second = [t for t in timings if t.name.startswith('Run')]
+    # Independent apps run at the same time.
+    assert second.start < first.end and first.start < second.end
+
+    with patch.dict(os.environ, {'FAKE_SPARK_EXIT': '1'}), pytest.raises(Exception, match='Local job failed'):
+        __main__.run_local(args)
+
+
+def test_parser_with_local_backend():
+    with pytest.raises(ValueError):
+        parse_args("--pipeline p.json --s3-bucket b --aws-region us-east-1 --release-label emr-6.2.0 --backend local")
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Test CLI entry point."""
+import os
+import sys
+import json
+import subprocess
+
+from sparksteps import __main__
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+APP = os.path.join(DIR_PATH, '..', 'examples', 'episodes.py')
+LIB = os.path.join(DIR_PATH, '..', 'examples', 'lib')
+
+
+def run_module(code):
+    return subprocess.check_output([sys.executable, '-c', code], cwd=os.path.join(DIR_PATH, '..'))
+
+
+def test_import_does_not_load_boto3():
+    output = run_module("import sys, sparksteps.__main__; print('boto3' in sys.modules)")
+    assert output.strip() == b'False'
+
+
+def test_dry_run_does_not_load_boto3():
+    output = run_module(
+        "import sys; from sparksteps import __main__;"
+        "sys.argv = ['sparksteps', 'examples/episodes.py', '--s3-bucket', 'my-bucket', '--aws-region', 'us-east-1',"
+        "            '--release-label', 'emr-6.2.0', '--dry-run'];"
+        "__main__.main(); print('boto3' in sys.modules)")
+    assert output.splitlines()[-1] == b'False'
+
+
+def test_dry_run():
+    parser = __main__.create_parser()
+    args = __main__.parse_cli_args(parser, args=[
+        APP, '--s3-bucket', 'my-bucket', '--s3-path', 'sparksteps', '--aws-region', 'us-east-1',
+        '--release-label', 'emr-6.2.0', '--uploads', LIB, '--num-core', '2', '--instance-type-core', 'm5.xlarge',
+        '--app-args=--input /home/hadoop/episodes.avro', '--dry-run'])
+    result = __main__.dry_run(args)
+    assert result['Cluster']['ReleaseLabel'] == 'emr-6.2.0'
+    assert result['Cluster']['Instances']['InstanceGroups'][1]['InstanceCount'] == 2
+    assert [step['Name'] for step in result['Steps']] == [
+        'Copy lib.zip', 'Unzip lib.zip', 'Copy episodes.py', 'Run episodes.py']
+    assert result['Steps'][-1]['HadoopJarStep']['Args'][-2:] == ['--input', '/home/hadoop/episodes.avro']
+    json.dumps(result)
+
+
+def test_dry_run_existing_cluster():
+    parser = __main__.create_parser()
+    args = __main__.parse_cli_args(parser, args=[
+        APP, '--s3-bucket', 'my-bucket', '--aws-region', 'us-east-1', '--release-label', 'emr-6.2.0',
+        '--cluster-id', 'j-123', '--dry-run'])
+    result = __main__.dry_run(args)
+    assert result['Cluster'] is None
+    assert [step['Name'] for step in result['Steps']] == ['Copy episodes.py', 'Run episodes.py']
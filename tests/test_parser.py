@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 """Test Parser."""
 import shlex
+import argparse
+
+import pytest
+
 from sparksteps import __main__
 
 
@@ -19,6 +23,7 @@ def test_parser():
       --tags Name=MyName CostCenter=MyCostCenter \
       --defaults spark-defaults key=value another_key=another_value \
       --maximize-resource-allocation \
+      --auto-tune \
       --debug \
       --wait
     """
@@ -37,6 +42,7 @@ def test_parser():
     assert args['uploads'] == ['examples/dir', 'examples/episodes.avro']
     assert args['tags'] == ['Name=MyName', 'CostCenter=MyCostCenter']
     assert args['maximize_resource_allocation'] is True
+    assert args['auto_tune'] is True
     assert args['num_core'] == 1
     assert args['wait'] == 150
 
@@ -69,3 +75,91 @@ def test_parser_with_bootstrap():
     assert args['uploads'] == ['examples/dir', 'examples/episodes.avro']
     assert args['tags'] == ['Name=MyName', 'CostCenter=MyCostCenter']
     assert args['bootstrap_script'] == 's3://bucket/bootstrap-actions.sh'
+
+
+def test_parser_with_managed_scaling():
+    parser = __main__.create_parser()
+    cmd_args_str = """episodes.py \
+      --s3-bucket my-bucket \
+      --aws-region us-east-1 \
+      --release-label emr-6.4.0 \
+      --num-core 2 \
+      --managed-scaling-min 2 \
+      --managed-scaling-max 10 \
+      --managed-scaling-max-on-demand 4 \
+      --keep-alive \
+      --idle-timeout 3600
+    """
+    args = __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str))
+    assert args['managed_scaling_min'] == 2
+    assert args['managed_scaling_max'] == 10
+    assert args['managed_scaling_max_on_demand'] == 4
+    assert args['managed_scaling_max_core'] is None
+    assert args['managed_scaling_unit_type'] == 'Instances'
+    assert args['idle_timeout'] == 3600
+
+
+def test_parser_with_app_specs():
+    parser = __main__.create_parser()
+    cmd_args_str = """episodes.py \
+      --s3-bucket my-bucket \
+      --aws-region us-east-1 \
+      --release-label emr-6.2.0 \
+      --app-spec "wordcount.py --submit-args='--deploy-mode cluster' --app-args='--input a.txt'" \
+      --app-spec other.py \
+      --step-concurrency-level 3
+    """
+    args = __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str))
+    assert args['app_spec'] == [
+        ('wordcount.py', ['--deploy-mode', 'cluster'], ['--input', 'a.txt']),
+        ('other.py', None, None),
+    ]
+    assert args['step_concurrency_level'] == 3
+
+    # Sweeps are not supported per app spec, rather than silently ignored.
+    with pytest.raises(argparse.ArgumentTypeError, match='invalid app spec'):
+        __main__.parse_app_spec("wordcount.py --sweep-args='--date 2020-01-01'")
+
+
+def test_parser_with_pipeline():
+    parser = __main__.create_parser()
+    cmd_args_str = """--pipeline pipeline.json \
+      --s3-bucket my-bucket \
+      --aws-region us-east-1 \
+      --release-label emr-6.2.0 \
+      --num-clusters 2
+    """
+    args = __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str))
+    assert args['app'] is None
+    assert args['pipeline'] == 'pipeline.json'
+    assert args['num_clusters'] == 2
+
+
+def test_parser_requires_app_or_pipeline():
+    parser = __main__.create_parser()
+    with pytest.raises(SystemExit):
+        __main__.parse_cli_args(parser, args=shlex.split(
+            "--s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0"))
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(
+            "episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 --num-clusters 2"))
+
+
+def test_parser_with_sweep(tmpdir):
+    sweep_file = tmpdir.join('dates.txt')
+    sweep_file.write("# one variant per line\n--date 2020-01-03\n\n--date '2020-01-04'\n")
+    parser = __main__.create_parser()
+    cmd_args_str = """episodes.py \
+      --s3-bucket my-bucket \
+      --aws-region us-east-1 \
+      --release-label emr-6.2.0 \
+      --app-args="--input s3://bucket/episodes" \
+      --sweep-args="--date 2020-01-01" \
+      --sweep-args="--date 2020-01-02" \
+      --sweep-file {} \
+      --num-clusters 2
+    """.format(sweep_file)
+    args = __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str))
+    assert args['sweep_args'] == [['--date', '2020-01-01'], ['--date', '2020-01-02'],
+                                  ['--date', '2020-01-03'], ['--date', '2020-01-04']]
+    assert args['num_clusters'] == 2
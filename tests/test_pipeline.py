@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Test pipeline scheduling."""
+import os
+import json
+
+import boto3
+import pytest
+from unittest.mock import MagicMock, patch
+from moto import mock_emr
+from moto.emr.models import emr_backends
+
+from sparksteps.cluster import emr_config
+from sparksteps.journal import Journal
+from sparksteps.pipeline import PipelineScheduler, load_pipeline, parse_pipeline, sweep_jobs
+from sparksteps.steps import App
+
+AWS_REGION_NAME = 'us-east-1'
+
+
+@pytest.fixture(scope='function')
+def emr_client():
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    with mock_emr():
+        yield boto3.client('emr', region_name=AWS_REGION_NAME)
+
+
+def launch_cluster(emr_client):
+    config = emr_config('emr-6.2.0', instance_type_master='m4.large', keep_alive=True)
+    return emr_client.run_job_flow(**config)['JobFlowId']
+
+
+def set_job_state(scheduler, job_name, new_state):
+    cluster_id, step_id = scheduler.placement[job_name]
+    for step in emr_backends[AWS_REGION_NAME].clusters[cluster_id].steps:
+        if step.id == step_id:
+            step.state = new_state
+
+
+PIPELINE = {
+    'uploads': ['lib'],
+    'jobs': {
+        'a': {'app': 'a.py', 'app_args': '--date 2020-01-01'},
+        'b': {'app': 'b.py', 'submit_args': ['--deploy-mode', 'cluster']},
+        'c': {'app': 'c.py', 'depends_on': ['a']},
+        'd': {'app': 'a.py', 'depends_on': ['c', 'a']},
+        'e': {'app': 'e.py', 'depends_on': ['b']},
+        'f': {'app': 'f.py', 'depends_on': ['e']},
+    }
+}
+
+
+def test_load_pipeline(tmpdir):
+    path = tmpdir.join('pipeline.json')
+    path.write(json.dumps(PIPELINE))
+    pipeline = load_pipeline(str(path))
+    assert pipeline.uploads == ['lib']
+    assert [job.name for job in pipeline.jobs] == ['a', 'b', 'c', 'd', 'e', 'f']
+    assert pipeline.jobs[0].app == ('a.py', None, ['--date', '2020-01-01'])
+    assert pipeline.jobs[1].app == ('b.py', ['--deploy-mode', 'cluster'], None)
+
+
+@pytest.mark.parametrize('jobs', [
+    {},
+    {'a': {'app': 'a.py', 'depends_on': ['missing']}},
+    {'a': {'app': 'a.py', 'depends_on': ['b']}, 'b': {'app': 'b.py', 'depends_on': ['a']}},
+    {'a': {'submit_args': '--deploy-mode cluster'}},
+])
+def test_parse_invalid_pipeline(jobs):
+    with pytest.raises(ValueError):
+        parse_pipeline({'jobs': jobs})
+
+
+def test_pipeline_scheduler(emr_client):
+    cluster_id = launch_cluster(emr_client)
+    jobs = parse_pipeline(PIPELINE).jobs
+    scheduler = PipelineScheduler(emr_client, [cluster_id], jobs, step_concurrency_level=2)
+
+    scheduler.start([])
+    assert sorted(scheduler.placement) == ['a', 'b']
+    steps = emr_client.list_steps(ClusterId=cluster_id)['Steps']
+    assert sorted(s['Name'] for s in steps) == ['Run a', 'Run b']
+    assert {s['ActionOnFailure'] for s in steps} == {'CONTINUE'}
+
+    # A failure only cancels the downstream jobs of the failed job.
+    set_job_state(scheduler, 'a', 'COMPLETED')
+    set_job_state(scheduler, 'b', 'FAILED')
+    assert scheduler.step() is False
+    assert scheduler.states == {'a': 'COMPLETED', 'b': 'FAILED', 'c': 'PENDING',
+                                'd': 'PENDING', 'e': 'CANCELLED', 'f': 'CANCELLED'}
+    assert sorted(scheduler.placement) == ['a', 'b', 'c']
+
+    set_job_state(scheduler, 'c', 'COMPLETED')
+    assert scheduler.step() is False
+    assert 'd' in scheduler.placement
+
+    set_job_state(scheduler, 'd', 'COMPLETED')
+    assert scheduler.step() is True
+    assert scheduler.states['d'] == 'COMPLETED'
+
+
+def test_pipeline_scheduler_multiple_clusters(emr_client):
+    cluster_ids = [launch_cluster(emr_client), launch_cluster(emr_client)]
+    jobs = parse_pipeline({'jobs': {name: {'app': '{}.py'.format(name)} for name in 'abcde'}}).jobs
+    scheduler = PipelineScheduler(emr_client, cluster_ids, jobs, step_concurrency_level=2)
+
+    scheduler.start([])
+    # Jobs are spread over both clusters until each runs at its concurrency level.
+    assert sorted(scheduler.placement) == ['a', 'b', 'c', 'd']
+    assert [len(scheduler.running(cluster_id)) for cluster_id in cluster_ids] == [2, 2]
+
+    set_job_state(scheduler, 'b', 'COMPLETED')
+    scheduler.step()
+    assert scheduler.placement['e'][0] == scheduler.placement['b'][0]
+
+
+def test_sweep(emr_client):
+    cluster_ids = [launch_cluster(emr_client), launch_cluster(emr_client)]
+    app = App('jobs/backfill.py', ['--deploy-mode', 'cluster'], ['--input', 's3://bucket/input'])
+    jobs = sweep_jobs(app, [['--date', '2020-01-0{}'.format(day)] for day in range(1, 4)])
+    assert [job.name for job in jobs] == ['backfill.py [1]', 'backfill.py [2]', 'backfill.py [3]']
+    assert jobs[2].app == App('jobs/backfill.py', ['--deploy-mode', 'cluster'],
+                              ['--input', 's3://bucket/input', '--date', '2020-01-03'])
+
+    scheduler = PipelineScheduler(emr_client, cluster_ids, jobs, step_concurrency_level=1)
+    scheduler.start([])
+    # At most one variant runs per cluster.
+    assert sorted(scheduler.placement) == ['backfill.py [1]', 'backfill.py [2]']
+
+    set_job_state(scheduler, 'backfill.py [1]', 'COMPLETED')
+    set_job_state(scheduler, 'backfill.py [2]', 'FAILED')
+    scheduler.step()
+    set_job_state(scheduler, 'backfill.py [3]', 'COMPLETED')
+    assert scheduler.step() is True
+
+    summary = scheduler.summary()
+    assert [(job.name, state) for job, state, _, _ in summary] == [
+        ('backfill.py [1]', 'COMPLETED'), ('backfill.py [2]', 'FAILED'), ('backfill.py [3]', 'COMPLETED')]
+    assert summary[2][2] == scheduler.placement['backfill.py [1]'][0]
+
+
+@patch('sparksteps.submit.wait_for_step_complete')
+def test_pipeline_scheduler_resume(mock_wait, emr_client, tmpdir):
+    cluster_id = launch_cluster(emr_client)
+    jobs = parse_pipeline(PIPELINE).jobs
+    staging_steps = [{'Name': 'Copy a.py', 'HadoopJarStep': {'Jar': 'command-runner.jar', 'Args': ['true']},
+                      'ActionOnFailure': 'CANCEL_AND_WAIT'}]
+    journal = Journal.open(str(tmpdir.join('run.jsonl')))
+    scheduler = PipelineScheduler(emr_client, [cluster_id], jobs, step_concurrency_level=2, journal=journal)
+    scheduler.start(staging_steps)
+    set_job_state(scheduler, 'a', 'COMPLETED')
+    scheduler.step()
+    assert sorted(scheduler.placement) == ['a', 'b', 'c']
+
+    # A new scheduler neither stages nor submits the recorded jobs again.
+    journal = Journal.open(journal.path, resume=True)
+    resumed = PipelineScheduler(emr_client, [cluster_id], jobs, step_concurrency_level=2, journal=journal)
+    assert resumed.placement == scheduler.placement
+    resumed.start(staging_steps)
+    resumed.update()
+    assert resumed.states['a'] == 'COMPLETED'
+    assert len(emr_client.list_steps(ClusterId=cluster_id)['Steps']) == 4
+
+    # Jobs placed on clusters which are no longer used are submitted again.
+    other = PipelineScheduler(emr_client, [launch_cluster(emr_client)], jobs, journal=journal)
+    assert other.placement == {}
+
+
+@patch('sparksteps.submit.wait_for_step_complete')
+def test_pipeline_scheduler_resume_submits_new_jobs(mock_wait, emr_client, tmpdir):
+    cluster_id = launch_cluster(emr_client)
+    jobs = parse_pipeline(PIPELINE).jobs
+    staging_steps = [{'Name': 'Copy a.py', 'HadoopJarStep': {'Jar': 'command-runner.jar', 'Args': ['true']},
+                      'ActionOnFailure': 'CANCEL_AND_WAIT'}]
+    journal = Journal.open(str(tmpdir.join('run.jsonl')))
+    PipelineScheduler(emr_client, [cluster_id], jobs, journal=journal).start(staging_steps)
+
+    # Job b is only submitted by the resumed attempt, at the position of job a in the recorded steps.
+    journal = Journal.open(journal.path, resume=True)
+    resumed = PipelineScheduler(emr_client, [cluster_id], jobs, step_concurrency_level=2, journal=journal)
+    resumed.start(staging_steps)
+    steps = {s['Id']: s['Name'] for s in emr_client.list_steps(ClusterId=cluster_id)['Steps']}
+    assert sorted(steps.values()) == ['Copy a.py', 'Run a', 'Run b']
+    assert steps[resumed.placement['a'][1]] == 'Run a'
+    assert steps[resumed.placement['b'][1]] == 'Run b'
+
+
+def test_pipeline_scheduler_cache(emr_client):
+    cluster_id = launch_cluster(emr_client)
+    jobs = parse_pipeline({'jobs': {
+        'a': {'app': 'a.py', 'outputs': ['s3://bucket/a/']},
+        'b': {'app': 'b.py'},
+        'c': {'app': 'c.py', 'depends_on': ['a'], 'inputs': ['s3://bucket/a/'], 'outputs': ['s3://bucket/c/']},
+    }}).jobs
+    assert jobs[2].inputs == ('s3://bucket/a/',)
+    cache = MagicMock()
+    cache.key.side_effect = lambda app, inputs: 'key-' + app.path
+    cache.lookup.side_effect = lambda key: {'outputs': ['s3://bucket/a/']} if key == 'key-a.py' else None
+    scheduler = PipelineScheduler(emr_client, [cluster_id], jobs, step_concurrency_level=2, cache=cache)
+
+    # The cached job is not submitted and the job depending on it is ready right away.
+    scheduler.start([])
+    assert sorted(scheduler.placement) == ['b', 'c']
+    assert scheduler.states['a'] == 'COMPLETED'
+    # Jobs without outputs are never looked up.
+    assert [c[0][0].path for c in cache.key.call_args_list] == ['a.py', 'c.py']
+
+    set_job_state(scheduler, 'b', 'COMPLETED')
+    set_job_state(scheduler, 'c', 'COMPLETED')
+    assert scheduler.step() is True
+    cache.store.assert_called_once_with('key-c.py', jobs[2].app, ('s3://bucket/c/',))
+    assert [(job.name, state) for job, state, _, _ in scheduler.summary()] == [
+        ('a', 'CACHED'), ('b', 'COMPLETED'), ('c', 'COMPLETED')]
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Test Poll logic."""
 import os
+import datetime
 import pytest
 import boto3
 
@@ -10,7 +11,10 @@ from moto import mock_emr, mock_s3
 from moto.emr.models import emr_backends
 
 from sparksteps.cluster import emr_config
-from sparksteps.poll import failure_message_from_response, is_step_complete, wait_for_step_complete
+from sparksteps.poll import (
+    Poller, StepTiming, are_steps_complete, failure_message_from_response, get_step_states, get_step_timings,
+    is_step_complete, wait_for_step_complete
+)
 
 
 @pytest.fixture(scope='function')
@@ -123,6 +127,45 @@ def test_is_step_complete(emr_client, s3_client):
             assert 'EMR job failed' == str(e), 'Exception message not as expected'
 
 
+def test_are_steps_complete(emr_client, s3_client):
+    """
+    Ensure are_steps_complete only returns the step states once all steps are in a terminal state
+    """
+    cluster_config = emr_config('emr-5.2.0', instance_type_master='m4.large', keep_alive=True)
+    cluster_id = emr_client.run_job_flow(**cluster_config)['JobFlowId']
+    test_step = {
+        'Name': 'test-step',
+        'ActionOnFailure': 'CONTINUE',
+        'HadoopJarStep': {
+            'Jar': 'command-runner.jar',
+            'Args': ['state-pusher-script']
+        }
+    }
+    step_ids = emr_client.add_job_flow_steps(JobFlowId=cluster_id, Steps=[test_step] * 2)['StepIds']
+
+    set_step_state(step_ids[0], cluster_id, 'COMPLETED')
+    set_step_state(step_ids[1], cluster_id, 'RUNNING')
+    assert are_steps_complete(emr_client, cluster_id, step_ids) is None
+
+    set_step_state(step_ids[1], cluster_id, 'FAILED')
+    assert are_steps_complete(emr_client, cluster_id, step_ids) == {
+        step_ids[0]: 'COMPLETED',
+        step_ids[1]: 'FAILED',
+    }
+
+
+def test_get_step_states_lists_at_most_ten_steps():
+    def paginate(ClusterId, StepIds):
+        assert len(StepIds) <= 10
+        return [{'Steps': [{'Id': step_id, 'Status': {'State': 'RUNNING'}} for step_id in StepIds]}]
+
+    emr_client = MagicMock()
+    emr_client.get_paginator.return_value.paginate.side_effect = paginate
+    step_ids = ['s-{}'.format(i) for i in range(25)]
+    assert get_step_states(emr_client, 'j-1', step_ids) == {step_id: 'RUNNING' for step_id in step_ids}
+    assert emr_client.get_paginator.return_value.paginate.call_count == 3
+
+
 def test_wait_for_step_complete():
     """
     Ensure polling.poll is called with expected arguments
@@ -134,3 +177,42 @@ def test_wait_for_step_complete():
         wait_for_step_complete(mock_emr, jobflow_id, step_id, 1)
         mock_poll.assert_called_once_with(
             is_step_complete, args=(mock_emr, jobflow_id, step_id), step=1, poll_forever=True)
+
+
+def test_get_step_timings():
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    responses = {
+        's-1': {'Step': {'Name': 'Run app.py', 'Status': {'State': 'COMPLETED', 'Timeline': {
+            'StartDateTime': start, 'EndDateTime': start + datetime.timedelta(seconds=90)}}}},
+        's-2': {'Step': {'Name': 'S3DistCp step', 'Status': {'State': 'CANCELLED', 'Timeline': {}}}},
+    }
+    emr_client = MagicMock()
+    emr_client.describe_step.side_effect = lambda ClusterId, StepId: responses[StepId]
+    assert get_step_timings(emr_client, 'j-1', ['s-1', 's-2']) == [
+        StepTiming('Run app.py', 'COMPLETED', start.timestamp(), start.timestamp() + 90),
+        StepTiming('S3DistCp step', 'CANCELLED', None, None)]
+
+
+class CountingPoller(Poller):
+    def __init__(self, results):
+        Poller.__init__(self, 'j-1', 0)
+        self.results = list(results)
+        self.steps = 0
+
+    def step(self):
+        self.steps += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def finished(self):
+        return not self.results
+
+
+def test_poller_retries_failed_steps():
+    poller = CountingPoller([Exception('ThrottlingException'), None, 'done'])
+    poller.start()
+    poller._thread.join(5)
+    poller.stop()
+    assert poller.steps == 3
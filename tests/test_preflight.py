@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Test pre-flight checks."""
+import os
+import shlex
+
+import boto3
+import pytest
+
+from unittest.mock import patch
+
+from moto import mock_emr, mock_s3
+
+from sparksteps import __main__
+from sparksteps import preflight
+
+TEST_BUCKET = 'sparksteps-test'
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+EPISODES_APP = os.path.join(DIR_PATH, 'data', 'episodes.py')
+
+
+@pytest.fixture(scope='function')
+def s3_client():
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    with mock_s3():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=TEST_BUCKET)
+        yield client
+
+
+def parse_args(extra_args_str):
+    cmd_args_str = "{} --s3-bucket {} --aws-region us-east-1 --release-label emr-6.2.0 ".format(
+        EPISODES_APP, TEST_BUCKET)
+    return __main__.parse_cli_args(__main__.create_parser(), args=shlex.split(cmd_args_str + extra_args_str))
+
+
+def test_run_checks(s3_client):
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='episodes/date=2020-01-01/part-0', Body=b'a')
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='bootstrap.sh', Body=b'')
+    args = parse_args("--bootstrap-script s3://{0}/bootstrap.sh --uploads s3://{0}/lib/ "
+                      "--inputs s3://{0}/episodes/date=2020-*/ --outputs s3://{0}/output/ "
+                      "--app-args='--input s3://{0}/episodes/ --layout s3://{0}/layout/ --output s3://{0}/output/'"
+                      .format(TEST_BUCKET))
+    results = preflight.run_checks(s3_client, args, max_workers=4)
+    assert [(r.description, r.error is None) for r in results] == [
+        ('staging path is writable', True), ('bootstrap script exists', True), ('upload exists', False),
+        ('input exists', True), ('--input exists', True), ('--layout exists', False),
+        ('output is writable', True)]
+    # Checking write access leaves no objects behind.
+    assert not any('preflight' in o['Key'] for o in s3_client.list_objects_v2(Bucket=TEST_BUCKET)['Contents'])
+
+
+def test_run_checks_only_writes_below_s3_path_and_declared_outputs(s3_client):
+    args = parse_args("--app-args='--timeout 60 --output s3://{0}/output/'".format(TEST_BUCKET))
+    with patch.object(s3_client, 'put_object') as mock_put:
+        results = preflight.run_checks(s3_client, args)
+    assert [c[1]['Key'].startswith('sparksteps/_sparksteps_preflight_') for c in mock_put.call_args_list] == [True]
+    # An undeclared output is read from, and fails the run before it wrote anything.
+    assert [(r.description, r.error) for r in results] == [
+        ('staging path is writable', None), ('--output exists', 'no objects found')]
+
+    args = parse_args("--outputs s3://{0}/output/ --app-args='--output s3://{0}/output/date=2020-01-01/'"
+                      .format(TEST_BUCKET))
+    assert [r.description for r in preflight.run_checks(s3_client, args)] == [
+        'staging path is writable', 'output is writable']
+
+
+def test_validate_reports_every_failure(s3_client):
+    args = parse_args("--bootstrap-script s3://{0}/bootstrap.sh --inputs s3://{0}/episodes/ "
+                      "--app-args='--output=s3://missing-bucket/output/'".format(TEST_BUCKET))
+    with pytest.raises(ValueError) as excinfo:
+        preflight.validate(s3_client, args)
+    report = str(excinfo.value)
+    assert report.startswith('3 of 4 pre-flight checks failed')
+    assert 'bootstrap script exists: s3://{}/bootstrap.sh'.format(TEST_BUCKET) in report
+    assert 'input exists: s3://{}/episodes/ (no objects found)'.format(TEST_BUCKET) in report
+    assert '--output exists: s3://missing-bucket/output/' in report
+
+
+def test_main_fails_before_launching(tmpdir):
+    argv = ['sparksteps', EPISODES_APP, '--s3-bucket', TEST_BUCKET, '--aws-region', 'us-east-1',
+            '--release-label', 'emr-6.2.0', '--inputs', 's3://{}/missing/'.format(TEST_BUCKET),
+            '--journal', str(tmpdir.join('run.jsonl')),
+            '--history', str(tmpdir.join('history.sqlite'))]
+    credentials = {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing'}
+    with mock_emr(), mock_s3(), patch.dict(os.environ, credentials):
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=TEST_BUCKET)
+        with patch('sys.argv', argv), patch('sparksteps.launcher.launch_clusters') as mock_launch:
+            with pytest.raises(ValueError, match='1 of 2 pre-flight checks failed'):
+                __main__.main()
+        mock_launch.assert_not_called()
+
+        launch = patch('sparksteps.__main__.launch_clusters', side_effect=RuntimeError('launched'))
+        with patch('sys.argv', argv + ['--skip-preflight']), launch as mock_launch:
+            with pytest.raises(RuntimeError):
+                __main__.main()
+        mock_launch.assert_called_once()
@@ -8,6 +8,9 @@ import pytest
 
 import boto3
 
+from unittest.mock import MagicMock, patch
+
+from sparksteps.pricing import determine_prices
 from sparksteps.pricing import get_bid_price, get_demand_price, determine_best_price, Zone
 
 # The price for an m4.large on-demand Linux instance in us-east-1.
@@ -66,3 +69,13 @@ class TestPricing:
         bid_price, use_spot = determine_best_price(demand_price, aws_zone)
         assert use_spot is False
         assert bid_price == demand_price
+
+    def test_determine_prices_once_per_instance_type(self):
+        args = {'dynamic_pricing_master': False, 'dynamic_pricing_core': True, 'dynamic_pricing_task': True,
+                'instance_type_master': 'm4.large', 'instance_type_core': 'r5.xlarge',
+                'instance_type_task': 'r5.xlarge'}
+        with patch('sparksteps.pricing.get_bid_price', return_value=(0.1, True)) as mock_bid_price:
+            priced = determine_prices(args, MagicMock(), MagicMock())
+        mock_bid_price.assert_called_once()
+        assert priced['bid_price_core'] == priced['bid_price_task'] == '0.1'
+        assert 'bid_price_master' not in priced
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Test recovering from lost instances."""
+import shlex
+
+import pytest
+
+from unittest.mock import MagicMock, patch
+
+from sparksteps import __main__
+from sparksteps.autoscale import TaskGroupScaler
+from sparksteps.recovery import find_lost_instances, recover_instance_groups, wait_and_recover
+from sparksteps.utilization import UtilizationSampler
+
+SPOT_LOST = {'Code': 'INSTANCE_FAILURE', 'Message': 'Spot instances were interrupted.'}
+
+
+def instance_group(role, market='SPOT', running=2, requested=2, reason=None, state='RUNNING'):
+    group = {
+        'Id': 'ig-{}'.format(role),
+        'Name': '{} Nodes'.format(role.capitalize()),
+        'Market': market,
+        'InstanceGroupType': role.upper(),
+        'InstanceType': 'm5.xlarge',
+        'RequestedInstanceCount': requested,
+        'RunningInstanceCount': running,
+        'Status': {'State': state, 'StateChangeReason': reason or {}},
+    }
+    if market == 'SPOT':
+        group['BidPrice'] = '0.10'
+    return group
+
+
+def mock_emr_client(groups, cluster_state='WAITING', cluster_reason=None):
+    client = MagicMock()
+    client.describe_cluster.return_value = {'Cluster': {
+        'Status': {'State': cluster_state, 'StateChangeReason': cluster_reason or {}},
+        'Ec2InstanceAttributes': {'Ec2AvailabilityZone': 'us-east-1a'}}}
+    client.get_paginator.return_value.paginate.return_value = [{'InstanceGroups': groups}]
+    client.describe_step.return_value = {'Step': {'Status': {'State': 'FAILED'}}}
+    return client
+
+
+def test_find_lost_instances():
+    healthy = [instance_group('master', 'ON_DEMAND', 1, 1), instance_group('core')]
+    assert find_lost_instances(mock_emr_client(healthy), 'j-1') is None
+
+    lost_task = instance_group('task', running=0, requested=4, reason=SPOT_LOST)
+    lost = find_lost_instances(mock_emr_client(healthy + [lost_task]), 'j-1')
+    assert lost.groups == [lost_task]
+    assert not lost.cluster_terminated
+    assert lost.availability_zone == 'us-east-1a'
+
+    ended = [instance_group('master', 'ON_DEMAND', 0, 1, state='ENDED'),
+             instance_group('core', running=0, state='ENDED')]
+    lost = find_lost_instances(mock_emr_client(ended, 'TERMINATED_WITH_ERRORS', SPOT_LOST), 'j-1')
+    assert lost.cluster_terminated
+    # The spot groups decide which roles are relaunched on-demand.
+    assert lost.groups == [ended[1]]
+
+
+def test_find_lost_instances_ignores_other_failures():
+    # A group short of instances is resizing, not losing them.
+    resizing = instance_group('task', running=1, requested=4, state='RESIZING')
+    assert find_lost_instances(mock_emr_client([resizing]), 'j-1') is None
+
+    # Ended groups of a live cluster are not resized.
+    ended = instance_group('task', running=0, reason=SPOT_LOST, state='ENDED')
+    terminating = instance_group('core', running=0, reason=SPOT_LOST, state='TERMINATING')
+    assert find_lost_instances(mock_emr_client([ended, terminating]), 'j-1') is None
+
+    # Only specific messages blame lost instances.
+    capacity = instance_group('task', reason={'Code': 'VALIDATION_ERROR', 'Message': 'Insufficient capacity.'})
+    assert find_lost_instances(mock_emr_client([capacity]), 'j-1') is None
+
+    # Clusters terminated by a user, the budget guard, a failing app or without steps are not recovered.
+    groups = [instance_group('core', running=0, state='ENDED', reason={'Code': 'CLUSTER_TERMINATED'})]
+    for code in ('USER_REQUEST', 'STEP_FAILURE', 'ALL_STEPS_COMPLETED', 'BOOTSTRAP_FAILURE'):
+        client = mock_emr_client(groups, 'TERMINATED', {'Code': code, 'Message': 'Terminated.'})
+        assert find_lost_instances(client, 'j-1') is None
+    lost_core = [instance_group('core', running=0, reason=SPOT_LOST)]
+    client = mock_emr_client(lost_core, 'TERMINATING', {'Code': 'USER_REQUEST', 'Message': 'Terminated by user.'})
+    assert find_lost_instances(client, 'j-1') is None
+
+
+def test_recover_instance_groups():
+    core = instance_group('core', reason=SPOT_LOST)
+    task = instance_group('task', running=0, requested=4)
+    client = mock_emr_client([core, task])
+
+    # The bid is still viable: both groups are resized.
+    recover_instance_groups(client, 'j-1', [core, task], lambda t, az: (0.08, True))
+    client.modify_instance_groups.assert_any_call(
+        ClusterId='j-1', InstanceGroups=[{'InstanceGroupId': 'ig-task', 'InstanceCount': 4}])
+    client.add_instance_groups.assert_not_called()
+
+    # Spot pricing is no longer recommended: the task group is replaced by an on-demand one.
+    client.reset_mock()
+    recover_instance_groups(client, 'j-1', [core, task], lambda t, az: (0.2, False))
+    client.modify_instance_groups.assert_any_call(
+        ClusterId='j-1', InstanceGroups=[{'InstanceGroupId': 'ig-core', 'InstanceCount': 2}])
+    client.modify_instance_groups.assert_any_call(
+        ClusterId='j-1', InstanceGroups=[{'InstanceGroupId': 'ig-task', 'InstanceCount': 0}])
+    client.add_instance_groups.assert_called_once_with(JobFlowId='j-1', InstanceGroups=[{
+        'Name': 'Task Nodes', 'Market': 'ON_DEMAND', 'InstanceRole': 'TASK',
+        'InstanceType': 'm5.xlarge', 'InstanceCount': 4}])
+
+
+def test_recover_core_group_on_demand():
+    core = instance_group('core', running=1, requested=3, reason=SPOT_LOST)
+    client = mock_emr_client([core])
+
+    # The core group cannot change its bid, the lost instances are replaced by on-demand task instances.
+    recover_instance_groups(client, 'j-1', [core], lambda t, az: (0.2, False))
+    client.modify_instance_groups.assert_called_once_with(
+        ClusterId='j-1', InstanceGroups=[{'InstanceGroupId': 'ig-core', 'InstanceCount': 1}])
+    client.add_instance_groups.assert_called_once_with(JobFlowId='j-1', InstanceGroups=[{
+        'Name': 'Core Nodes replacement', 'Market': 'ON_DEMAND', 'InstanceRole': 'TASK',
+        'InstanceType': 'm5.xlarge', 'InstanceCount': 2}])
+
+    # Spot is still recommended at a higher bid: the replacement bids that.
+    client.reset_mock()
+    recover_instance_groups(client, 'j-1', [core], lambda t, az: (0.15, True))
+    config = client.add_instance_groups.call_args[1]['InstanceGroups'][0]
+    assert (config['Market'], config['BidPrice'], config['InstanceCount']) == ('SPOT', '0.15', 2)
+
+
+@patch('sparksteps.recovery.wait_for_steps_complete')
+def test_wait_and_recover_resubmits_failed_steps(wait):
+    emr_steps = [{'Name': 'Copy lib.zip'}, {'Name': 'Run app.py'}, {'Name': 'S3DistCp'}]
+    client = mock_emr_client([instance_group('task', running=0, requested=4, reason=SPOT_LOST)])
+    client.add_job_flow_steps.return_value = {'StepIds': ['s-4', 's-5']}
+    wait.side_effect = [{'s-1': 'COMPLETED', 's-2': 'FAILED', 's-3': 'CANCELLED'},
+                        {'s-4': 'COMPLETED', 's-5': 'COMPLETED'}]
+    on_submit = MagicMock()
+
+    cluster_id = wait_and_recover(client, 'j-1', emr_steps, ['s-1', 's-2', 's-3'], 1, 1,
+                                  lambda t, az: (0.08, True), num_staging_steps=1, on_submit=on_submit)
+    assert cluster_id == 'j-1'
+    client.add_job_flow_steps.assert_called_once_with(JobFlowId='j-1', Steps=emr_steps[1:])
+    on_submit.assert_called_once_with('j-1', ['s-4', 's-5'])
+    assert wait.call_args[0][2] == ['s-4', 's-5']
+
+
+@patch('sparksteps.recovery.wait_for_steps_complete')
+def test_wait_and_recover_relaunches_cluster(wait):
+    emr_steps = [{'Name': 'Copy lib.zip'}, {'Name': 'Run app.py'}]
+    client = mock_emr_client([instance_group('core', reason=SPOT_LOST)], 'TERMINATED_WITH_ERRORS', SPOT_LOST)
+    client.add_job_flow_steps.return_value = {'StepIds': ['s-3', 's-4']}
+    wait.side_effect = [{'s-1': 'COMPLETED', 's-2': 'FAILED'}, {'s-3': 'COMPLETED', 's-4': 'COMPLETED'}]
+    relaunch = MagicMock(return_value='j-2')
+
+    on_relaunch = MagicMock()
+    cluster_id = wait_and_recover(client, 'j-1', emr_steps, ['s-1', 's-2'], 1, 1, lambda t, az: (0.2, False),
+                                  relaunch=relaunch, num_staging_steps=1, on_relaunch=on_relaunch)
+    assert cluster_id == 'j-2'
+    relaunch.assert_called_once_with(['core'])
+    on_relaunch.assert_called_once_with('j-1', 'j-2')
+    # Files are staged on the new cluster again.
+    client.add_job_flow_steps.assert_called_once_with(JobFlowId='j-2', Steps=emr_steps)
+
+
+@patch('sparksteps.recovery.wait_for_steps_complete')
+def test_wait_and_recover_gives_up(wait):
+    emr_steps = [{'Name': 'Run app.py'}]
+    wait.return_value = {'s-1': 'FAILED'}
+    client = mock_emr_client([instance_group('core')])
+    with pytest.raises(Exception, match='EMR job failed'):
+        wait_and_recover(client, 'j-1', emr_steps, ['s-1'], 1, 3, lambda t, az: (0.08, True))
+    client.add_job_flow_steps.assert_not_called()
+
+    client = mock_emr_client([instance_group('core', reason=SPOT_LOST)])
+    client.add_job_flow_steps.return_value = {'StepIds': ['s-1']}
+    with pytest.raises(Exception, match='after recovering from lost instances 2 times'):
+        wait_and_recover(client, 'j-1', emr_steps, ['s-1'], 1, 2, lambda t, az: (0.08, True))
+    assert client.add_job_flow_steps.call_count == 2
+
+
+@patch('sparksteps.recovery.wait_for_steps_complete')
+def test_wait_and_recover_does_not_relaunch_terminated_by_user(wait):
+    wait.return_value = {'s-1': 'FAILED'}
+    for code in ('USER_REQUEST', 'STEP_FAILURE'):
+        client = mock_emr_client([instance_group('core', running=0, state='ENDED')], 'TERMINATED',
+                                 {'Code': code, 'Message': 'Terminated.'})
+        relaunch = MagicMock()
+        with pytest.raises(Exception, match='EMR job failed'):
+            wait_and_recover(client, 'j-1', [{'Name': 'Run app.py'}], ['s-1'], 1, 3, lambda t, az: (0.08, True),
+                             relaunch=relaunch)
+        relaunch.assert_not_called()
+        client.add_job_flow_steps.assert_not_called()
+
+
+def test_retarget_pollers():
+    clock = [0]
+    scaler = TaskGroupScaler(MagicMock(), 'j-1', MagicMock(), 0, 4, clock=lambda: clock[0])
+    sampler = UtilizationSampler('j-3', MagicMock())
+    clock[0] = 600
+    __main__.retarget_pollers([scaler, sampler], 'j-1', 'j-2')
+    assert (scaler.cluster_id, sampler.cluster_id) == ('j-2', 'j-3')
+    # The cooldown restarts while the relaunched cluster warms up.
+    assert scaler.last_resized_at == 600
+
+
+def test_parser_with_max_recoveries():
+    parser = __main__.create_parser()
+    cmd_args_str = "episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 "
+    args = __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--wait --max-recoveries 2"))
+    assert args['max_recoveries'] == 2
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--max-recoveries 2"))
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(
+            cmd_args_str + "--wait --max-recoveries 2 --app-spec other.py"))
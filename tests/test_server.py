@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Test submission server."""
+import os
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import boto3
+import pytest
+
+from unittest.mock import MagicMock, patch
+
+from moto import mock_emr, mock_s3
+
+from sparksteps.cluster import emr_config
+from sparksteps.server import SubmissionQueue, SubmissionServer, percentile
+from sparksteps.session import Session
+
+TEST_BUCKET = 'sparksteps-test'
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+EPISODES_APP = os.path.join(DIR_PATH, 'data', 'episodes.py')
+
+
+@pytest.fixture(scope='function')
+def session():
+    """
+    Session with mocked AWS Credentials for moto to prevent impact to real infrastructure
+    """
+    with mock_emr(), mock_s3():
+        boto_session = boto3.session.Session(aws_access_key_id='testing', aws_secret_access_key='testing',
+                                             region_name='us-east-1')
+        yield Session(boto_session=boto_session)
+
+
+@pytest.fixture(scope='function')
+def server(session):
+    session.s3.create_bucket(Bucket=TEST_BUCKET)
+    queue = SubmissionQueue(session.emr, batch_window_s=0)
+    server = SubmissionServer(('127.0.0.1', 0), session, queue, s3_bucket=TEST_BUCKET,
+                              staging_dir=os.path.join(DIR_PATH, 'data'))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, path, body=None):
+    url = 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read().decode('utf-8'))
+
+
+def launch_cluster(session):
+    config = emr_config('emr-5.2.0', instance_type_master='m4.large', keep_alive=True)
+    return session.emr.run_job_flow(**config)['JobFlowId']
+
+
+def test_percentile():
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert percentile([5], 99) == 5
+
+
+def test_submit_jobs_in_batches(server, session):
+    cluster_a, cluster_b = launch_cluster(session), launch_cluster(session)
+    jobs = [
+        {'cluster_id': cluster_a, 'app': 'episodes.py', 'app_args': '--input s3://bucket/episodes.avro',
+         's3_bucket': 'other-bucket'},
+        {'cluster_id': cluster_b, 'app': 's3://bucket/apps/wordcount.py'},
+        {'cluster_id': cluster_a, 'app': 's3://bucket/apps/wordcount.py', 'submit_args': ['--deploy-mode', 'cluster']},
+    ]
+    job_ids = []
+    for job in jobs:
+        status, body = request(server, '/jobs', job)
+        assert status == 202
+        assert body['state'] == 'QUEUED'
+        job_ids.append(body['id'])
+    assert request(server, '/metrics')[1]['queue_depth'] == 3
+
+    with patch.object(session.emr, 'add_job_flow_steps', wraps=session.emr.add_job_flow_steps) as mock_add:
+        server.queue.flush()
+    # One request per cluster.
+    assert [c[1]['JobFlowId'] for c in mock_add.call_args_list] == [cluster_a, cluster_b]
+
+    status, body = request(server, '/jobs/' + job_ids[0])
+    assert status == 200
+    assert body['state'] == 'SUBMITTED'
+    assert len(body['step_ids']) == 2
+    steps = session.emr.list_steps(ClusterId=cluster_a)['Steps']
+    assert sorted(s['Name'] for s in steps) == ['Copy episodes.py', 'Copy wordcount.py',
+                                                'Run episodes.py', 'Run wordcount.py']
+    # Only the app of a job continues on failure, a failing copy cancels the steps after it.
+    assert {(s['Name'], s['ActionOnFailure']) for s in steps} == {
+        ('Copy episodes.py', 'CANCEL_AND_WAIT'), ('Run episodes.py', 'CONTINUE'),
+        ('Copy wordcount.py', 'CANCEL_AND_WAIT'), ('Run wordcount.py', 'CONTINUE')}
+    assert [o.key for o in session.s3.Bucket(TEST_BUCKET).objects.all()] == [
+        'sparksteps/jobs/{}/sources/episodes.py'.format(job_ids[0])]
+
+    metrics = request(server, '/metrics')[1]
+    assert metrics['queue_depth'] == 0
+    assert metrics['batches'] == 2
+    assert metrics['jobs_submitted'] == 3
+    assert metrics['steps_submitted'] == 6
+    assert metrics['queue_latency_s']['max'] >= 0
+
+
+def test_invalid_requests(server):
+    assert request(server, '/jobs', {'app': 'job.py'})[0] == 400
+    assert request(server, '/jobs', {'cluster_id': 'j-1', 'app': 'missing.py'})[0] == 400
+    assert request(server, '/jobs/unknown')[0] == 404
+    assert request(server, '/unknown', {})[0] == 404
+    server.s3_bucket = None
+    status, body = request(server, '/jobs', {'cluster_id': 'j-1', 'app': EPISODES_APP})
+    assert status == 400
+    assert body['error'] == 's3_bucket is required to stage local files.'
+
+
+def test_local_paths_outside_staging_dir(server):
+    for app in ('../test_server.py', os.path.realpath(__file__)):
+        status, body = request(server, '/jobs', {'cluster_id': 'j-1', 'app': app})
+        assert status == 400
+        assert body['error'].endswith('is not inside the staging directory.')
+    server.staging_dir = None
+    status, body = request(server, '/jobs', {'cluster_id': 'j-1', 'app': EPISODES_APP})
+    assert status == 400
+    assert body['error'].startswith('Local paths are not accepted')
+    assert request(server, '/jobs', {'cluster_id': 'j-1', 'app': 's3://bucket/apps/wordcount.py'})[0] == 202
+
+
+def test_same_named_apps_do_not_collide(server, session, tmp_path):
+    cluster_id = launch_cluster(session)
+    server.staging_dir = str(tmp_path.resolve())
+    for name in ('a', 'b'):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'main.py').write_text('print({!r})'.format(name))
+
+    responses = {}
+
+    def submit(name):
+        responses[name] = request(server, '/jobs', {
+            'cluster_id': cluster_id, 'app': '{}/main.py'.format(name), 'app_args': '--out /home/hadoop/out'})
+
+    threads = [threading.Thread(target=submit, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {status for status, _ in responses.values()} == {202}
+    server.queue.flush()
+
+    bucket = session.s3.Bucket(TEST_BUCKET)
+    for name, (_, body) in responses.items():
+        body = request(server, '/jobs/' + body['id'])[1]
+        key = 'sparksteps/jobs/{}/sources/main.py'.format(body['id'])
+        assert bucket.Object(key).get()['Body'].read().decode('utf-8') == 'print({!r})'.format(name)
+        job_dir = '/home/hadoop/jobs/{}/'.format(body['id'])
+        copy_step, run_step = [session.emr.describe_step(ClusterId=cluster_id, StepId=step_id)['Step']
+                               for step_id in body['step_ids']]
+        assert copy_step['Config']['Args'] == ['aws', 's3', 'cp', 's3://{}/{}'.format(TEST_BUCKET, key), job_dir]
+        assert run_step['Config']['Args'] == ['spark-submit', job_dir + 'main.py', '--out', job_dir + 'out']
+
+
+def test_staging_failure(server):
+    server.s3_bucket = 'missing-bucket'
+    status, body = request(server, '/jobs', {'cluster_id': 'j-1', 'app': EPISODES_APP})
+    assert status == 502
+    assert 'NoSuchBucket' in body['error']
+
+
+def test_batches_respect_request_limit():
+    queue = SubmissionQueue(MagicMock(), max_batch_size=4)
+    for cluster_id in ('j-1', 'j-1', 'j-2', 'j-1'):
+        queue.put(cluster_id, [{'Name': 'Copy'}, {'Name': 'Run'}])
+    batches = queue.take_batches()
+    assert [(cluster_id, len(jobs)) for cluster_id, jobs in batches] == [('j-1', 2), ('j-1', 1), ('j-2', 1)]
+    with pytest.raises(ValueError):
+        queue.put('j-1', [{'Name': 'Run'}] * 5)
+
+
+def test_failed_batch():
+    emr = MagicMock()
+    emr.add_job_flow_steps.side_effect = Exception('Cluster j-1 is terminated')
+    queue = SubmissionQueue(emr)
+    job = queue.put('j-1', [{'Name': 'Run'}])
+    queue.flush()
+    assert job.state == 'FAILED'
+    assert job.error == 'Cluster j-1 is terminated'
+    assert queue.metrics()['jobs_failed'] == 1
+
+
+def test_stop_submits_pending_jobs():
+    emr = MagicMock()
+    emr.add_job_flow_steps.return_value = {'StepIds': ['s-1', 's-2']}
+    queue = SubmissionQueue(emr, batch_window_s=60)
+    queue.start()
+    jobs = [queue.put('j-1', [{'Name': 'Run a'}]), queue.put('j-1', [{'Name': 'Run b'}])]
+    queue.stop()
+    assert [job.step_ids for job in jobs] == [['s-1'], ['s-2']]
+    emr.add_job_flow_steps.assert_called_once()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Test Session."""
+import os
+import threading
+
+import boto3
+import pytest
+
+from unittest.mock import patch
+
+from moto import mock_emr, mock_s3
+
+from sparksteps.session import Session
+
+TEST_BUCKET = 'sparksteps-test'
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+EPISODES_APP = os.path.join(DIR_PATH, 'data', 'episodes.py')
+LIB_DIR = os.path.join(DIR_PATH, 'data', 'dir')
+
+
+@pytest.fixture(scope='function')
+def session():
+    """
+    Session with mocked AWS Credentials for moto to prevent impact to real infrastructure
+    """
+    with mock_emr(), mock_s3():
+        boto_session = boto3.session.Session(aws_access_key_id='testing', aws_secret_access_key='testing',
+                                             region_name='us-east-1')
+        yield Session(boto_session=boto_session)
+
+
+def test_clients_are_reused(session):
+    assert session.emr is session.emr
+    assert session.ec2 is session.client('ec2')
+    assert session.emr.meta.config.max_pool_connections == 50
+    assert session.aws_region == 'us-east-1'
+
+
+def test_s3_resource_per_thread(session):
+    resources = []
+    thread = threading.Thread(target=lambda: resources.append(session.s3))
+    thread.start()
+    thread.join()
+    assert session.s3 is session.s3
+    assert resources[0] is not session.s3
+
+
+def test_bid_price_cache(session):
+    with patch('sparksteps.pricing.get_bid_price', return_value=(0.1, True)) as mock_bid_price:
+        assert session.get_bid_price('m5.xlarge') == (0.1, True)
+        assert session.get_bid_price('m5.xlarge') == (0.1, True)
+        mock_bid_price.assert_called_once()
+        session.get_bid_price('r5.xlarge')
+        assert mock_bid_price.call_count == 2
+
+    session.bid_price_ttl_s = 0
+    with patch('sparksteps.pricing.get_bid_price', return_value=(0.2, True)):
+        assert session.get_bid_price('m5.xlarge') == (0.2, True)
+
+
+def test_launch_stage_submit_wait(session):
+    session.s3.create_bucket(Bucket=TEST_BUCKET)
+    with patch('sparksteps.pricing.get_bid_price', return_value=(0.1, True)):
+        cluster_ids = session.launch(release_label='emr-5.2.0', instance_type_master='m4.large',
+                                     num_core=2, instance_type_core='m4.2xlarge',
+                                     dynamic_pricing_core=True, keep_alive=True, num_clusters=2)
+    assert len(cluster_ids) == 2
+    instance_groups = session.emr.list_instance_groups(ClusterId=cluster_ids[0])['InstanceGroups']
+    assert [g['BidPrice'] for g in instance_groups if g['InstanceGroupType'] == 'CORE'] == ['0.1']
+
+    uploads = [LIB_DIR]
+    emr_steps = session.stage(TEST_BUCKET, 'sparksteps', EPISODES_APP, uploads=uploads)
+    assert uploads == [LIB_DIR]
+    assert [s['Name'] for s in emr_steps] == ['Copy dir.zip', 'Unzip dir.zip', 'Copy episodes.py', 'Run episodes.py']
+    keys = [o.key for o in session.s3.Bucket(TEST_BUCKET).objects.all()]
+    assert sorted(keys) == ['sparksteps/sources/dir.zip', 'sparksteps/sources/episodes.py']
+
+    step_ids = session.submit(cluster_ids[0], emr_steps)
+    assert len(step_ids) == 4
+    # Steps of moto clusters start out running, the wait returns once they are no longer pending.
+    with patch('sparksteps.session.wait_for_steps_complete', return_value={'s-1': 'COMPLETED'}) as mock_wait:
+        assert session.wait(cluster_ids[0], step_ids, sleep_interval_s=1) == {'s-1': 'COMPLETED'}
+    mock_wait.assert_called_once_with(session.emr, cluster_ids[0], step_ids, 1)
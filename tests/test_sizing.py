@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Test sizing clusters from their inputs."""
+import os
+import math
+import shlex
+
+import boto3
+import pytest
+
+from moto import mock_s3
+
+from sparksteps import __main__
+from sparksteps.sizing import MIN_PARTITION_BYTES, Sizing, measure_inputs, size_cluster, sized_submit_args, total_cores
+from sparksteps.tuning import TASKS_PER_CORE
+
+TEST_BUCKET = 'sparksteps-test'
+GiB = 1024 ** 3
+
+
+@pytest.fixture(scope='function')
+def s3_client():
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    with mock_s3():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=TEST_BUCKET)
+        yield client
+
+
+def parse_args(extra_args_str, inputs=True):
+    cmd_args_str = "episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 "
+    cmd_args_str += "--size-from-inputs " + extra_args_str
+    if inputs:
+        cmd_args_str += " --inputs s3://{}/episodes/".format(TEST_BUCKET)
+    return __main__.parse_cli_args(__main__.create_parser(), args=shlex.split(cmd_args_str))
+
+
+def test_measure_inputs(s3_client):
+    for key, size in (('episodes/_SUCCESS', 0), ('episodes/date=2020-01-01/part-0', 100),
+                      ('episodes/date=2020-01-01/part-1', 50), ('episodes/date=2020-01-02/part-0', 25),
+                      ('shows/part-0', 10), ('other/part-0', 1000)):
+        s3_client.put_object(Bucket=TEST_BUCKET, Key=key, Body=b'a' * size)
+
+    uris = ['s3://{}/episodes/'.format(TEST_BUCKET), 's3://{}/shows/'.format(TEST_BUCKET)]
+    assert measure_inputs(s3_client, uris, max_workers=2) == (185, 5)
+    assert measure_inputs(s3_client, ['s3://{}/missing/'.format(TEST_BUCKET)]) == (0, 0)
+
+
+def test_size_cluster_small_input():
+    sizing = size_cluster(300 * 1024 ** 2, instance_type_core='m5.2xlarge', num_core=4)
+    assert sizing.num_core == 1
+    # Partitions are split finer than the default so that every core has one to read.
+    cores = total_cores(instance_type_core='m5.2xlarge', num_core=1)
+    assert sizing.max_partition_bytes == int(math.ceil(300 * 1024 ** 2 / (cores * TASKS_PER_CORE)))
+    assert sizing.shuffle_partitions == cores * TASKS_PER_CORE
+
+
+def test_size_cluster_large_input():
+    assert size_cluster(10000 * GiB, instance_type_core='m5.2xlarge').num_core == 20
+    assert size_cluster(10000 * GiB, max_nodes=5, instance_type_core='m5.2xlarge').num_core == 5
+
+
+def test_size_cluster_with_task_nodes():
+    sizing = size_cluster(100 * GiB, instance_type_core='m5.xlarge', num_core=2, instance_type_task='m5.2xlarge')
+    assert sizing.num_core == 2
+    assert sizing.num_task == 13
+
+    with pytest.raises(ValueError):
+        size_cluster(100 * GiB)
+
+
+def test_sized_submit_args():
+    assert sized_submit_args(None, Sizing(2, 0, 1024, 64)) == [
+        '--conf', 'spark.sql.files.maxPartitionBytes=1024', '--conf', 'spark.sql.shuffle.partitions=64']
+
+
+def test_size_from_inputs(s3_client):
+    s3_client.put_object(Bucket=TEST_BUCKET, Key='episodes/part-0', Body=b'a')
+    args = parse_args("--instance-type-core m5.2xlarge --num-core 5 --submit-args='--deploy-mode cluster'")
+    sized = __main__.size_from_inputs(s3_client, args)
+    assert sized['num_core'] == 1
+    assert sized['submit_args'][:2] == ['--deploy-mode', 'cluster']
+    assert 'spark.sql.files.maxPartitionBytes={}'.format(MIN_PARTITION_BYTES) in sized['submit_args']
+
+    # The node counts of an existing cluster are left as they are.
+    args = parse_args("--instance-type-core m5.2xlarge --num-core 5 --cluster-id j-1")
+    assert __main__.size_from_inputs(s3_client, args)['num_core'] == 5
+
+
+def test_parser_with_size_from_inputs():
+    assert parse_args("--instance-type-core m5.xlarge")['size_max_nodes'] == 20
+    with pytest.raises(ValueError):
+        parse_args("--instance-type-core m5.xlarge", inputs=False)
+    with pytest.raises(ValueError):
+        parse_args("")
+    with pytest.raises(ValueError):
+        parse_args("--instance-type-core m5.xlarge --sweep-args='--date 2020-01-01'")
@@ -5,9 +5,10 @@ import os.path
 
 import boto3
 import moto
+import pytest
 
 from sparksteps.cluster import emr_config
-from sparksteps.steps import setup_steps, S3DistCp
+from sparksteps.steps import App, path_digest, setup_concurrent_steps, setup_steps, S3DistCp
 
 TEST_BUCKET = 'sparksteps-test'
 TEST_BUCKET_PATH = 'sparksteps/'
@@ -291,18 +292,66 @@ def test_emr_ebs_storage():
                       'ServiceRole': 'EMR_DefaultRole'}
 
 
+def test_emr_managed_scaling_and_auto_termination():
+    config = emr_config('emr-6.4.0',
+                        keep_alive=True,
+                        instance_type_master='m4.large',
+                        instance_type_core='m4.2xlarge',
+                        instance_type_task='m4.2xlarge',
+                        num_core=2,
+                        num_task=2,
+                        managed_scaling_min=2,
+                        managed_scaling_max=10,
+                        managed_scaling_max_on_demand=4,
+                        managed_scaling_max_core=3,
+                        idle_timeout=3600)
+    assert config['ManagedScalingPolicy'] == {
+        'ComputeLimits': {
+            'UnitType': 'Instances',
+            'MinimumCapacityUnits': 2,
+            'MaximumCapacityUnits': 10,
+            'MaximumOnDemandCapacityUnits': 4,
+            'MaximumCoreCapacityUnits': 3,
+        }
+    }
+    assert config['AutoTerminationPolicy'] == {'IdleTimeout': 3600}
+
+
+@pytest.mark.parametrize('kw', [
+    # Managed scaling requires core nodes.
+    dict(managed_scaling_min=1, managed_scaling_max=4),
+    # Minimum may not exceed the maximum.
+    dict(num_core=2, instance_type_core='m4.large', managed_scaling_min=5, managed_scaling_max=4),
+    # Both boundaries are required.
+    dict(num_core=2, instance_type_core='m4.large', managed_scaling_max=4),
+    # On-demand limit may not exceed the maximum.
+    dict(num_core=2, instance_type_core='m4.large', managed_scaling_min=1, managed_scaling_max=4,
+         managed_scaling_max_on_demand=5),
+    # Instance fleet units are not supported for instance groups.
+    dict(num_core=2, instance_type_core='m4.large', managed_scaling_min=1, managed_scaling_max=4,
+         managed_scaling_unit_type='InstanceFleetUnits'),
+    dict(idle_timeout=10),
+])
+def test_emr_invalid_scaling_config(kw):
+    with pytest.raises(ValueError):
+        emr_config('emr-6.4.0', instance_type_master='m4.large', **kw)
+
+
 @moto.mock_s3
 def test_setup_steps():
     s3 = boto3.resource('s3', region_name=AWS_REGION_NAME)
     s3.create_bucket(Bucket=TEST_BUCKET)
+    uploads = [LIB_DIR, EPISODES_AVRO]
     steps = (setup_steps(s3,
                          TEST_BUCKET,
                          TEST_BUCKET_PATH,
                          EPISODES_APP,
                          submit_args="--jars /home/hadoop/dir/test.jar".split(),
                          app_args="--input /home/hadoop/episodes.avro".split(),
-                         uploads=[LIB_DIR, EPISODES_AVRO])
+                         uploads=uploads)
              )
+    # The uploads are not modified, staging them again does not stage the app twice.
+    assert uploads == [LIB_DIR, EPISODES_AVRO]
     assert steps == [
         {'HadoopJarStep': {'Jar': 'command-runner.jar',
                            'Args': ['aws', 's3', 'cp',
@@ -403,6 +452,30 @@ def test_setup_steps_with_bucket_path():
          'Name': 'Run episodes.py'}]
 
 
+@moto.mock_s3
+def test_setup_concurrent_steps():
+    s3 = boto3.resource('s3', region_name=AWS_REGION_NAME)
+    s3.create_bucket(Bucket=TEST_BUCKET)
+    apps = [App(EPISODES_APP, None, ['--date', '2020-01-01']),
+            App(EPISODES_APP, ['--deploy-mode', 'cluster'], ['--date', '2020-01-02'])]
+    staging_steps, app_steps = setup_concurrent_steps(s3, TEST_BUCKET, TEST_BUCKET_PATH, apps,
+                                                      uploads=[LIB_DIR])
+    assert [step['Name'] for step in staging_steps] == ['Copy dir.zip', 'Unzip dir.zip', 'Copy episodes.py']
+    assert [step['HadoopJarStep']['Args'] for step in app_steps] == [
+        ['spark-submit', '/home/hadoop/episodes.py', '--date', '2020-01-01'],
+        ['spark-submit', '--deploy-mode', 'cluster', '/home/hadoop/episodes.py', '--date', '2020-01-02'],
+    ]
+
+
+@moto.mock_s3
+def test_setup_concurrent_steps_conflicting_apps():
+    s3 = boto3.resource('s3', region_name=AWS_REGION_NAME)
+    s3.create_bucket(Bucket=TEST_BUCKET)
+    apps = [App(EPISODES_APP, None, None), App('s3://other-bucket/episodes.py', None, None)]
+    with pytest.raises(ValueError):
+        setup_concurrent_steps(s3, TEST_BUCKET, TEST_BUCKET_PATH, apps)
+
+
 def test_s3_dist_cp_step():
     splitted = shlex.split(
         "--s3Endpoint=s3.amazonaws.com --src=s3://mybucket/logs/j-3GYXXXXXX9IOJ/node/ --dest=hdfs:///output --srcPattern=.*[a-zA-Z,]+")  # NOQA: E501
@@ -417,3 +490,12 @@ def test_s3_dist_cp_step():
             'Jar': 'command-runner.jar'},
         'Name': 'S3DistCp step'
     }
+
+
+def test_path_digest(tmpdir):
+    directory = tmpdir.mkdir('lib')
+    directory.join('a.py').write('a = 1')
+    digest = path_digest(str(directory))
+    assert path_digest(str(directory)) == digest
+    directory.join('a.py').write('a = 2')
+    assert path_digest(str(directory)) != digest
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Test step submission."""
+import pytest
+
+from unittest.mock import MagicMock, patch
+
+from sparksteps.submit import add_steps, has_capacity, submit_after_staging
+
+STAGING_STEPS = [{'Name': 'Copy a.zip'}, {'Name': 'Unzip a.zip'}]
+APP_STEPS = [{'Name': 'Run a'}, {'Name': 'Run b'}]
+
+
+def test_submit_after_staging():
+    emr = MagicMock()
+    emr.describe_cluster.return_value = {'Cluster': {'StepConcurrencyLevel': 4}}
+    emr.add_job_flow_steps.return_value = {'StepIds': ['s-COPY', 's-UNZIP', 's-APP1', 's-APP2']}
+    with patch('sparksteps.submit.wait_for_step_complete') as mock_wait:
+        step_ids = submit_after_staging(emr, 'j-CLUSTER', STAGING_STEPS, APP_STEPS, step_concurrency_level=4)
+
+    assert step_ids == ['s-APP1', 's-APP2']
+    emr.add_job_flow_steps.assert_called_once_with(JobFlowId='j-CLUSTER', Steps=STAGING_STEPS + APP_STEPS)
+    mock_wait.assert_called_once_with(emr, 'j-CLUSTER', 's-UNZIP', 15)
+    # Staging is serialized before the concurrency level is raised again.
+    assert [c[1]['StepConcurrencyLevel'] for c in emr.modify_cluster.call_args_list] == [1, 4]
+
+
+def test_submit_after_staging_sequential():
+    emr = MagicMock()
+    emr.add_job_flow_steps.return_value = {'StepIds': ['s-COPY', 's-UNZIP', 's-APP1', 's-APP2']}
+    with patch('sparksteps.submit.wait_for_step_complete') as mock_wait:
+        step_ids = submit_after_staging(emr, 'j-CLUSTER', STAGING_STEPS, APP_STEPS)
+
+    assert step_ids == ['s-APP1', 's-APP2']
+    mock_wait.assert_not_called()
+    emr.modify_cluster.assert_not_called()
+
+
+def test_add_steps_in_chunks():
+    emr = MagicMock()
+    emr.add_job_flow_steps.side_effect = lambda JobFlowId, Steps: {'StepIds': [s['Name'] for s in Steps]}
+    steps = [{'Name': 's-{}'.format(i)} for i in range(5)]
+    with patch('sparksteps.submit.poll') as mock_poll:
+        step_ids = add_steps(emr, 'j-CLUSTER', steps, chunk_size=2, max_active_steps=4)
+
+    assert step_ids == ['s-0', 's-1', 's-2', 's-3', 's-4']
+    assert [c[1]['Steps'] for c in emr.add_job_flow_steps.call_args_list] == [steps[0:2], steps[2:4], steps[4:]]
+    # Every chunk but the first waits for room on the cluster.
+    assert [c[1]['args'][2] for c in mock_poll.call_args_list] == [2, 1]
+
+
+def test_add_steps_invalid_chunk_size():
+    with pytest.raises(ValueError):
+        add_steps(MagicMock(), 'j-CLUSTER', [{'Name': 'a'}], chunk_size=300)
+
+
+def test_has_capacity():
+    emr = MagicMock()
+    with patch('sparksteps.submit.list_step_ids') as mock_list:
+        mock_list.side_effect = [['s-OTHER'], ['s-1', 's-2', 's-3']]
+        assert has_capacity(emr, 'j-CLUSTER', 2, ['s-1', 's-2', 's-3'], max_active_steps=5) is True
+        mock_list.side_effect = [[], ['s-1', 's-2', 's-3', 's-4']]
+        assert has_capacity(emr, 'j-CLUSTER', 2, ['s-1', 's-2', 's-3'], max_active_steps=5) is False
+        mock_list.side_effect = [['s-2'], []]
+        with pytest.raises(Exception, match='EMR steps s-2 did not complete'):
+            has_capacity(emr, 'j-CLUSTER', 2, ['s-1', 's-2', 's-3'], max_active_steps=5)
+
+
+def test_submit_after_staging_resume():
+    emr = MagicMock()
+    emr.add_job_flow_steps.return_value = {'StepIds': ['s-APP2']}
+    on_submit = MagicMock()
+    with patch('sparksteps.submit.wait_for_step_complete') as mock_wait:
+        step_ids = submit_after_staging(emr, 'j-CLUSTER', STAGING_STEPS, APP_STEPS, step_concurrency_level=4,
+                                        submitted_step_ids=['s-COPY', 's-UNZIP', 's-APP1'], on_submit=on_submit)
+
+    assert step_ids == ['s-APP1', 's-APP2']
+    emr.add_job_flow_steps.assert_called_once_with(JobFlowId='j-CLUSTER', Steps=APP_STEPS[1:])
+    on_submit.assert_called_once_with(['s-APP2'])
+    mock_wait.assert_called_once_with(emr, 'j-CLUSTER', 's-UNZIP', 15)
+    # The concurrency level was lowered by the previous attempt.
+    emr.describe_cluster.assert_not_called()
+    assert [c[1]['StepConcurrencyLevel'] for c in emr.modify_cluster.call_args_list] == [4]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Test Spark executor tuning."""
+import pytest
+
+from sparksteps.cluster import emr_config
+from sparksteps.tuning import AM_CONTAINER_MB, INSTANCE_TYPES, executor_layout, spark_defaults, ExecutorLayout
+
+
+def test_executor_layout_uses_all_cores():
+    # 16 vCPUs leave 15 cores for three 5 core executors per node, shrunk to fit the application master.
+    layout = executor_layout({INSTANCE_TYPES['r5.4xlarge']: 10})
+    assert layout == ExecutorLayout(cores=5, memory_mb=36964, memory_overhead_mb=3697, instances=30)
+
+
+def test_executor_layout_fits_smallest_node():
+    layout = executor_layout({INSTANCE_TYPES['m5.4xlarge']: 2, INSTANCE_TYPES['m5.xlarge']: 2})
+    # An m5.xlarge offers 3 usable cores and 12288 MB of YARN memory.
+    assert layout.cores == 3
+    assert layout.memory_mb + layout.memory_overhead_mb <= 12288
+    assert layout.instances == 2 * 5 + 2 * 1
+
+
+def test_executor_layout_fits_application_master():
+    # Shrinking executors to fit the application master beats giving up half of them.
+    layout = executor_layout({INSTANCE_TYPES['m5.xlarge']: 2})
+    assert layout.instances == 2
+    assert 12288 - (layout.memory_mb + layout.memory_overhead_mb) >= AM_CONTAINER_MB
+
+    # On large clusters of nodes without spare memory, the application master takes an executor's place.
+    layout = executor_layout({INSTANCE_TYPES['c4.large']: 50})
+    assert (layout.instances, layout.memory_mb + layout.memory_overhead_mb) == (49, 2816)
+
+
+def test_spark_defaults_single_node():
+    conf = spark_defaults(instance_type_master='m4.large', defaults=['spark-defaults',
+                                                                     'spark.dynamicAllocation.enabled=false'])
+    assert conf[0] == 'spark-defaults'
+    assert 'spark.executor.cores=1' in conf
+    assert 'spark.executor.instances=1' in conf
+
+
+def test_spark_defaults_leave_dynamic_allocation_enabled():
+    static = ['spark-defaults', 'spark.dynamicAllocation.enabled=false']
+    assert 'spark.executor.instances=8' in spark_defaults(instance_type_core='m5.2xlarge', num_core=4,
+                                                          defaults=static)
+    # EMR enables dynamic allocation by default, and nodes added by scaling need executors.
+    for kw in ({}, {'managed_scaling_max': 10, 'defaults': static}, {'autoscale_max': 10, 'defaults': static}):
+        conf = spark_defaults(instance_type_core='m5.2xlarge', num_core=4, **kw)
+        assert not [p for p in conf if p.startswith('spark.executor.instances=')]
+
+
+def test_spark_defaults_unknown_instance_type():
+    with pytest.raises(ValueError):
+        spark_defaults(instance_type_core='x1.unknown', num_core=2)
+
+
+def test_emr_config_auto_tune_with_defaults():
+    config = emr_config('emr-5.2.0',
+                        instance_type_master='m4.large',
+                        instance_type_core='m5.2xlarge',
+                        num_core=4,
+                        auto_tune=True,
+                        defaults=['spark-defaults', 'spark.sql.shuffle.partitions=1000',
+                                  'yarn-site', 'yarn.nodemanager.vmem-check-enabled=false'])
+    assert config['Configurations'] == [
+        {'Classification': 'spark-defaults',
+         'Properties': {'spark.executor.cores': '3',
+                        'spark.executor.memory': '10763m',
+                        'spark.executor.memoryOverhead': '1077m',
+                        'spark.default.parallelism': '48',
+                        'spark.sql.shuffle.partitions': '1000'}},
+        {'Classification': 'yarn-site',
+         'Properties': {'yarn.nodemanager.vmem-check-enabled': 'false'}},
+    ]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Test utilization sampling and right-sizing recommendations."""
+import os
+import json
+import shlex
+
+import pytest
+
+from unittest.mock import MagicMock
+
+from sparksteps import __main__
+from sparksteps.utilization import (
+    CloudWatchUtilization, RecordedUtilization, Sample, TimeSeries, UtilizationSampler, recommend
+)
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+TRACE = os.path.join(DIR_PATH, 'data', 'utilization_trace.json')
+# On-demand prices proportional to the size of the instance type.
+PRICES = {'xlarge': 0.192, '2xlarge': 0.384, '4xlarge': 0.768, '8xlarge': 1.536, '12xlarge': 2.304,
+          '16xlarge': 3.072, '24xlarge': 4.608}
+
+
+def price(instance_type):
+    return PRICES[instance_type.split('.')[1]]
+
+
+def sampled_series(samples=None):
+    sampler = UtilizationSampler('j-1', RecordedUtilization(samples) if samples else RecordedUtilization.load(TRACE))
+    while sampler.step() is not None:
+        pass
+    return sampler.series
+
+
+def test_sampler_with_recorded_trace():
+    series = sampled_series()
+    assert len(series) == 10
+    assert series.percentile('memory_pct', 95) == 30
+    assert series.percentile('vcores_pct', 95) == 30
+    assert TimeSeries.from_dict(json.loads(json.dumps(series.to_dict()))).points == series.points
+
+
+def test_recommend_oversized():
+    recommendation = recommend(sampled_series(), price, duration_s=7200,
+                               instance_type_core='m5.2xlarge', num_core=10)
+    assert recommendation.role == 'core'
+    assert (recommendation.recommended_instance_type, recommendation.recommended_num_nodes) == ('m5.xlarge', 9)
+    assert recommendation.hourly_cost_delta == pytest.approx(9 * 0.192 - 10 * 0.384)
+    assert recommendation.run_cost_delta == pytest.approx(2 * recommendation.hourly_cost_delta)
+    assert 'oversized' in recommendation.reason
+
+
+def test_recommend_undersized_task_group():
+    series = sampled_series([Sample(100, 95, 20)] * 5)
+    recommendation = recommend(series, price, instance_type_core='m5.xlarge', num_core=2,
+                               instance_type_task='m5.2xlarge', num_task=4)
+    assert recommendation.role == 'task'
+    assert recommendation.hourly_cost_delta > 0
+    assert recommendation.run_cost_delta is None
+    assert 'undersized' in recommendation.reason
+
+
+def test_recommend_keeps_core_nodes_under_hdfs_pressure():
+    series = sampled_series([Sample(10, 10, 90)] * 5)
+    recommendation = recommend(series, price, instance_type_core='m5.2xlarge', num_core=4)
+    assert (recommendation.recommended_instance_type, recommendation.recommended_num_nodes) == ('m5.2xlarge', 4)
+    assert recommendation.hourly_cost_delta == 0
+
+    assert recommend(TimeSeries(), price, instance_type_core='m5.2xlarge', num_core=4) is None
+
+
+def test_cloudwatch_utilization():
+    client = MagicMock()
+    client.get_metric_data.return_value = {'MetricDataResults': [
+        {'Id': 'memory_available_pct', 'Values': [60.0]}, {'Id': 'hdfs_pct', 'Values': [12.5]}]}
+    assert CloudWatchUtilization(client)('j-1') == Sample(40.0, None, 12.5)
+
+    client.get_metric_data.return_value = {'MetricDataResults': [{'Id': 'memory_available_pct', 'Values': []}]}
+    assert CloudWatchUtilization(client)('j-1') is None
+
+
+def test_report_utilization(tmpdir):
+    out = str(tmpdir.join('utilization.json'))
+    sampler = UtilizationSampler('j-1', RecordedUtilization.load(TRACE))
+    sampler.step()
+    args = {'instance_type_core': 'm5.2xlarge', 'num_core': 10, 'utilization_out': out}
+    recommendations = __main__.report_utilization([sampler], args, price, 3600)
+    # Four m5.xlarge nodes cost as much, the current instance type wins ties.
+    assert (recommendations['j-1'].recommended_instance_type, recommendations['j-1'].recommended_num_nodes) == (
+        'm5.2xlarge', 2)
+    with open(out) as f:
+        assert json.load(f)['j-1']['points']['memory_pct'] == [12]
+
+
+def test_parser_with_sample_utilization():
+    parser = __main__.create_parser()
+    cmd_args_str = ("episodes.py --s3-bucket my-bucket --aws-region us-east-1 --release-label emr-6.2.0 "
+                    "--sample-utilization ")
+    args = __main__.parse_cli_args(parser, args=shlex.split(
+        cmd_args_str + "--wait --num-core 2 --instance-type-core m5.xlarge"))
+    assert args['utilization_source'] == 'cloudwatch'
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--num-core 2 --instance-type-core m5.xlarge"))
+    with pytest.raises(ValueError):
+        __main__.parse_cli_args(parser, args=shlex.split(cmd_args_str + "--wait --cluster-id j-1"))